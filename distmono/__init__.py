@@ -1,7 +1,17 @@
-from distmono.core import (  # noqa
-    Project,
-    Deployable,
-    Stack,
-    Stacker,
-)
 from distmono.exceptions import *  # noqa
+
+core_names = [
+    'Project',
+    'Deployable',
+    'Stack',
+    'Stacker',
+]
+
+
+def __getattr__(name):
+    # Import core lazily, it is slow to import and dmn client doesn't need it
+    if name in core_names:
+        from distmono import core
+        return getattr(core, name)
+
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
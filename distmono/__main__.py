@@ -1,16 +1,45 @@
-from distmono.core import load_project
+from cached_property import cached_property
+from distmono.daemon import Daemon, DaemonClient, run_command
 from pprint import pprint
 import click
+import json
 import subprocess
 
 
+class Cli:
+    def __init__(self, file, use_daemon):
+        self.file = file
+        self.use_daemon = use_daemon
+
+    @cached_property
+    def project(self):
+        from distmono.core import load_project
+        return load_project(self.file)
+
+    @cached_property
+    def daemon_client(self):
+        if not self.use_daemon:
+            return None
+
+        client = DaemonClient.for_project_file(self.file)
+        return client if client.is_running() else None
+
+    def run_command(self, command, **args):
+        if self.daemon_client:
+            return self.daemon_client.call(command, **args)
+
+        return run_command(self.project, command, args)
+
+
 @click.group()
 @click.option('-p', '--project-env', 'file',
               required=True,
               help='Project and env file (e.g. project-env/api.py)')
+@click.option('--daemon/--no-daemon', 'use_daemon', default=True,
+              help='Forward commands to dmn daemon if it is running')
 @click.pass_context
-def cli(ctx, file):
-    ctx.obj = load_project(file)
+def cli(ctx, file, use_daemon):
+    ctx.obj = Cli(file, use_daemon)
 
 
 @cli.command('run', context_settings=dict(
@@ -42,18 +71,110 @@ def cli_run(ctx, command):
 
 
 @cli.command('build')
-@click.argument('target', required=False)
+@click.argument('targets', nargs=-1)
+@click.option('--only', is_flag=True,
+              help='Build only the targets, not their dependencies')
+@click.option('--from', 'start', multiple=True,
+              help='Build only this target and what depends on it')
+@click.option('--resume', is_flag=True,
+              help='Skip targets completed by the previous build')
+@click.option('-k', '--keep-going', is_flag=True,
+              help='Keep building targets not depending on a failed one')
+@click.option('--hotswap', is_flag=True,
+              help='Update Lambda code directly when only code changed')
+@click.option('-j', '--jobs', type=int, help='Number of targets to build in parallel')
+@click.option('-t', '--timeout', type=int, help='Seconds the whole build may take')
 @click.pass_obj
-def cli_build(project, target):
-    output = project.build(target)
+def cli_build(cli, targets, only, start, resume, keep_going, hotswap, jobs, timeout):
+    '''
+    Build targets (names or globs like '*-code') and their dependencies.
+    '''
+    target = targets[0] if len(targets) == 1 else list(targets)
+    output = cli.run_command('build', target=target, only=only, start=list(start),
+                             resume=resume, keep_going=keep_going,
+                             hotswap=hotswap, jobs=jobs, timeout=timeout)
     pprint(output)
 
 
+@cli.command('watch')
+@click.argument('target', required=False)
+@click.option('-i', '--interval', type=float, default=1,
+              help='Seconds between checking for changes')
+@click.pass_obj
+def cli_watch(cli, target, interval):
+    '''
+    Build target, then rebuild whatever depends on changed files.
+    '''
+    cli.project.watch(target, interval=interval)
+
+
 @cli.command('destroy')
 @click.argument('target', required=False)
+@click.option('-j', '--jobs', type=int, help='Number of targets to destroy in parallel')
+@click.option('-t', '--timeout', type=int, help='Seconds the whole destroy may take')
 @click.pass_obj
-def cli_destroy(project, target):
-    project.destroy(target)
+def cli_destroy(cli, target, jobs, timeout):
+    cli.run_command('destroy', target=target, jobs=jobs, timeout=timeout)
+
+
+@cli.command('outputs')
+@click.argument('target', required=False)
+@click.option('-k', '--key', help='Print only this output key')
+@click.option('-f', '--format', 'fmt', type=click.Choice(['pprint', 'json']),
+              default='pprint')
+@click.option('--refresh', is_flag=True, help='Fetch stack outputs from AWS')
+@click.pass_obj
+def cli_outputs(cli, target, key, fmt, refresh):
+    '''
+    Print outputs saved by previous builds.
+    '''
+    output = cli.run_command('outputs', target=target, refresh=refresh)
+
+    if key:
+        try:
+            output = output[key]
+        except (KeyError, TypeError):
+            raise click.ClickException(f'Output key {key!r} not found')
+
+    if fmt == 'json':
+        click.echo(json.dumps(output, indent=2))
+    elif key and isinstance(output, str):
+        click.echo(output)
+    else:
+        pprint(output)
+
+
+@cli.command('gc')
+@click.option('--retention-days', type=float, default=7,
+              help='Keep what was created or used in these many days')
+@click.option('-n', '--dry-run', is_flag=True, help='Only print what would be deleted')
+@click.option('--all-versions', is_flag=True,
+              help='Also delete noncurrent versions in versioned buckets, permanently')
+@click.pass_obj
+def cli_gc(cli, retention_days, dry_run, all_versions):
+    '''
+    Delete artifacts and build directories no longer used.
+    '''
+    counts = cli.run_command('gc', retention=retention_days * 24 * 3600, dry_run=dry_run,
+                             all_versions=all_versions)
+    verb = 'Would delete' if dry_run else 'Deleted'
+    click.echo(f"{verb} {counts['objects']} S3 objects and {counts['dirs']} directories")
+
+
+@cli.command('daemon')
+@click.option('--stop', is_flag=True, help='Stop running daemon')
+@click.pass_obj
+def cli_daemon(cli, stop):
+    '''
+    Keep project loaded, serving build and destroy from other dmn commands.
+    '''
+    if stop:
+        if cli.daemon_client:
+            cli.daemon_client.shutdown()
+
+        return
+
+    Daemon(cli.file).serve()
 
 
 cli(prog_name='dmn')
@@ -0,0 +1,112 @@
+from botocore.exceptions import ClientError
+from cached_property import cached_property
+from distmono.util import BotoHelper
+from pathlib import Path
+from urllib.parse import urlparse
+import attr
+import json
+import os
+
+
+class BuildCache:
+    '''
+    Last build of each target deployed to a namespace, shared between
+    machines, keyed by region/namespace/target.
+
+    An entry has the build hash and the record, which is whatever the target
+    saved in the output store after the build. Restoring the record makes
+    the target up-to-date without building it again.
+    '''
+
+    @classmethod
+    def from_url(cls, url, *, region, boto=None):
+        '''
+        Create cache from "s3://bucket/prefix" or a local directory path.
+        '''
+        parsed = urlparse(url)
+
+        if parsed.scheme == 's3':
+            return S3BuildCache(bucket=parsed.netloc,
+                                prefix=parsed.path.strip('/'),
+                                region=region,
+                                boto=boto)
+
+        if parsed.scheme in ('', 'file'):
+            return LocalBuildCache(cache_dir=parsed.path)
+
+        raise ValueError(f'Unsupported build cache URL {url!r}')
+
+    def get(self, key):
+        raise NotImplementedError
+
+    def put(self, key, record):
+        raise NotImplementedError
+
+    def delete(self, key):
+        raise NotImplementedError
+
+
+@attr.s(kw_only=True)
+class LocalBuildCache(BuildCache):
+    cache_dir = attr.ib(converter=Path)
+
+    def get(self, key):
+        try:
+            return json.loads(self.get_file(key).read_text())
+        except FileNotFoundError:
+            return None
+
+    def put(self, key, record):
+        file = self.get_file(key)
+        file.parent.mkdir(parents=True, exist_ok=True)
+        temp_file = file.with_name(f'.{file.name}.{os.getpid()}')
+        temp_file.write_text(json.dumps(record))
+        temp_file.replace(file)
+
+    def delete(self, key):
+        try:
+            self.get_file(key).unlink()
+        except FileNotFoundError:
+            pass
+
+    def get_file(self, key):
+        return self.cache_dir / f'{key}.json'
+
+
+@attr.s(kw_only=True)
+class S3BuildCache(BuildCache):
+    bucket = attr.ib()
+    prefix = attr.ib(default='')
+    region = attr.ib()
+    boto = attr.ib(default=None)
+
+    def get(self, key):
+        try:
+            resp = self.s3.get_object(Bucket=self.bucket, Key=self.get_key(key))
+        except ClientError as e:
+            if e.response['Error']['Code'] in ('NoSuchKey', '404'):
+                return None
+
+            raise
+
+        return json.loads(resp['Body'].read())
+
+    def put(self, key, record):
+        self.s3.put_object(Bucket=self.bucket,
+                           Key=self.get_key(key),
+                           Body=json.dumps(record).encode('utf8'),
+                           ContentType='application/json')
+
+    def delete(self, key):
+        self.s3.delete_object(Bucket=self.bucket, Key=self.get_key(key))
+
+    def get_key(self, key):
+        if self.prefix:
+            return f'{self.prefix}/{key}.json'
+
+        return f'{key}.json'
+
+    @cached_property
+    def s3(self):
+        boto = self.boto or BotoHelper(region=self.region)
+        return boto.client('s3')
@@ -1,24 +1,49 @@
 from copy import deepcopy
-from cached_property import cached_property
+from botocore.exceptions import ClientError
+from cached_property import cached_property, threaded_cached_property
+from distmono.cache import BuildCache
 from distmono.exceptions import (
+    BuildOutputNotFoundError,
     CircularDependencyError,
     ConfigError,
+    DeploymentCancelledError,
+    StackDoesNotExistError,
 )
-from distmono.util import BotoHelper, sh
+from distmono.hotswap import Hotswap
+from distmono.recovery import StackRecovery
+from distmono.scheduler import CancelToken, Scheduler
+from distmono.store import OutputStore
+from distmono.util import BotoHelper, sh, update_hash
 from marshmallow import Schema, fields, ValidationError
 from pathlib import Path
+import asyncio
 import attr
+import contextlib
+import fnmatch
 import hashlib
+import importlib
+import inspect
+import json
 import networkx as nx
+import os
+import re
 import runpy
 import shutil
+import sys
+import threading
+import time
 import yaml
 
 
 class Project:
     def __init__(self, *, project_dir, env):
         self.project_dir = Path(project_dir).resolve()
+        self.project_file = None  # set by load_project()
         self.env = env
+        self.output_stores = {}
+        self.output_stores_lock = threading.Lock()
+        self.deployable_classes = {}  # by dotted path
+        self.deployable_classes_lock = threading.Lock()
 
     @property
     def env(self):
@@ -35,40 +60,194 @@ class Project:
             raise ValueError(f'Invalid project env: {e}')
 
     def get_deployables(self):
+        '''
+        Deployable classes by target. A class can be given by its dotted
+        path, e.g. 'sample_projects.api:ApiStack', so that its module is
+        only imported when the target is deployed.
+        '''
         raise NotImplementedError
 
+    def load_deployable_cls(self, dpl_cls):
+        '''
+        Deployable class, imported on first use if given by dotted path.
+        '''
+        if not isinstance(dpl_cls, str):
+            return dpl_cls
+
+        with self.deployable_classes_lock:
+            if dpl_cls not in self.deployable_classes:
+                self.deployable_classes[dpl_cls] = import_deployable_cls(dpl_cls)
+
+            return self.deployable_classes[dpl_cls]
+
     def get_dependencies(self):
         raise NotImplementedError
 
     def get_default_build_target(self):
         raise NotImplementedError
 
+    def get_stack_groups(self):
+        '''
+        Stacks to deploy together as nested stacks of one parent stack, e.g.
+        {'base-stack': ['buckets-stack', 'access-stack']}. A group replaces
+        its stacks in the graph, which must not depend on each other.
+        Requires env template_bucket.
+
+        Nested stacks get generated names, templates of grouped stacks must
+        not derive resource names from AWS::StackName. Grouping creates new
+        stacks, destroy the stacks being grouped first, they can't be
+        destroyed by target once grouped.
+        '''
+        return {}
+
+    def get_jobs(self):
+        '''
+        Number of targets to build or destroy in parallel.
+        '''
+        return self.env.get('jobs', 1)
+
+    def get_resource_limits(self):
+        '''
+        Capacity of resources used by deployables (see Deployable.resources),
+        resources without limit are unlimited.
+        '''
+        limits = {
+            'cfn_slots': 4,
+            'cpu': os.cpu_count() or 1,
+        }
+        limits.update(self.env.get('resource_limits', {}))
+        return limits
+
+    def get_build_cache(self):
+        url = self.env.get('build_cache')
+
+        if not url:
+            return None
+
+        return BuildCache.from_url(url, region=self.env['region'],
+                                   boto=BotoHelper.from_env(self.env))
+
+    @threaded_cached_property
+    def template_renderer(self):
+        '''
+        Renderer of stack templates in env render_jobs processes, None if
+        not enabled.
+        '''
+        from distmono.render import TemplateRenderer
+
+        render_jobs = self.env.get('render_jobs')
+
+        if not render_jobs:
+            return None
+
+        return TemplateRenderer(project_file=self.project_file, max_workers=render_jobs)
+
     @cached_property
     def temp_dir(self):
         return Path(self.project_dir) / 'tmp'
 
-    def build(self, target=None):
+    def get_namespace_dir(self):
+        return self.temp_dir / 'namespace' / self.env['namespace']
+
+    def get_output_store(self):
+        namespace = self.env['namespace']
+
+        with self.output_stores_lock:
+            store = self.output_stores.get(namespace)
+
+            if not store:
+                ns_dir = self.get_namespace_dir()
+                store = OutputStore(ns_dir / 'outputs.db')
+                store.migrate(ns_dir / 'build-output')
+                self.output_stores[namespace] = store
+
+        return store
+
+    def build(self, target=None, *, jobs=None, only=False, start=None,
+              resume=False, keep_going=False, timeout=None):
+        '''
+        Build target and its dependencies, return its build output. Target
+        can also be a glob (e.g. '*-code') or a list of targets, outputs are
+        then returned by target. See DeploymentGraph.select() for only and
+        start.
+
+        With resume, targets completed by the previous build with the same
+        input are not built again. With keep_going, targets not depending on
+        a failed target are still built. Timeout in seconds is for the
+        whole build, see also Deployable.timeout.
+        '''
         if not target:
             target = self.get_default_build_target()
 
-        return Builder(self, target).build()
+        builder = Builder(self, target, jobs=jobs, only=only, start=start,
+                          resume=resume, keep_going=keep_going, timeout=timeout)
+        return builder.build()
 
     def clear_build_output(self, target):
         self.clear_build_outputs([target])
 
     def clear_build_outputs(self, targets):
-        pass  # TODO
+        store = self.get_output_store()
+        store.delete(*targets)
+        store.clear_journal(*targets)
+
+    def destroy(self, target=None, *, jobs=None, timeout=None):
+        Destroyer(self, target, jobs=jobs, timeout=timeout).destroy()
+
+    def gc(self, *, retention=7 * 24 * 3600, dry_run=False, all_versions=False):
+        '''
+        Delete artifacts and directories no longer used by builds and older
+        than retention seconds, see GarbageCollector.
+        '''
+        from distmono.garbage import GarbageCollector
+        return GarbageCollector(project=self, retention=retention, dry_run=dry_run,
+                                all_versions=all_versions).collect()
+
+    def get_outputs(self, target=None, *, refresh=False):
+        return OutputReader(self, target).read(refresh=refresh)
+
+    def watch(self, target=None, *, interval=1):
+        if not target:
+            target = self.get_default_build_target()
 
-    def destroy(self, target=None):
-        Destroyer(self, target).destroy()
+        Watcher(self, target).watch(interval=interval)
 
 
 class EnvSchema(Schema):
     namespace = fields.Str(required=True)
     region = fields.Str(required=True)
+    build_cache = fields.Str()  # local dir or s3://bucket/prefix
+    template_bucket = fields.Str()  # for nested stack templates of stack groups
+    hotswap = fields.Bool()  # update Lambda code directly if possible
+    check_drift = fields.Bool()  # compare stacks with live state, default true
+    profile = fields.Str()  # AWS profile, default from environment
+    role_arn = fields.Str()  # role to assume, credentials are cached on disk
+    jobs = fields.Int()
+    render_jobs = fields.Int()  # processes rendering stack templates, default none
+    timeout = fields.Int()  # seconds for a whole build or destroy
+    target_timeout = fields.Int()  # seconds for each target by default
+    resource_limits = fields.Dict(keys=fields.Str(), values=fields.Int())
 
 
 class Deployable:
+    '''
+    Something to build or destroy, build() and destroy() can also be
+    coroutine functions, each call then runs in its own event loop.
+    '''
+
+    # What building or destroying uses, e.g. {'cfn_slots': 1}, parallel
+    # builds are limited by Project.get_resource_limits()
+    resources = {}
+
+    # Seconds building or destroying may take, overrides env target_timeout.
+    # Long running steps should poll context.cancel_token.
+    timeout = None
+
+    # Whether building and destroying only use paths from the context, not
+    # the working directory. Other deployables run in context.work_dir, one
+    # at a time when running more than one job.
+    parallel_safe = False
+
     def __init__(self, context):
         self.context = context
 
@@ -81,52 +260,502 @@ class Deployable:
     def is_build_outdated(self):
         return True
 
+    def get_build_hash(self):
+        '''
+        Hash of everything the build depends on, None if unknown. The last
+        build deployed to a namespace is shared through project build cache,
+        it is restored instead of building again if its hash is the same.
+        '''
+        return None
+
     def destroy(self):
         pass
 
+    def get_artifact_prefixes(self):
+        '''
+        (bucket, key prefix) of S3 locations the build owns and puts its
+        artifacts in, e.g. [(bucket, 'function-code/')]. Objects there no
+        longer used by any build are deleted by dmn gc.
+        '''
+        return []
+
+    def get_watch_paths(self):
+        '''
+        Files or directories the build is made from, watch mode rebuilds the
+        target when they change.
+        '''
+        return []
+
+    def load_output(self, name, default=None):
+        ctx = self.context
+        return ctx.output_store.get(ctx.target, name, default)
+
+    def require_output(self, name):
+        value = self.load_output(name)
+
+        if value is None:
+            target = self.context.target
+            msg = f'Build output {name!r} of {target!r} not found, please build it first'
+            raise BuildOutputNotFoundError(msg)
+
+        return value
+
+    def save_output(self, **values):
+        ctx = self.context
+        ctx.output_store.update(ctx.target, values)
+
 
 class Deployer:
-    def __init__(self, project, target):
+    def __init__(self, project, target, *, jobs=None, timeout=None):
         self.project = project
         self.target = target
+        self.jobs = jobs or project.get_jobs()
+        self.timeout = timeout or project.env.get('timeout')
+        self.work_dir_lock = threading.Lock()
+
+    @cached_property
+    def cancel_token(self):
+        return CancelToken(self.timeout)
+
+    def get_cancel_token(self, target):
+        timeout = self.get_deployable_cls(target).timeout
+        timeout = timeout or self.project.env.get('target_timeout')
+        return self.cancel_token.child(timeout)
+
+    @cached_property
+    def scheduler(self):
+        return Scheduler(jobs=self.jobs, limits=self.project.get_resource_limits())
+
+    @threaded_cached_property
+    def build_cache(self):
+        return self.project.get_build_cache()
+
+    def get_cache_key(self, target):
+        '''
+        Key of the last build of target deployed to the namespace, None if
+        there is no build cache.
+        '''
+        if not self.build_cache:
+            return None
+
+        env = self.project.env
+        return f"{env['region']}/{env['namespace']}/{target}"
+
+    def get_resources(self, target):
+        return self.get_deployable_cls(target).resources
+
+    @contextlib.contextmanager
+    def work_in(self, dpl, work_dir):
+        '''
+        Change into work_dir of deployable. The working directory is shared
+        by all threads, so when running more than one job, only deployables
+        that aren't parallel safe change into it, one at a time.
+        '''
+        if self.jobs > 1 and dpl.parallel_safe:
+            yield
+            return
+
+        with self.work_dir_lock:
+            with sh.chdir(work_dir):
+                yield
+
+    @cached_property
+    def stack_groups(self):
+        return {g: list(members) for g, members in self.project.get_stack_groups().items()}
+
+    @cached_property
+    def group_of(self):
+        return {m: g for g, members in self.stack_groups.items() for m in members}
+
+    @cached_property
+    def dependencies(self):
+        '''
+        Dependencies of targets as lists, before grouping stacks.
+        '''
+        dependencies = {}
+
+        for a, b in self.project.get_dependencies().items():
+            dependencies[a] = list(b) if isinstance(b, (list, tuple)) else [b]
+
+        return dependencies
 
     @cached_property
     def deployables(self):
-        return self.project.get_deployables()
+        deployables = dict(self.project.get_deployables())
+
+        for group, members in self.stack_groups.items():
+            if group in deployables:
+                raise ConfigError(f'Stack group {group!r} has the name of a target')
+
+            member_classes = {}
+
+            for member in members:
+                dpl_cls = self.project.load_deployable_cls(deployables.pop(member, None))
+
+                if not (isinstance(dpl_cls, type) and issubclass(dpl_cls, Stack)):
+                    msg = f'Stack group {group!r} member {member!r} is not a Stack target'
+                    raise ConfigError(msg)
+
+                overridden = [name for name in StackGroup.member_unsupported
+                              if getattr(dpl_cls, name) is not getattr(Stack, name)]
+
+                if overridden:
+                    msg = (f'Stack group {group!r} member {member!r} overrides'
+                           f' {", ".join(overridden)}, which grouped stacks do not support')
+                    raise ConfigError(msg)
+
+                member_classes[member] = dpl_cls
+
+            logical_ids = {m: StackGroup.get_logical_id(m) for m in members}
+
+            for a in members:
+                for b in members:
+                    if a != b and logical_ids[b].startswith(logical_ids[a]):
+                        msg = (f'Stack group {group!r} members {a!r} and {b!r} have'
+                               f' conflicting logical IDs {logical_ids[a]!r} and'
+                               f' {logical_ids[b]!r}')
+                        raise ConfigError(msg)
+
+            member_dependencies = {m: self.dependencies.get(m, []) for m in members}
+            deployables[group] = StackGroup.create_class(member_classes, member_dependencies)
+
+        return deployables
 
     def get_deployable_cls(self, target):
-        return self.deployables[target]
+        return self.project.load_deployable_cls(self.deployables[target])
+
+    def resolve_target(self, target):
+        '''
+        Target building or destroying target, its stack group if grouped.
+        '''
+        return self.group_of.get(target, target)
+
+    def get_input(self, target, get_output):
+        '''
+        Input of target, get_output(successor) returns build output of a
+        successor. Outputs of grouped stacks are given by stack target, as
+        if they weren't grouped.
+        '''
+        if target in self.stack_groups:
+            names = []
+
+            for member in self.stack_groups[target]:
+                names.extend(d for d in self.dependencies.get(member, []) if d not in names)
+        else:
+            names = self.dependencies.get(target, [])
+
+        input = {}
+
+        for name in names:
+            group = self.group_of.get(name)
+            input[name] = get_output(group)[name] if group else get_output(name)
+
+        return input
+
+    def create_deployable(self, target, input, work_dir):
+        ctx = Context.create(self.project, target, input)
+        ctx.work_dir = getattr(ctx, work_dir)
+        ctx.cancel_token = self.get_cancel_token(target)
+        dpl_cls = self.get_deployable_cls(target)
+        return dpl_cls(ctx)
 
     @cached_property
     def graph(self):
         nodes = list(self.deployables.keys())
-        edges = self.project.get_dependencies()
+        edges = {}
+
+        for a, bs in self.dependencies.items():
+            a = self.resolve_target(a)
+
+            for b in bs:
+                b = self.resolve_target(b)
+
+                if a == b and a in self.stack_groups:
+                    raise ConfigError(f'Stacks in stack group {a!r} depend on each other')
+
+                successors = edges.setdefault(a, [])
+
+                if b not in successors:
+                    successors.append(b)
+
         return DeploymentGraph(nodes, edges)
 
+    def call(self, func, cancel_token):
+        '''
+        Call func, coroutine function is cancelled with cancel token.
+        '''
+        cancel_token.check()
+
+        if inspect.iscoroutinefunction(func):
+            return asyncio.run(sh.watch_cancel(func(), cancel_token))
+
+        return func()
+
+    def get_successor_outputs(self, target):
+        return self.get_input(target, self.get_build_output)
+
+    def get_build_output(self, target):
+        '''
+        Build output of target without building it, the saved one if any.
+        '''
+        store = self.project.get_output_store()
+        store.refresh(target)
+        output = store.get(target, 'build_output')
+
+        if output is not None:
+            return output
+
+        input = self.get_successor_outputs(target)
+
+        with self.lock(target):
+            dpl = self.create_deployable(target, input, 'build_dir')
+
+            try:
+                return dpl.get_build_output()
+            except Exception:
+                raise  # TODO: rethrow with friendlier message
+
+    def lock(self, target):
+        '''
+        Serialize work on target with other dmn processes, outputs written by
+        them are reloaded once the lock is acquired.
+        '''
+        lock_file = self.project.get_namespace_dir() / 'lock' / f'{target}.lock'
+        lock = sh.lock(lock_file, name=repr(target))
+
+        class LockContext:
+            def __enter__(ctx):
+                lock.__enter__()
+
+                try:
+                    self.project.get_output_store().refresh(target)
+                except BaseException:
+                    lock.__exit__(*sys.exc_info())
+                    raise
+
+            def __exit__(ctx, exc_type, exc_val, exc_tb):
+                return lock.__exit__(exc_type, exc_val, exc_tb)
+
+        return LockContext()
+
 
 class Builder(Deployer):
+    def __init__(self, project, target, *, jobs=None, only=False, start=None,
+                 resume=False, keep_going=False, timeout=None):
+        super().__init__(project, target, jobs=jobs, timeout=timeout)
+        self.only = only
+        self.start_targets = start
+        self.resume = resume
+        self.keep_going = keep_going
+
+    @threaded_cached_property
+    def stack_probe(self):
+        env = self.project.env
+
+        if not env.get('check_drift', True):
+            return None
+
+        return StackProbe(boto=BotoHelper.from_env(env))
+
+    def create_deployable(self, target, input, work_dir='build_dir'):
+        dpl = super().create_deployable(target, input, work_dir)
+        ctx = dpl.context
+        ctx.stack_probe = self.stack_probe
+        rendering = self.rendered_templates.get(target)
+
+        # Template rendered ahead in a renderer process, see render_template()
+        if rendering and rendering[0] == input:
+            try:
+                ctx.rendered_template = rendering[1].result()
+            except Exception as e:
+                # Rendered by the build instead, e.g. if the project can't
+                # be loaded in a worker
+                sh.print(f'{target}: unable to render template in a worker: {e!r}', error=True)
+                self.rendered_templates.pop(target, None)
+
+        return dpl
+
+    @cached_property
+    def rendered_templates(self):
+        '''
+        Input and future of templates being rendered, by target.
+        '''
+        return {}
+
+    def render_template(self, target, input):
+        '''
+        Start rendering template of stack target in a renderer process, if
+        enabled. Templates of all stacks ready to be built are rendered at
+        the same time, before their builds start. Stack groups are made of
+        the templates of their stacks.
+        '''
+        renderer = self.project.template_renderer
+        dpl_cls = self.get_deployable_cls(target)
+
+        if not renderer or not (isinstance(dpl_cls, type) and issubclass(dpl_cls, Stack)) \
+                or issubclass(dpl_cls, StackGroup):
+            return
+
+        future = renderer.render(target, self.project.env, input)
+
+        if future:
+            self.rendered_templates[target] = (input, future)
+
     def build(self):
+        graph = self.graph
+        targets = [self.target] if isinstance(self.target, str) else self.target
+        targets = [self.resolve_target(t) for t in targets]
+        start = self.start_targets
+
+        if start:
+            start = [self.resolve_target(t) for t in ([start] if isinstance(start, str) else start)]
+
+        selected = graph.select(targets, only=self.only, start=start)
+
+        if not selected:
+            sh.print('Nothing to build')
+
+        if not self.resume:
+            self.project.get_output_store().clear_journal(*selected)
+
         builds = {}
-        return self.build_successors_first(self.target, builds)
+        self.build_targets(selected, builds)
+
+        if isinstance(self.target, str) and not graph.is_pattern(self.target) \
+                and not self.start_targets:
+            group = self.group_of.get(self.target)
+            return builds[group][self.target] if group else builds[self.target]
+
+        return {t: builds[t] for t in selected}
 
     def build_successors_first(self, target, builds):
-        input = {}
+        '''
+        Build target after its dependencies, targets already in builds are
+        not built again. Outputs are added to builds.
+        '''
+        target = self.resolve_target(target)
+        self.build_targets(self.graph.successors_first(target), builds)
+        return builds[target]
 
-        for successor in self.graph.successors(target):
-            output = self.build_successors_first(successor, builds)
-            input[successor] = output
+    def build_targets(self, targets, builds):
+        '''
+        Build targets, dependencies first, skipping those already in builds.
+        Dependencies not in targets aren't built, their saved outputs are
+        used instead.
+        '''
+        graph = self.graph
+        targets = [t for t in targets if t not in builds]
+        selected = set(targets)
+        dependencies = {t: [s for s in graph.successors(t) if s in selected]
+                        for t in targets}
 
-        if target not in builds:
-            builds[target] = self.build_target_only(target, input)
+        def get_output(successor):
+            if successor in selected or successor in builds:
+                return builds[successor]
 
-        return builds[target]
+            return self.get_build_output(successor)
+
+        def build(target):
+            input = self.get_input(target, get_output)
+            return self.build_target_only(target, input)
+
+        def render(target):
+            try:
+                input = self.get_input(target, get_output)
+            except Exception:
+                return  # raised again by build()
+
+            self.render_template(target, input)
+
+        try:
+            self.scheduler.run(targets, dependencies, build,
+                               resources=self.get_resources,
+                               results=builds,
+                               keep_going=self.keep_going,
+                               cancel=self.cancel_token,
+                               on_ready=render)
+        finally:
+            self.stop_rendering()
+
+    def stop_rendering(self):
+        '''
+        Cancel templates still waiting to be rendered. Renderer processes
+        are kept for the next build, with the project loaded.
+        '''
+        for _, future in self.rendered_templates.values():
+            future.cancel()
+
+        self.rendered_templates.clear()
 
     def build_target_only(self, target, input):
-        ctx = Context.create(self.project, target, input)
-        dpl_cls = self.get_deployable_cls(target)
-        dpl = dpl_cls(ctx)
+        '''
+        Build target and record the result in the journal, or return output
+        recorded by the previous build when resuming.
+        '''
+        store = self.project.get_output_store()
+        input_hash = self.hash_input(input)
+
+        if self.resume:
+            entry = self.get_done_entry(target, input)
+
+            if entry:
+                sh.print(f'{target}: done in previous build')
+                return entry['output']
+
+        try:
+            with self.lock(target):
+                output, build_hash = self.build_target_locked(target, input)
+        except (DeploymentCancelledError, KeyboardInterrupt) as e:
+            sh.print(f'{target}: build interrupted', error=True)
+            store.update_journal(target, 'interrupted', input_hash=input_hash,
+                                 error=repr(e))
+            raise
+        except Exception as e:
+            sh.print(f'{target}: build failed: {e}', error=True)
+            store.update_journal(target, 'failed', input_hash=input_hash, error=repr(e))
+            raise
+
+        if self.is_serializable(output):
+            store.update_journal(target, 'done', input_hash=self.hash_input(input, build_hash),
+                                 output=output)
+        else:
+            store.clear_journal(target)  # built again when resuming
+
+        return output
+
+    def get_done_entry(self, target, input):
+        '''
+        Journal entry of target if the previous build built it from the same
+        input and build hash, None otherwise.
+        '''
+        entry = self.project.get_output_store().get_journal(target)
+
+        if not entry or entry['status'] != 'done':
+            return None
+
+        with self.lock(target):
+            dpl = self.create_deployable(target, input)
+
+            with self.work_in(dpl, dpl.context.build_dir):
+                build_hash = dpl.get_build_hash()
+
+        if entry['input_hash'] != self.hash_input(input, build_hash):
+            return None
+
+        return entry
+
+    def hash_input(self, input, build_hash=None):
+        data = json.dumps([input, build_hash], sort_keys=True, default=str)
+        return hashlib.sha256(data.encode('utf8')).hexdigest()
+
+    def build_target_locked(self, target, input):
+        '''
+        Build target if it is outdated, return its output and build hash.
+        '''
+        dpl = self.create_deployable(target, input)
+        ctx = dpl.context
 
-        with sh.chdir(ctx.build_dir):
+        with self.work_in(dpl, ctx.build_dir):
             if dpl.is_build_outdated():
                 build = True
                 sh.print(f'{target}: build outdated')
@@ -134,96 +763,324 @@ class Builder(Deployer):
                 build = False
                 sh.print(f'{target}: up-to-date')
 
-            # TODO
-            # skip = self.is_target_skipped(target)
-            # if skip:
-            #     sh.print(f'{target}: skipped')
-            #     build = False
+            if build and self.restore_from_cache(target, dpl):
+                build = False
+                sh.print(f'{target}: restored from build cache')
 
             if build:
-                dpl.build()
+                self.call(dpl.build, ctx.cancel_token)
+                self.save_to_cache(target, dpl)
 
-        # TODO: catch error, report error, taking 'skip' into account
         output = dpl.get_build_output()
         # TODO: validate/filter
-        return output
+
+        if not self.is_serializable(output):
+            sh.print(f'{target}: build output is not JSON serializable, not saved')
+        elif output != ctx.output_store.get(target, 'build_output'):
+            ctx.output_store.update(target, {'build_output': output})
+
+        prefixes = [list(p) for p in dpl.get_artifact_prefixes()]
+
+        if prefixes != ctx.output_store.get(target, 'artifact_prefixes', []):
+            ctx.output_store.update(target, {'artifact_prefixes': prefixes})
+
+        with self.work_in(dpl, ctx.build_dir):
+            build_hash = dpl.get_build_hash()
+
+        return output, build_hash
+
+    def is_serializable(self, output):
+        try:
+            json.dumps(output)
+        except (TypeError, ValueError):
+            return False
+
+        return True
+
+    def restore_from_cache(self, target, dpl):
+        '''
+        Restore the last build deployed to the namespace if it has the same
+        build hash and, for stacks, matches the live stack.
+        '''
+        key = self.get_cache_key(target)
+        build_hash = key and dpl.get_build_hash()
+
+        if not build_hash:
+            return False
+
+        cached = self.build_cache.get(key)
+
+        if not cached or cached['build_hash'] != build_hash:
+            return False
+
+        store = dpl.context.output_store
+        previous = store.get_target(target)
+        store.update(target, cached['record'])
+
+        # Another machine might have deployed or destroyed it since
+        if isinstance(dpl, Stack) and dpl.is_build_outdated():
+            store.delete(target)
+
+            if previous:
+                store.update(target, previous)
+
+            return False
+
+        return True
+
+    def save_to_cache(self, target, dpl):
+        key = self.get_cache_key(target)
+        build_hash = key and dpl.get_build_hash()
+
+        if not build_hash:
+            return
+
+        record = dpl.context.output_store.get_target(target)
+
+        if record:
+            self.build_cache.put(key, {'build_hash': build_hash, 'record': record})
+
+
+class Watcher(Builder):
+    '''
+    Build target, then rebuild whatever depends on changed files without
+    reloading the project.
+    '''
+
+    def start(self):
+        self.builds = {}
+        self.watch_paths = {}
+        self.rebuild([])
+
+    def create_deployable(self, target, input, work_dir='build_dir'):
+        dpl = super().create_deployable(target, input, work_dir)
+        self.watch_paths[target] = [Path(p).resolve() for p in dpl.get_watch_paths()]
+        return dpl
+
+    def rebuild(self, targets):
+        self.__dict__.pop('stack_probe', None)
+        self.__dict__.pop('cancel_token', None)
+
+        for target in targets:
+            for dependent in [target] + self.graph.dependents(target):
+                self.builds.pop(dependent, None)
+
+        try:
+            self.build_successors_first(self.target, self.builds)
+        except Exception as e:
+            sh.print(f'Build failed: {e}', error=True)
+
+        self.snapshot = self.take_snapshot()
+
+    def take_snapshot(self):
+        paths = [p for paths in self.watch_paths.values() for p in paths]
+        return sh.snapshot_files(paths)
+
+    def poll(self):
+        '''
+        Rebuild targets affected by files changed since last build, return
+        them.
+        '''
+        changed = sh.diff_snapshots(self.snapshot, self.take_snapshot())
+        targets = []
+
+        for target, paths in self.watch_paths.items():
+            if any(p == f or p in f.parents for p in paths for f in changed):
+                targets.append(target)
+
+        if targets:
+            sh.print(f'Changed: {", ".join(targets)}')
+            self.rebuild(targets)
+
+        return targets
+
+    def watch(self, *, interval=1):
+        self.start()
+        sh.print('Watching for changes, press Ctrl-C to stop')
+
+        try:
+            while True:
+                time.sleep(interval)
+                self.poll()
+        except KeyboardInterrupt:
+            pass
+
+
+class OutputReader(Deployer):
+    '''
+    Read build outputs saved by previous builds without creating deployables.
+    Outputs of stacks that are not saved are fetched with one batched
+    DescribeStacks.
+    '''
+
+    def read(self, *, refresh=False):
+        target = self.target and self.resolve_target(self.target)
+        targets = [target] if target else self.graph.nodes
+        store = self.project.get_output_store()
+        outputs = {}
+        stale = []
+
+        for target in targets:
+            self.graph.validate_node(target)
+            output = None if refresh else store.get(target, 'build_output')
+
+            if output is None:
+                stale.append(target)
+            else:
+                outputs[target] = output
+
+        if stale:
+            outputs.update(self.fetch_stack_outputs(stale))
+
+        if not self.target:
+            # Outputs of grouped stacks by stack target, as if they weren't
+            # grouped
+            expanded = {}
+
+            for target, output in outputs.items():
+                if target in self.stack_groups:
+                    expanded.update(output)
+                else:
+                    expanded[target] = output
+
+            return expanded
+
+        if target not in outputs:
+            msg = f'Build output of {self.target!r} not found, please build it first'
+            raise BuildOutputNotFoundError(msg)
+
+        if target != self.target:
+            return outputs[target][self.target]
+
+        return outputs[target]
+
+    def fetch_stack_outputs(self, targets):
+        store = self.project.get_output_store()
+        stacks = {}
+
+        for target in targets:
+            dpl_cls = self.get_deployable_cls(target)
+
+            if not issubclass(dpl_cls, Stack):
+                continue
+
+            dpl = dpl_cls(self.create_reader_context(target))
+
+            try:
+                stack_name = dpl.get_stack_name()
+            except (AttributeError, KeyError):
+                continue  # abstract stack, or its name depends on input
+
+            stacks[stack_name] = dpl
+
+        if not stacks:
+            return {}
+
+        boto = BotoHelper.from_env(self.project.env)
+        outputs = {}
+
+        for stack in boto.describe_stacks():
+            dpl = stacks.get(stack['StackName'])
+
+            if not dpl:
+                continue
+
+            target = dpl.context.target
+            store.update(target, {'stack_outputs': boto.get_outputs(stack)})
+            output = dpl.get_build_output()
+            store.update(target, {'build_output': output})
+            outputs[target] = output
+
+        return outputs
+
+    def create_reader_context(self, target):
+        '''
+        Context to get stack name and build output with, without creating
+        target directories.
+        '''
+        return Context(
+            project=self.project,
+            target=target,
+            env=deepcopy(self.project.env),
+            build_dir=None,
+            build_output_dir=None,
+            destroy_dir=None,
+            output_store=self.project.get_output_store(),
+        )
 
 
 class Destroyer(Deployer):
     def destroy(self):
         if self.target:
-            self.destroyed = set()
-            self.destroy_predecessors_first(self.target)
+            self.destroy_predecessors_first(self.resolve_target(self.target))
         else:
             self.destroy_all()
 
     def destroy_predecessors_first(self, target):
-        predecessors = self.graph.predecessors(target)
-
-        for predecessor in predecessors:
-            self.destroy_predecessors_first(predecessor)
-
-        if target not in self.destroyed:
-            self.destroy_one(target)
-            self.destroyed.add(target)
+        self.destroy_targets(self.graph.predecessors_first(target))
 
     def destroy_all(self):
-        for target in self.graph.sort():
-            self.destroy_one(target)
+        self.destroy_targets(self.graph.sort())
+
+    def destroy_targets(self, targets):
+        dependencies = {t: self.graph.predecessors(t) for t in targets}
+        self.scheduler.run(targets, dependencies, self.destroy_one,
+                           resources=self.get_resources,
+                           cancel=self.cancel_token)
 
     def destroy_one(self, target):
         input = self.get_successor_outputs(target)
-        ctx = Context.create(self.project, target, input)
-        dpl_cls = self.get_deployable_cls(target)
-        dpl = dpl_cls(ctx)
 
-        with sh.chdir(ctx.destroy_dir):
-            dpl.destroy()
+        with self.lock(target):
+            self.destroy_one_locked(target, input)
+
+    def destroy_one_locked(self, target, input):
+        dpl = self.create_deployable(target, input, 'destroy_dir')
+        ctx = dpl.context
+
+        with self.work_in(dpl, ctx.destroy_dir):
+            self.call(dpl.destroy, ctx.cancel_token)
 
             # TODO: sh.remove()
             if ctx.build_output_dir.exists():
                 shutil.rmtree(ctx.build_output_dir)
 
-    def get_successor_outputs(self, target):
-        outputs = {}
-
-        for successor in self.graph.successors(target):
-            outputs[successor] = self.get_build_output(successor)
+            ctx.output_store.delete(target)
+            ctx.output_store.clear_journal(target)
+            key = self.get_cache_key(target)
 
-        return outputs
-
-    def get_build_output(self, target):
-        input = self.get_successor_outputs(target)
-        ctx = Context.create(self.project, target, input)
-        dpl_cls = self.get_deployable_cls(target)
-        dpl = dpl_cls(ctx)
-
-        try:
-            return dpl.get_build_output()
-        except Exception:
-            raise  # TODO: rethrow with friendlier message
+            if key:
+                self.build_cache.delete(key)
 
 
 @attr.s(kw_only=True)
 class Context:
     project = attr.ib()
+    target = attr.ib()
     env = attr.ib()
     input = attr.ib(default=attr.Factory(dict))
     build_dir = attr.ib()
     build_output_dir = attr.ib()
     destroy_dir = attr.ib()
+    output_store = attr.ib()
+    stack_probe = attr.ib(default=None)
+    work_dir = attr.ib(default=None)  # build_dir or destroy_dir
+    cancel_token = attr.ib(default=None)
+    rendered_template = attr.ib(default=None)  # {'body', 'data'} of Stack
 
     @classmethod
     def create(cls, project, target, input):
         env = deepcopy(project.env)
-        tdir = project.temp_dir / 'namespace' / env['namespace']
+        tdir = project.get_namespace_dir()
         return Context(
             project=project,
+            target=target,
             env=env,
             input=input,
             build_dir=cls.mkdir(tdir / 'build' / target, clear=True),
             build_output_dir=cls.mkdir(tdir / 'build-output' / target),
             destroy_dir=cls.mkdir(tdir / 'destroy' / target, clear=True),
+            output_store=project.get_output_store(),
         )
 
     @classmethod
@@ -238,6 +1095,23 @@ class Context:
         return d
 
 
+class StackProbe:
+    '''
+    Live state of all stacks in a region, fetched on first use with as few
+    DescribeStacks calls as possible.
+    '''
+
+    def __init__(self, *, boto):
+        self.boto = boto
+
+    @threaded_cached_property
+    def stacks(self):
+        return {s['StackName']: s for s in self.boto.describe_stacks()}
+
+    def get(self, stack_name):
+        return self.stacks.get(stack_name)
+
+
 class DeploymentGraph:
     def __init__(self, nodes, edges):
         g = nx.DiGraph()
@@ -291,9 +1165,84 @@ class DeploymentGraph:
         self.validate_node(node)
         return list(self.graph.predecessors(node))
 
+    def successors_first(self, node):
+        '''
+        Node and everything it depends on, dependencies first.
+        '''
+        self.validate_node(node)
+        return list(nx.dfs_postorder_nodes(self.graph, node))
+
+    def predecessors_first(self, node):
+        '''
+        Node and everything depending on it, dependents first.
+        '''
+        self.validate_node(node)
+        return list(nx.dfs_postorder_nodes(self.graph.reverse(copy=False), node))
+
+    def dependents(self, node):
+        '''
+        All nodes that depend on node, directly or indirectly.
+        '''
+        self.validate_node(node)
+        return list(nx.ancestors(self.graph, node))
+
     def sort(self):
         return list(nx.topological_sort(self.graph))
 
+    @staticmethod
+    def is_pattern(target):
+        return any(c in target for c in '*?[')
+
+    def match(self, patterns):
+        '''
+        Nodes named by patterns, which can be globs (e.g. '*-code').
+        '''
+        nodes = []
+
+        for pattern in patterns:
+            if self.is_pattern(pattern):
+                matched = [n for n in self.node_list if fnmatch.fnmatchcase(n, pattern)]
+
+                if not matched:
+                    raise ValueError(f'No target matches {pattern!r}')
+            else:
+                self.validate_node(pattern)
+                matched = [pattern]
+
+            nodes.extend(n for n in matched if n not in nodes)
+
+        return nodes
+
+    def select(self, targets, *, only=False, start=None):
+        '''
+        Nodes to build for targets (see match()), dependencies first.
+        Dependencies of targets are included unless only is true, start
+        limits them to start nodes and nodes depending on them.
+        '''
+        targets = self.match(targets)
+        # Postorder of the whole closure keeps dependencies first
+        closure = []
+
+        for target in targets:
+            closure.extend(n for n in nx.dfs_postorder_nodes(self.graph, target)
+                           if n not in closure)
+
+        selected = set(targets) if only else set(closure)
+
+        if start:
+            if isinstance(start, str):
+                start = [start]
+
+            starting = set()
+
+            for node in self.match(start):
+                starting.add(node)
+                starting.update(nx.ancestors(self.graph, node))
+
+            selected &= starting
+
+        return [n for n in closure if n in selected]
+
 
 @attr.s(kw_only=True)
 class Stacker:
@@ -301,12 +1250,18 @@ class Stacker:
     namespace_delimiter = attr.ib(default='-')
     stacker_bucket = attr.ib(default='')
     stack_code = attr.ib()
-    template = attr.ib()
+    template = attr.ib()  # troposphere Template, or None with template_body
+    template_body = attr.ib(default=None)
     tags = attr.ib(default=attr.Factory(dict))
 
     region = attr.ib()
     config_file = attr.ib()
     template_file = attr.ib()
+    log_prefix = attr.ib(default=None)
+    log_file = attr.ib()
+    cancel_token = attr.ib(default=None)
+    # Let stacker delete and recreate stacks in a failed state
+    recreate_failed = attr.ib(default=False)
 
     @config_file.default
     def default_config_file(self):
@@ -316,15 +1271,36 @@ class Stacker:
     def default_template_file(self):
         return Path('stack.yaml')
 
+    @log_file.default
+    def default_log_file(self):
+        return Path('stacker.log')
+
+    @property
+    def stack_name(self):
+        return f'{self.namespace}{self.namespace_delimiter}{self.stack_code}'
+
     def generate_input_files(self):
-        self.template_file.write_text(self.template.to_yaml())
+        self.generate_template_file()
+        self.generate_config_file()
+
+    def generate_template_file(self):
+        body = self.template_body
+
+        if body is None:
+            body = self.template.to_yaml()
+
+        self.template_file.write_text(body)
+
+    def generate_config_file(self):
         config = {
             'namespace': self.namespace,
             'stacker_bucket': self.stacker_bucket,
             'stacks': [
                 {
                     'name': self.stack_code,
-                    'template_path': str(self.template_file),
+                    # relative, stacker runs in config file directory
+                    'template_path': os.path.relpath(self.template_file,
+                                                     self.config_file.parent),
                     'tags': self.tags,
                 }
             ],
@@ -332,36 +1308,161 @@ class Stacker:
         self.config_file.write_text(yaml.dump(config))
 
     def build(self):
-        cmd = [
-            'stacker', 'build',
-            '-r', self.region,
-            '--recreate-failed',
-            str(self.config_file)
-        ]
-        sh.run(cmd)
+        cmd = ['stacker', 'build', '-r', self.region]
+
+        if self.recreate_failed:
+            cmd.append('--recreate-failed')
+
+        cmd.append(self.config_file.name)
+        self.run(cmd)
 
     def destroy(self):
         cmd = [
             'stacker', 'destroy',
             '-r', self.region, '--force',
-            str(self.config_file)
+            self.config_file.name,
         ]
-        sh.run(cmd)
+        self.run(cmd)
+
+    def run(self, cmd):
+        sh.stream(cmd, prefix=self.log_prefix, log_file=self.log_file,
+                  cancel=self.cancel_token, cwd=self.config_file.parent)
 
 
 class Stack(Deployable):
+    build_hash_tag = 'distmono:build-hash'
+    resources = {'cfn_slots': 1}
+    parallel_safe = True
+    # Recreate stacks in a failed state instead of recovering them
+    recreate_failed = False
+
     def build(self):
         self.generate_stacker_files()
-        self.stacker.build()
 
-        build_dir = self.context.build_dir
+        if self.hotswap_enabled and self.hotswap():
+            return
+
+        self.revert_hotswap()
+
+        if not self.recreate_failed:
+            self.recover()
+
+        try:
+            self.stacker.build()
+        except (DeploymentCancelledError, KeyboardInterrupt):
+            self.cancel_update()
+            raise
+
+        stack = self.boto.describe_stack(self.stacker.stack_name)
+        self.save_output(
+            stack_outputs=self.boto.get_outputs(stack),
+            stack_updated=self.boto.get_last_updated(stack),
+            build_hash=self.build_hash_file.read_text(),
+            hotswap_hash=None,
+            hotswap_template=None,
+            template=self.get_template_data(),
+        )
+
+    def recover(self):
+        '''
+        Bring stack back to an updatable state, see StackRecovery.
+        '''
+        return StackRecovery(
+            stack_name=self.stacker.stack_name,
+            boto=self.boto,
+            cancel_token=self.context.cancel_token,
+            log_prefix=self.context.target,
+        ).recover()
+
+    def cancel_update(self):
+        '''
+        Roll back stack update left in progress by an interrupted build.
+        '''
+        stack_name = self.stacker.stack_name
+
+        try:
+            status = self.boto.describe_stack(stack_name)['StackStatus']
+
+            if status == 'UPDATE_IN_PROGRESS':
+                sh.print(f'{self.context.target}: cancelling update of {stack_name}')
+                self.boto.cloudform.cancel_update_stack(StackName=stack_name)
+        except (ClientError, StackDoesNotExistError) as e:
+            sh.print(f'{self.context.target}: unable to cancel update: {e}', error=True)
+
+    @property
+    def hotswap_enabled(self):
+        return self.context.env.get('hotswap', False)
+
+    def hotswap(self):
+        '''
+        Update Lambda code directly if nothing else changed since the last
+        stack update. The stack is then reconciled by the next build without
+        hotswap.
+        '''
+        previous_template = self.load_output('template')
+
+        if previous_template is None:
+            return False
+
+        # Diff against what is live, code hot-swapped since the last stack
+        # update included
+        build_hash = self.build_hash_file.read_text()
+        hotswapped = self.load_output('hotswap_hash') is not None
+        live_template = (hotswapped and self.load_output('hotswap_template')) or previous_template
+        template = self.get_template_data()
+        hotswap = Hotswap(
+            stack_name=self.stacker.stack_name,
+            boto=self.boto,
+            old_template=live_template,
+            new_template=template,
+        )
+        swapped = hotswap.apply()
+
+        if not swapped:
+            return False
+
+        sh.print(f'{self.context.target}: hot-swapped {", ".join(swapped)}')
 
-        stack_outputs = self.get_stack_outputs()
-        stack_outputs_file = build_dir / self.out_stack_outputs_file.name
-        stack_outputs_file.write_text(yaml.dump(stack_outputs))
+        if build_hash == self.load_output('build_hash'):
+            # Back to what the last stack update deployed
+            self.save_output(hotswap_hash=None, hotswap_template=None)
+        else:
+            self.save_output(hotswap_hash=build_hash, hotswap_template=template)
+
+        return True
+
+    def revert_hotswap(self):
+        '''
+        Put back code deployed by the last stack update over hot-swapped
+        code. CloudFormation doesn't know about the hot-swapped code, so
+        the stack update wouldn't replace it if its template has the same
+        code.
+        '''
+        hotswap_template = self.load_output('hotswap_template')
+
+        if self.load_output('hotswap_hash') is None or hotswap_template is None:
+            return
+
+        hotswap = Hotswap(
+            stack_name=self.stacker.stack_name,
+            boto=self.boto,
+            old_template=hotswap_template,
+            new_template=self.load_output('template'),
+        )
+        reverted = hotswap.apply()
+
+        if reverted:
+            sh.print(f'{self.context.target}: reverted hot-swapped {", ".join(reverted)}')
 
-        stack_outputs_file.replace(self.out_stack_outputs_file)
-        self.build_hash_file.replace(self.out_build_hash_file)
+        self.save_output(hotswap_hash=None, hotswap_template=None)
+
+    def get_template_data(self):
+        rendered = self.context.rendered_template
+
+        if rendered:
+            return rendered['data']
+
+        return json.loads(self.stacker.template.to_json())
 
     @property
     def build_hash_file(self):
@@ -369,37 +1470,60 @@ class Stack(Deployable):
 
     def generate_stacker_files(self):
         s = self.stacker
+        s.tags.pop(self.build_hash_tag, None)
         s.generate_input_files()
-        self.build_hash_file.write_text(self.get_build_hash())
+        build_hash = self.hash_stacker_files()
+
+        # Tag the stack with its hash so that its freshness can be checked
+        s.tags[self.build_hash_tag] = build_hash
+        s.generate_config_file()
+        self.build_hash_file.write_text(build_hash)
 
     def get_build_hash(self):
+        if not self.build_hash_file.exists():
+            self.generate_stacker_files()
+
+        return self.build_hash_file.read_text()
+
+    def hash_stacker_files(self):
         h = hashlib.sha256()
         s = self.stacker
-        h.update(s.config_file.read_bytes())
-        h.update(s.template_file.read_bytes())
+        update_hash(h, s.config_file)
+        update_hash(h, s.template_file)
         return h.hexdigest()
 
     def get_stack_outputs(self):
-        s = self.stacker
-        stack_name = f'{s.namespace}{s.namespace_delimiter}{s.stack_code}'
-        return self.boto.get_stack_outputs(stack_name)
+        return self.boto.get_stack_outputs(self.stacker.stack_name)
 
     @cached_property
     def stacker(self):
         return self.get_stacker()
 
     def get_stacker(self):
+        work_dir = self.context.work_dir or Path()
+        rendered = self.context.rendered_template
         return Stacker(
             namespace=self.get_namespace(),
             stack_code=self.get_stack_code(),
-            template=self.get_template(),
-            tags=self.get_tags(),
+            template=None if rendered else self.get_template(),
+            template_body=rendered['body'] if rendered else None,
+            tags=dict(self.get_tags()),  # build hash tag is added to it
             region=self.get_region(),
+            config_file=work_dir / 'config.yaml',
+            template_file=work_dir / 'stack.yaml',
+            log_file=work_dir / 'stacker.log',
+            log_prefix=self.context.target,
+            cancel_token=self.context.cancel_token,
+            recreate_failed=self.recreate_failed,
         )
 
     def get_namespace(self):
         return self.context.env['namespace']
 
+    def get_stack_name(self):
+        delimiter = attr.fields(Stacker).namespace_delimiter.default
+        return f'{self.get_namespace()}{delimiter}{self.get_stack_code()}'
+
     def get_stack_code(self):
         return self.stack_code
 
@@ -412,30 +1536,68 @@ class Stack(Deployable):
     def get_region(self):
         return self.context.env['region']
 
-    @cached_property
-    def out_stack_outputs_file(self):
-        return self.context.build_output_dir / 'stack-outputs.yaml'
-
-    @cached_property
-    def out_build_hash_file(self):
-        return self.context.build_output_dir / self.build_hash_file.name
-
     @cached_property
     def boto(self):
-        return BotoHelper(region=self.get_region())
+        return BotoHelper.from_env(self.context.env, region=self.get_region())
 
     def get_build_output(self):
-        return yaml.safe_load(self.out_stack_outputs_file.read_text())
+        return self.require_output('stack_outputs')
 
     def is_build_outdated(self):
-        try:
-            previous_hash = self.out_build_hash_file.read_text()
-        except FileNotFoundError:
+        previous_hash = self.load_output('build_hash')
+
+        if previous_hash is None:
             return True
 
         self.generate_stacker_files()
         current_hash = self.build_hash_file.read_text()
-        return current_hash != previous_hash
+        hotswap_hash = self.load_output('hotswap_hash')
+
+        if self.hotswap_enabled:
+            # Hot-swapped code is live until the next stack update
+            return current_hash != (hotswap_hash or previous_hash)
+
+        # Stack needs reconciling if it was hot-swapped
+        if current_hash != previous_hash or hotswap_hash is not None:
+            return True
+
+        return self.is_drifted()
+
+    def is_drifted(self):
+        '''
+        Whether live stack is different from what was last built.
+        '''
+        probe = self.context.stack_probe
+
+        if not probe:
+            return False
+
+        target = self.context.target
+        stack = probe.get(self.stacker.stack_name)
+
+        if not stack:
+            sh.print(f'{target}: stack does not exist')
+            return True
+
+        status = stack['StackStatus']
+
+        if not status.endswith('_COMPLETE') or 'ROLLBACK' in status:
+            sh.print(f'{target}: stack is in {status}')
+            return True
+
+        tags = self.boto.get_tags(stack)
+
+        if tags.get(self.build_hash_tag) != self.load_output('build_hash'):
+            sh.print(f'{target}: stack was deployed from another build')
+            return True
+
+        updated = self.load_output('stack_updated')
+
+        if updated and updated != self.boto.get_last_updated(stack):
+            sh.print(f'{target}: stack was updated outside of dmn')
+            return True
+
+        return False
 
     def destroy(self):
         stacker = self.stacker
@@ -443,6 +1605,155 @@ class Stack(Deployable):
         stacker.destroy()
 
 
+class StackGroup(Stack):
+    '''
+    Stacks deployed as nested stacks of one parent stack, see
+    Project.get_stack_groups(). Templates of the stacks are uploaded to env
+    template_bucket, build output has outputs of each stack by its target.
+    '''
+    members = {}  # Stack subclasses by target
+    member_dependencies = {}  # dependencies of members by target
+
+    # Stack methods called on the group only, members must not override them
+    member_unsupported = [
+        'build',
+        'destroy',
+        'get_build_output',
+        'get_build_hash',
+        'is_build_outdated',
+        'get_tags',
+        'get_region',
+        'get_watch_paths',
+    ]
+
+    @classmethod
+    def create_class(cls, members, member_dependencies):
+        return type(cls.__name__, (cls,), {
+            'members': members,
+            'member_dependencies': member_dependencies,
+        })
+
+    def get_stack_code(self):
+        return self.context.target
+
+    @cached_property
+    def member_templates(self):
+        '''
+        Logical ID, S3 key, YAML body and output names of member templates.
+        '''
+        ctx = self.context
+        templates = {}
+
+        for member, dpl_cls in self.members.items():
+            input = {d: ctx.input[d] for d in self.member_dependencies.get(member, [])}
+            member_ctx = attr.evolve(ctx, target=member, input=input, rendered_template=None)
+            template = dpl_cls(member_ctx).get_template()
+            body = template.to_yaml()
+            digest = hashlib.sha256(body.encode('utf8')).hexdigest()[:32]
+            templates[member] = {
+                'logical_id': self.get_logical_id(member),
+                'key': f"{ctx.env['namespace']}/{ctx.target}/{member}-{digest}.yaml",
+                'body': body,
+                'outputs': list(template.outputs),
+            }
+
+        return templates
+
+    @classmethod
+    def get_logical_id(cls, member):
+        parts = re.split(r'[^a-zA-Z0-9]+', member)
+        return ''.join(p[:1].upper() + p[1:] for p in parts)
+
+    def get_template(self):
+        from troposphere import GetAtt, Output, Template, cloudformation
+
+        bucket = self.template_bucket
+        region = self.get_region()
+        t = Template()
+
+        for member, m in self.member_templates.items():
+            logical_id = m['logical_id']
+            t.add_resource(cloudformation.Stack(
+                logical_id,
+                TemplateURL=f"https://{bucket}.s3.{region}.amazonaws.com/{m['key']}",
+            ))
+
+            for name in m['outputs']:
+                t.add_output(Output(f'{logical_id}{name}',
+                                    Value=GetAtt(logical_id, f'Outputs.{name}')))
+
+        return t
+
+    @property
+    def template_bucket(self):
+        bucket = self.context.env.get('template_bucket')
+
+        if not bucket:
+            raise ConfigError(f'Stack group {self.context.target!r} requires env template_bucket')
+
+        return bucket
+
+    def build(self):
+        self.upload_member_templates()
+        super().build()
+
+    def destroy(self):
+        super().destroy()
+        # Member templates uploaded by all builds of the group
+        prefix = f"{self.context.env['namespace']}/{self.context.target}/"
+        self.boto.empty_bucket(self.template_bucket, prefix=prefix)
+
+    def upload_member_templates(self):
+        s3 = self.boto.client('s3')
+
+        for m in self.member_templates.values():
+            s3.put_object(Bucket=self.template_bucket,
+                          Key=m['key'],
+                          Body=m['body'].encode('utf8'),
+                          ContentType='text/yaml')
+
+    def get_build_output(self):
+        '''
+        Outputs of the stack split by member, from their logical ID prefix,
+        so that they are known without rendering member templates.
+        '''
+        stack_outputs = self.require_output('stack_outputs')
+        logical_ids = {self.get_logical_id(m): m for m in self.members}
+        output = {m: {} for m in self.members}
+
+        for key, value in stack_outputs.items():
+            for logical_id, member in logical_ids.items():
+                if key.startswith(logical_id):
+                    output[member][key[len(logical_id):]] = value
+                    break
+
+        return output
+
+
+def import_deployable_cls(path):
+    '''
+    Import deployable class by 'package.module:Class' or
+    'package.module.Class'.
+    '''
+    if ':' in path:
+        module_name, _, name = path.partition(':')
+    else:
+        module_name, _, name = path.rpartition('.')
+
+    try:
+        obj = importlib.import_module(module_name)
+
+        for part in name.split('.'):
+            obj = getattr(obj, part)
+    except (ImportError, AttributeError, ValueError) as e:
+        raise ConfigError(f'Unable to import deployable {path!r}: {e}')
+
+    if not (isinstance(obj, type) and issubclass(obj, Deployable)):
+        raise ConfigError(f'{path!r} is not a Deployable class')
+
+    return obj
+
+
 def load_project(filename):
     mod = runpy.run_path(filename)
     func = mod.get('get_project')
@@ -456,4 +1767,5 @@ def load_project(filename):
     if not isinstance(obj, Project):
         raise ConfigError(f'get_project() from {filename!r} did not return Project instance')
 
+    obj.project_file = Path(filename).resolve()
     return obj
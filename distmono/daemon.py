@@ -0,0 +1,284 @@
+'''
+Long running dmn process that keeps a project loaded, and its client.
+
+Only the standard library is imported at module level, so that the client
+starts fast.
+'''
+from contextlib import redirect_stderr, redirect_stdout
+from distmono.exceptions import DaemonError
+from pathlib import Path
+import hashlib
+import io
+import json
+import os
+import socket
+import socketserver
+import sys
+import tempfile
+
+
+def get_socket_dir():
+    '''
+    Directory of daemon sockets of the user, only the user can access it.
+    '''
+    runtime_dir = os.environ.get('XDG_RUNTIME_DIR') or tempfile.gettempdir()
+    return Path(runtime_dir) / f'dmn-{os.getuid()}'
+
+
+def get_socket_path(project_file):
+    key = hashlib.sha256(str(Path(project_file).resolve()).encode('utf8'))
+    return get_socket_dir() / f'{key.hexdigest()[:16]}.sock'
+
+
+def run_command(project, command, args):
+    if command == 'build':
+        env = project.env
+
+        try:
+            if args.get('hotswap'):
+                project.env = dict(env, hotswap=True)
+
+            return project.build(args.get('target'),
+                                 jobs=args.get('jobs'),
+                                 only=args.get('only', False),
+                                 start=args.get('start'),
+                                 resume=args.get('resume', False),
+                                 keep_going=args.get('keep_going', False),
+                                 timeout=args.get('timeout'))
+        finally:
+            project.env = env
+
+    if command == 'destroy':
+        return project.destroy(args.get('target'),
+                               jobs=args.get('jobs'),
+                               timeout=args.get('timeout'))
+
+    if command == 'gc':
+        return project.gc(retention=args['retention'],
+                          dry_run=args.get('dry_run', False),
+                          all_versions=args.get('all_versions', False))
+
+    if command == 'outputs':
+        return project.get_outputs(args.get('target'), refresh=args.get('refresh', False))
+
+    raise ValueError(f'Unknown command {command!r}')
+
+
+class Daemon:
+    def __init__(self, project_file, *, socket_path=None):
+        self.project_file = Path(project_file).resolve()
+        self.socket_path = Path(socket_path or get_socket_path(project_file))
+        self.project = None
+        self.snapshot = None
+
+    def get_project(self):
+        '''
+        Load project, again if any of its source files changed.
+        '''
+        from distmono.util import sh
+
+        if self.project and sh.diff_snapshots(self.snapshot, self.take_snapshot()):
+            sh.print('Project files changed, reloading')
+            self.unload_modules()
+            self.unload_project()
+
+        if not self.project:
+            from distmono.core import load_project
+            self.project = load_project(self.project_file)
+            self.snapshot = self.take_snapshot()
+
+        return self.project
+
+    def unload_project(self):
+        '''
+        Drop project, stopping its template renderer processes if any.
+        '''
+        renderer = self.project and self.project.__dict__.get('template_renderer')
+
+        if renderer:
+            renderer.shutdown()
+
+        self.project = None
+
+    def get_project_modules(self):
+        import distmono
+
+        distmono_dir = Path(distmono.__file__).parent
+        project_dir = self.project.project_dir
+        modules = {}
+
+        for name, mod in list(sys.modules.items()):
+            file = getattr(mod, '__file__', None)
+
+            if not file:
+                continue
+
+            file = Path(file).resolve()
+
+            if project_dir in file.parents and distmono_dir not in file.parents:
+                modules[name] = file
+
+        return modules
+
+    def take_snapshot(self):
+        from distmono.util import sh
+
+        files = [self.project_file] + list(self.get_project_modules().values())
+        return sh.snapshot_files(files)
+
+    def unload_modules(self):
+        for name in self.get_project_modules():
+            del sys.modules[name]
+
+    def handle(self, request, stream):
+        '''
+        Run command of request, writing its printed output to stream as it
+        goes, return result.
+        '''
+        class LineWriter(io.TextIOBase):
+            def __init__(self, key):
+                self.key = key
+
+            def write(self, text):
+                if text:
+                    send(stream, {self.key: text})
+
+                return len(text)
+
+        with redirect_stdout(LineWriter('output')), redirect_stderr(LineWriter('error_output')):
+            project = self.get_project()
+
+            try:
+                return run_command(project, request['command'], request.get('args', {}))
+            finally:
+                # Watch modules of deployables imported on first use too
+                self.snapshot = {**self.take_snapshot(), **self.snapshot}
+
+    def serve(self):
+        from distmono.util import sh
+
+        daemon = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                line = self.rfile.readline()
+
+                if not line:  # connection check
+                    return
+
+                request = json.loads(line)
+
+                if request['command'] == 'shutdown':
+                    send(self.wfile, {'result': None})
+                    self.server.shutdown_requested = True
+                    return
+
+                try:
+                    result = daemon.handle(request, self.wfile)
+                except Exception as e:
+                    sh.print(f'{request["command"]} failed: {e!r}', error=True)
+                    send(self.wfile, {'error': f'{type(e).__name__}: {e}'})
+                else:
+                    send(self.wfile, {'result': result})
+
+        self.make_socket_dir()
+
+        if DaemonClient(self.socket_path).is_running():
+            raise RuntimeError(f'Daemon already running on {self.socket_path}')
+
+        if self.socket_path.exists():
+            self.socket_path.unlink()
+
+        self.get_project()
+
+        with socketserver.UnixStreamServer(str(self.socket_path), Handler) as server:
+            server.shutdown_requested = False
+            os.chmod(self.socket_path, 0o600)
+            sh.print(f'Listening on {self.socket_path}')
+
+            try:
+                while not server.shutdown_requested:
+                    server.handle_request()
+            except KeyboardInterrupt:
+                pass
+            finally:
+                self.socket_path.unlink()
+                self.unload_project()
+
+    def make_socket_dir(self):
+        '''
+        Create socket directory if missing, make sure no other user can
+        access it, as the socket is accessible until it is chmod'ed.
+        '''
+        socket_dir = self.socket_path.parent
+        socket_dir.mkdir(mode=0o700, parents=True, exist_ok=True)
+        st = socket_dir.stat()
+
+        if st.st_uid != os.getuid() or st.st_mode & 0o077:
+            raise DaemonError(f'Socket directory {socket_dir} must be accessible only by its owner')
+
+
+def send(stream, message):
+    stream.write(json.dumps(message, default=str).encode('utf8') + b'\n')
+    stream.flush()
+
+
+class DaemonClient:
+    def __init__(self, socket_path, *, output=None, error_output=None):
+        self.socket_path = Path(socket_path)
+        self.output = output
+        self.error_output = error_output
+
+    @classmethod
+    def for_project_file(cls, project_file):
+        return cls(get_socket_path(project_file))
+
+    def is_running(self):
+        if not self.socket_path.exists():
+            return False
+
+        try:
+            with self.connect():
+                return True
+        except (ConnectionRefusedError, FileNotFoundError):
+            return False
+
+    def connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+
+        try:
+            sock.connect(str(self.socket_path))
+        except OSError:
+            sock.close()
+            raise
+
+        return sock
+
+    def call(self, command, **args):
+        '''
+        Run command in daemon, printing its output, return its result.
+        '''
+        with self.connect() as sock:
+            stream = sock.makefile('rwb')
+            send(stream, {'command': command, 'args': args})
+
+            for line in stream:
+                message = json.loads(line)
+
+                if 'output' in message:
+                    self.write(self.output or sys.stdout, message['output'])
+                elif 'error_output' in message:
+                    self.write(self.error_output or sys.stderr, message['error_output'])
+                elif 'error' in message:
+                    raise DaemonError(message['error'])
+                else:
+                    return message['result']
+
+        raise DaemonError('Daemon closed connection')
+
+    def write(self, output, text):
+        output.write(text)
+        output.flush()
+
+    def shutdown(self):
+        return self.call('shutdown')
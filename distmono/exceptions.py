@@ -12,3 +12,43 @@ class CircularDependencyError(DistmonoError):
 
 class StackDoesNotExistError(DistmonoError):
     pass
+
+
+class BuildOutputNotFoundError(DistmonoError):
+    pass
+
+
+class DaemonError(DistmonoError):
+    pass
+
+
+class DeploymentCancelledError(DistmonoError):
+    pass
+
+
+class DeploymentTimeoutError(DeploymentCancelledError):
+    pass
+
+
+class TasksFailedError(DistmonoError):
+    def __init__(self, errors, skipped):
+        self.errors = errors
+        self.skipped = skipped
+        msg = f'Failed: {", ".join(errors)}'
+
+        if skipped:
+            msg += f'; skipped: {", ".join(skipped)}'
+
+        super().__init__(msg)
+
+
+class StackRecoveryError(DistmonoError):
+    pass
+
+
+class S3DeleteError(DistmonoError):
+    pass
+
+
+class LoadTestFailedError(DistmonoError):
+    pass
@@ -0,0 +1,185 @@
+from cached_property import cached_property
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from distmono.core import Stack
+from distmono.store import OutputStore
+from distmono.util import BotoHelper, sh
+import attr
+import shutil
+import time
+
+
+@attr.s(kw_only=True)
+class GarbageCollector:
+    '''
+    Delete what builds of a project left behind, older than retention
+    seconds:
+
+    - S3 objects under prefixes that deployables own (see
+      Deployable.get_artifact_prefixes(), e.g. old
+      s3://bucket/function-code/<hash>.zip), not referenced by build outputs
+      of any namespace nor by templates of stacks deployed by distmono in
+      the region, from any machine
+    - build and destroy directories of targets, build output directories of
+      targets without outputs
+    - directories of other namespaces without outputs (i.e. destroyed)
+    '''
+    project = attr.ib()
+    retention = attr.ib(default=7 * 24 * 3600)
+    dry_run = attr.ib(default=False)
+    # Delete all versions of objects, instead of keeping them as noncurrent
+    # versions in versioned buckets
+    all_versions = attr.ib(default=False)
+    max_workers = attr.ib(default=8)
+
+    @cached_property
+    def boto(self):
+        return BotoHelper.from_env(self.project.env,
+                                   max_pool_connections=self.max_workers)
+
+    def collect(self):
+        '''
+        Return number of S3 objects and directories deleted.
+        '''
+        outputs = self.load_all_outputs()
+        prefixes = set()
+        live = set()
+
+        for ns_outputs in outputs.values():
+            live.update(self.find_artifacts(ns_outputs))
+
+            for target_outputs in ns_outputs.values():
+                prefixes.update(tuple(p) for p in target_outputs.get('artifact_prefixes', []))
+
+        if prefixes:
+            live.update(self.find_deployed_artifacts())
+
+        return {
+            'objects': self.collect_objects(prefixes, live),
+            'dirs': self.collect_dirs(outputs),
+        }
+
+    def get_namespace_dirs(self):
+        namespaces_dir = self.project.temp_dir / 'namespace'
+
+        if not namespaces_dir.is_dir():
+            return []
+
+        return sorted(d for d in namespaces_dir.iterdir() if d.is_dir())
+
+    def load_all_outputs(self):
+        '''
+        Outputs of all targets by namespace directory.
+        '''
+        outputs = {}
+
+        for ns_dir in self.get_namespace_dirs():
+            db_file = ns_dir / 'outputs.db'
+            outputs[ns_dir] = OutputStore(db_file).get_all() if db_file.is_file() else {}
+
+        return outputs
+
+    def find_artifacts(self, value):
+        '''
+        Iterate through (bucket, key) of S3 locations (e.g. build output of
+        Code or Lambda code in a stack template) found in value.
+        '''
+        if isinstance(value, dict):
+            for bucket_name, key_name in (('Bucket', 'Key'), ('S3Bucket', 'S3Key')):
+                bucket = value.get(bucket_name)
+                key = value.get(key_name)
+
+                if isinstance(bucket, str) and isinstance(key, str):
+                    yield bucket, key
+
+            for item in value.values():
+                yield from self.find_artifacts(item)
+        elif isinstance(value, list):
+            for item in value:
+                yield from self.find_artifacts(item)
+
+    def find_deployed_artifacts(self):
+        '''
+        Iterate through (bucket, key) of S3 locations in templates of stacks
+        deployed by distmono in the region, from this checkout or not.
+        '''
+        from cfn_flip import load
+
+        for stack in self.boto.describe_stacks():
+            if Stack.build_hash_tag not in self.boto.get_tags(stack):
+                continue
+
+            resp = self.boto.cloudform.get_template(StackName=stack['StackId'],
+                                                    TemplateStage='Original')
+            body = resp['TemplateBody']
+            template = body if isinstance(body, dict) else load(body)[0]
+            yield from self.find_artifacts(template)
+
+    def collect_objects(self, prefixes, live):
+        cutoff = datetime.now(timezone.utc) - timedelta(seconds=self.retention)
+        versions = self.all_versions
+        count = 0
+
+        for bucket, prefix in sorted(prefixes):
+            live_keys = {key for b, key in live if b == bucket}
+
+            def select(item):
+                return item['Key'] not in live_keys and item['LastModified'] < cutoff
+
+            if self.dry_run:
+                s3 = self.boto.client('s3')
+                batches = self.boto.list_object_batches(s3, bucket, prefix=prefix,
+                                                        select=select, versions=versions)
+                deleted = sum(len(batch) for batch in batches)
+            else:
+                deleted = self.boto.delete_object_versions(
+                    bucket, prefix=prefix, select=select, max_workers=self.max_workers,
+                    versions=versions)
+
+            if deleted:
+                sh.print(f'{self.verb} {deleted} objects in s3://{bucket}/{prefix}')
+
+            count += deleted
+
+        return count
+
+    def collect_dirs(self, outputs):
+        cutoff = time.time() - self.retention
+        current_ns_dir = self.project.get_namespace_dir()
+        dirs = []
+
+        for ns_dir, ns_outputs in outputs.items():
+            if not ns_outputs and ns_dir != current_ns_dir:
+                if self.is_stale(ns_dir, cutoff):
+                    dirs.append(ns_dir)
+
+                continue
+
+            for name in ('build', 'destroy', 'build-output'):
+                parent = ns_dir / name
+
+                if not parent.is_dir():
+                    continue
+
+                for target_dir in parent.iterdir():
+                    if name == 'build-output' and target_dir.name in ns_outputs:
+                        continue
+
+                    if self.is_stale(target_dir, cutoff):
+                        dirs.append(target_dir)
+
+        for d in dirs:
+            sh.print(f'{self.verb} {d}')
+
+        if not self.dry_run:
+            with ThreadPoolExecutor(self.max_workers) as executor:
+                list(executor.map(lambda d: shutil.rmtree(d, ignore_errors=True), dirs))
+
+        return len(dirs)
+
+    def is_stale(self, path, cutoff):
+        return path.is_dir() and path.stat().st_mtime < cutoff
+
+    @property
+    def verb(self):
+        return 'Would delete' if self.dry_run else 'Deleted'
@@ -0,0 +1,158 @@
+from cached_property import cached_property
+import attr
+
+
+@attr.s(kw_only=True)
+class Hotswap:
+    '''
+    Apply Lambda code changes between two templates of a stack directly,
+    without CloudFormation.
+    '''
+    stack_name = attr.ib()
+    boto = attr.ib()
+    old_template = attr.ib()
+    new_template = attr.ib()
+
+    # Properties that can be updated directly, by resource type
+    swappable_properties = {
+        'AWS::Lambda::Function': {'Code'},
+        'AWS::Lambda::LayerVersion': {'Content'},
+    }
+
+    def get_changes(self):
+        '''
+        Changed resources by logical ID, None if anything changed that can
+        only be updated through CloudFormation.
+        '''
+        old = dict(self.old_template)
+        new = dict(self.new_template)
+        old_resources = old.pop('Resources', {})
+        new_resources = new.pop('Resources', {})
+
+        if old != new or old_resources.keys() != new_resources.keys():
+            return None
+
+        changes = {}
+
+        for logical_id, new_res in new_resources.items():
+            old_res = old_resources[logical_id]
+
+            if old_res == new_res:
+                continue
+
+            if not self.is_swappable(old_res, new_res):
+                return None
+
+            changes[logical_id] = new_res
+
+        return changes
+
+    def is_swappable(self, old_res, new_res):
+        res_type = new_res.get('Type')
+
+        if old_res.get('Type') != res_type or res_type not in self.swappable_properties:
+            return False
+
+        old_res = dict(old_res)
+        new_res = dict(new_res)
+        old_props = old_res.pop('Properties', {})
+        new_props = new_res.pop('Properties', {})
+
+        if old_res != new_res:
+            return False
+
+        swappable = self.swappable_properties[res_type]
+        changed = {k for k in old_props.keys() | new_props.keys()
+                   if old_props.get(k) != new_props.get(k)}
+
+        if not changed <= swappable:
+            return False
+
+        # Only S3 locations known before deployment can be applied
+        return all(self.get_s3_location(new_props[k]) for k in changed)
+
+    def get_s3_location(self, code):
+        location = {k: code.get(k) for k in ('S3Bucket', 'S3Key', 'S3ObjectVersion')}
+
+        if not all(isinstance(location[k], str) for k in ('S3Bucket', 'S3Key')):
+            return None
+
+        if location['S3ObjectVersion'] is None:
+            del location['S3ObjectVersion']
+
+        return location
+
+    def apply(self):
+        '''
+        Return logical IDs of updated resources, empty if the changes can't
+        be hot-swapped.
+        '''
+        changes = self.get_changes()
+
+        if not changes:
+            return []
+
+        physical_ids = self.get_physical_ids()
+        new_layer_arns = {}  # by layer ARN without version
+
+        for logical_id, res in changes.items():
+            if res['Type'] == 'AWS::Lambda::LayerVersion':
+                old_arn = physical_ids[logical_id]
+                new_arn = self.publish_layer(old_arn, res['Properties'])
+                new_layer_arns[self.get_layer_arn(old_arn)] = new_arn
+
+        for logical_id, res in changes.items():
+            if res['Type'] == 'AWS::Lambda::Function':
+                self.update_function_code(physical_ids[logical_id], res['Properties'])
+
+        if new_layer_arns:
+            for logical_id, res in self.new_template.get('Resources', {}).items():
+                if res.get('Type') == 'AWS::Lambda::Function':
+                    self.update_function_layers(physical_ids[logical_id], new_layer_arns)
+
+        return list(changes)
+
+    def get_physical_ids(self):
+        resp = self.cloudform.describe_stack_resources(StackName=self.stack_name)
+        return {r['LogicalResourceId']: r['PhysicalResourceId']
+                for r in resp['StackResources']}
+
+    def get_layer_arn(self, layer_version_arn):
+        # arn:aws:lambda:<region>:<account>:layer:<name>:<version>
+        return layer_version_arn.rsplit(':', 1)[0]
+
+    def publish_layer(self, layer_version_arn, props):
+        kwargs = {
+            'LayerName': self.get_layer_arn(layer_version_arn),
+            'Content': self.get_s3_location(props['Content']),
+        }
+
+        for key in ('CompatibleRuntimes', 'CompatibleArchitectures', 'Description', 'LicenseInfo'):
+            if key in props:
+                kwargs[key] = props[key]
+
+        resp = self.lambd.publish_layer_version(**kwargs)
+        return resp['LayerVersionArn']
+
+    def update_function_code(self, function_name, props):
+        self.lambd.update_function_code(FunctionName=function_name,
+                                        **self.get_s3_location(props['Code']))
+
+    def update_function_layers(self, function_name, new_layer_arns):
+        self.lambd.get_waiter('function_updated').wait(FunctionName=function_name)
+        config = self.lambd.get_function_configuration(FunctionName=function_name)
+        layers = [layer['Arn'] for layer in config.get('Layers', [])]
+        # Function may use a version published by a previous hotswap
+        new_layers = [new_layer_arns.get(self.get_layer_arn(arn), arn) for arn in layers]
+
+        if new_layers != layers:
+            self.lambd.update_function_configuration(FunctionName=function_name,
+                                                     Layers=new_layers)
+
+    @cached_property
+    def cloudform(self):
+        return self.boto.client('cloudformation')
+
+    @cached_property
+    def lambd(self):
+        return self.boto.client('lambda')
@@ -0,0 +1,298 @@
+'''
+Load test deployables, to gate a deployment on performance of what it
+deployed, in the same graph:
+
+    class ApiLoadTest(HttpLoadTest):
+        rps = 50
+        duration = 30
+        max_latency_ms = {'p95': 500}
+        max_error_rate = 0.01
+
+        def get_url(self):
+            return self.context.input['api-stack']['ApiUrl'] + '/status'
+
+Build output is the load test report, see LoadTest.get_report().
+'''
+from cached_property import cached_property, threaded_cached_property
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from distmono.core import Deployable
+from distmono.exceptions import LoadTestFailedError
+from distmono.util import BotoHelper, sh
+import asyncio
+import base64
+import itertools
+import json
+import math
+import urllib.request
+
+
+class LoadTest(Deployable):
+    '''
+    Send requests for duration seconds from concurrency workers, at rps
+    requests per second in total if set, as fast as they can otherwise.
+    Requests are blocking calls run in a thread per worker.
+    '''
+    parallel_safe = True
+    concurrency = 10
+    rps = None
+    duration = 10  # seconds
+    request_timeout = 30  # seconds
+
+    # Gates, build fails if any is exceeded
+    max_latency_ms = {}  # e.g. {'p50': 100, 'p99': 1000}
+    max_error_rate = None  # e.g. 0.01
+    max_cold_starts = None
+    # Build also fails if requests were sent at less than this ratio of rps,
+    # when the load test couldn't keep up with it
+    min_rps_ratio = 0.9
+
+    percentiles = [50, 90, 95, 99]
+
+    async def build(self):
+        samples = await self.run()
+        report = self.get_report(samples)
+        self.print_report(report)
+        self.save_output(report=report)
+        self.check_gates(report)
+
+    def get_build_output(self):
+        return self.require_output('report')
+
+    def request(self):
+        '''
+        Send one request, return whether it hit a cold start. Raise an error
+        if the request failed.
+        '''
+        raise NotImplementedError
+
+    async def run(self):
+        '''
+        Return samples of all requests.
+        '''
+        loop = asyncio.get_running_loop()
+        executor = ThreadPoolExecutor(self.concurrency)
+        futures = set()
+        start = loop.time()
+        end = start + self.duration
+        counter = itertools.count()
+        samples = []
+
+        async def worker():
+            while True:
+                if self.rps:
+                    at = start + next(counter) / self.rps
+
+                    if at >= end:
+                        return
+
+                    await asyncio.sleep(max(0, at - loop.time()))
+                elif loop.time() >= end:
+                    return
+                else:
+                    at = None
+
+                samples.append(await self.measure(loop, executor, futures, start, at))
+
+        try:
+            await asyncio.gather(*(worker() for _ in range(self.concurrency)))
+        finally:
+            # Requests not started yet when cancelled
+            for future in list(futures):
+                future.cancel()
+
+            executor.shutdown(wait=False)
+
+        return samples
+
+    async def measure(self, loop, executor, futures, start, at=None):
+        '''
+        Send a request, its latency is from at, the time it was scheduled
+        at if any, so that requests delayed by slow ones are accounted for.
+        '''
+        sent = loop.time()
+        sample = {'sent': sent - start, 'latency': None, 'error': None, 'cold_start': False}
+        future = executor.submit(self.request)
+        futures.add(future)
+
+        try:
+            result = await asyncio.wait_for(asyncio.wrap_future(future), self.request_timeout)
+            sample['cold_start'] = bool(result)
+        except asyncio.TimeoutError:
+            sample['error'] = f'Timed out after {self.request_timeout}s'
+        except Exception as e:
+            sample['error'] = f'{type(e).__name__}: {e}'
+        finally:
+            futures.discard(future)
+
+        sample['latency'] = loop.time() - (sent if at is None else at)
+        return sample
+
+    def get_report(self, samples):
+        '''
+        Number of requests, errors and cold starts, error rate, requests sent
+        per second and its target, latency percentiles of successful
+        requests in milliseconds and the most common errors.
+        '''
+        count = len(samples)
+        errors = Counter(s['error'] for s in samples if s['error'])
+        num_errors = sum(errors.values())
+        latencies = sorted(s['latency'] * 1000 for s in samples if not s['error'])
+        latency_ms = {f'p{p}': self.percentile(latencies, p) for p in self.percentiles}
+        # Requests sent late extend the time taken to send them all
+        sending = max([self.duration] + [s['sent'] for s in samples])
+
+        if latencies:
+            latency_ms.update(
+                min=round(latencies[0], 1),
+                max=round(latencies[-1], 1),
+                mean=round(sum(latencies) / len(latencies), 1),
+            )
+
+        return {
+            'requests': count,
+            'errors': num_errors,
+            'error_rate': num_errors / count if count else 0,
+            'cold_starts': sum(1 for s in samples if s['cold_start']),
+            'rps': round(count / sending, 1) if sending else 0,
+            'target_rps': self.rps,
+            'latency_ms': latency_ms,
+            'top_errors': dict(errors.most_common(5)),
+        }
+
+    def percentile(self, values, p):
+        '''
+        Nearest-rank percentile of sorted values, None if there is none.
+        '''
+        if not values:
+            return None
+
+        rank = max(1, math.ceil(p / 100 * len(values)))
+        return round(values[rank - 1], 1)
+
+    def print_report(self, report):
+        target = self.context.target
+        latency = ', '.join(f'{k} {v}' for k, v in report['latency_ms'].items() if v is not None)
+        rps = f"{report['rps']}/s"
+
+        if report['target_rps']:
+            rps += f" of {report['target_rps']}/s"
+
+        sh.print(f"{target}: {report['requests']} requests ({rps}), "
+                 f"{report['errors']} errors, {report['cold_starts']} cold starts")
+        sh.print(f'{target}: latency ms {latency or "-"}')
+
+        for error, count in report['top_errors'].items():
+            sh.print(f'{target}: {count} x {error}', error=True)
+
+    def check_gates(self, report):
+        failures = []
+
+        for name, limit in self.max_latency_ms.items():
+            value = report['latency_ms'].get(name)
+
+            if value is None or value > limit:
+                failures.append(f'latency {name} {value} ms > {limit} ms')
+
+        if self.max_error_rate is not None and report['error_rate'] > self.max_error_rate:
+            failures.append(f"error rate {report['error_rate']:.3f} > {self.max_error_rate}")
+
+        if self.max_cold_starts is not None and report['cold_starts'] > self.max_cold_starts:
+            failures.append(f"cold starts {report['cold_starts']} > {self.max_cold_starts}")
+
+        min_rps = self.rps and self.min_rps_ratio and self.rps * self.min_rps_ratio
+
+        if min_rps and report['rps'] < min_rps:
+            failures.append(f"rps {report['rps']} < {min_rps:g}"
+                            f" ({self.min_rps_ratio:.0%} of {self.rps})")
+
+        if failures:
+            raise LoadTestFailedError(f'{self.context.target}: {"; ".join(failures)}')
+
+
+class HttpLoadTest(LoadTest):
+    '''
+    Load test URL from get_url(), responses with status 400 and above are
+    errors.
+    '''
+    method = 'GET'
+    headers = {}
+    # Response header set on cold starts by the service, if any
+    cold_start_header = None
+
+    def get_url(self):
+        raise NotImplementedError
+
+    def get_body(self):
+        '''
+        Request body, bytes or None.
+        '''
+        return None
+
+    @cached_property
+    def url(self):
+        return self.get_url()
+
+    @cached_property
+    def body(self):
+        return self.get_body()
+
+    def request(self):
+        req = urllib.request.Request(self.url, data=self.body,
+                                     headers=self.headers, method=self.method)
+
+        with urllib.request.urlopen(req, timeout=self.request_timeout) as r:
+            r.read()
+            return bool(self.cold_start_header and r.headers.get(self.cold_start_header))
+
+    async def build(self):
+        sh.print(f'{self.context.target}: {self.method} {self.url}')
+        await super().build()
+
+
+class FunctionLoadTest(LoadTest):
+    '''
+    Load test Lambda function from get_function_name(), invocations that
+    raised a function error are errors. Cold starts are found from the
+    init duration in invocation logs.
+    '''
+    qualifier = None
+
+    def get_function_name(self):
+        raise NotImplementedError
+
+    def get_payload(self):
+        return {}
+
+    @cached_property
+    def function_name(self):
+        return self.get_function_name()
+
+    @cached_property
+    def payload(self):
+        return json.dumps(self.get_payload()).encode('utf8')
+
+    @threaded_cached_property
+    def lambd(self):
+        boto = BotoHelper.from_context(self.context, max_pool_connections=self.concurrency)
+        return boto.client('lambda')
+
+    def request(self):
+        kwargs = {'Qualifier': self.qualifier} if self.qualifier else {}
+        resp = self.lambd.invoke(
+            FunctionName=self.function_name,
+            Payload=self.payload,
+            LogType='Tail',
+            **kwargs,
+        )
+        payload = resp['Payload'].read().decode('utf8', 'replace')
+
+        if resp.get('FunctionError'):
+            raise RuntimeError(f"{resp['FunctionError']} error: {payload[:200]}")
+
+        log = base64.b64decode(resp.get('LogResult', '')).decode('utf8', 'replace')
+        return 'Init Duration' in log
+
+    async def build(self):
+        sh.print(f'{self.context.target}: invoking {self.function_name}')
+        await super().build()
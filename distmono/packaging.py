@@ -0,0 +1,144 @@
+from distmono.scheduler import ProcessPool
+from pathlib import Path
+import attr
+import hashlib
+import json
+import os
+import shutil
+import sys
+import zipfile
+
+
+def zip_dir(zip_file, root_dir, base_dir=None):
+    '''
+    Zip files under root_dir (or root_dir/base_dir, keeping base_dir in the
+    archive names) into zip_file, return its SHA-256.
+    '''
+    if base_dir:
+        return zip_dirs(zip_file, [(Path(root_dir) / base_dir, base_dir)])
+
+    return zip_dirs(zip_file, [(root_dir, '')])
+
+
+def zip_dirs(zip_file, sources):
+    '''
+    Zip files of (src_dir, archive_dir) sources into zip_file, return its
+    SHA-256. A file from an earlier source wins over one with the same name
+    from a later source.
+
+    Entries are sorted and timestamps fixed, so the same files always make
+    the same zip and hash.
+    '''
+    from distmono.util import walk_files
+
+    zip_file = Path(zip_file)
+    temp_file = zip_file.with_name(f'.{zip_file.name}.{os.getpid()}')
+    names = set()
+
+    with zipfile.ZipFile(temp_file, 'w', zipfile.ZIP_DEFLATED) as zf:
+        for src_dir, archive_dir in sources:
+            src_dir = Path(src_dir)
+
+            for file in walk_files(src_dir):
+                name = str(Path(archive_dir) / file.relative_to(src_dir))
+
+                if name in names:
+                    continue
+
+                names.add(name)
+                info = zipfile.ZipInfo(name)
+                info.external_attr = (file.stat().st_mode & 0o777 | 0o100000) << 16
+                info.compress_type = zipfile.ZIP_DEFLATED
+
+                # Streamed, large files are not read into memory
+                with open(file, 'rb') as src, zf.open(info, 'w') as dst:
+                    shutil.copyfileobj(src, dst, 1024 * 1024)
+
+    temp_file.replace(zip_file)
+    return file_sha256(zip_file)
+
+
+def file_sha256(file):
+    from distmono.util import hash_file
+    return hash_file(file)
+
+
+class Packager(ProcessPool):
+    '''
+    Run packaging in worker processes.
+    '''
+
+    def zip_dir(self, zip_file, root_dir, base_dir=None):
+        return self.submit(zip_dir, str(zip_file), str(root_dir), base_dir).result()
+
+    def zip_dirs(self, zip_file, sources):
+        sources = [(str(src_dir), archive_dir) for src_dir, archive_dir in sources]
+        return self.submit(zip_dirs, str(zip_file), sources).result()
+
+
+packager = Packager()
+
+
+@attr.s(kw_only=True)
+class Vendor:
+    '''
+    Install requirements into a directory for a Lambda layer. Installed
+    trees are kept in cache_dir by hash of requirements and pip arguments,
+    and downloaded wheels are cached across all of them.
+    '''
+    cache_dir = attr.ib(converter=Path)
+    python = attr.ib(default=sys.executable)
+    # e.g. ['--platform', 'manylinux2014_x86_64', '--only-binary=:all:',
+    #       '--python-version', '3.7'] to match Lambda runtime
+    pip_args = attr.ib(factory=list)
+
+    def get_key(self, requirements_file):
+        h = hashlib.sha256()
+        h.update(Path(requirements_file).read_bytes())
+        h.update(json.dumps(self.pip_args).encode('utf8'))
+        return h.hexdigest()[:32]
+
+    def vendor(self, requirements_file):
+        '''
+        Return directory with requirements installed, reusing the one
+        installed previously if requirements didn't change.
+        '''
+        from distmono.util import sh
+
+        vendor_dir = self.cache_dir / 'vendor'
+        key = self.get_key(requirements_file)
+        target_dir = vendor_dir / key
+
+        with sh.lock(vendor_dir / f'{key}.lock'):
+            if target_dir.is_dir():
+                sh.print(f'Reusing vendored requirements {target_dir}')
+                return target_dir
+
+            temp_dir = vendor_dir / f'.{key}.tmp'
+
+            if temp_dir.exists():
+                shutil.rmtree(temp_dir)
+
+            temp_dir.mkdir(parents=True)
+
+            if self.has_requirements(requirements_file):
+                sh.run([
+                    self.python, '-m', 'pip', 'install',
+                    '--disable-pip-version-check',
+                    '--requirement', requirements_file,
+                    '--target', temp_dir,
+                    '--cache-dir', self.cache_dir / 'wheels',
+                    *self.pip_args,
+                ])
+
+            temp_dir.replace(target_dir)
+            return target_dir
+
+    def has_requirements(self, requirements_file):
+        for line in Path(requirements_file).read_text().splitlines():
+            line = line.split('#', 1)[0].strip()
+
+            if line:
+                return True
+
+        return False
@@ -0,0 +1,109 @@
+from distmono.exceptions import StackDoesNotExistError, StackRecoveryError
+from distmono.util import sh
+import attr
+import time
+
+
+@attr.s(kw_only=True)
+class StackRecovery:
+    '''
+    Bring a stack left in a failed or busy state back to one CloudFormation
+    can update, the cheapest way for its state:
+
+    - *_IN_PROGRESS: wait for the operation to finish
+    - UPDATE_ROLLBACK_FAILED: continue the rollback, keeping resources
+    - ROLLBACK_COMPLETE and other failed creations: delete, so that the
+      stack is created again (it has no resources worth keeping)
+    - DELETE_FAILED: retry the delete, then create the stack again. It may
+      still have resources, those failing to delete again must be deleted
+      or retained manually
+
+    Stacks in any other state are left alone.
+    '''
+    stack_name = attr.ib()
+    boto = attr.ib()
+    cancel_token = attr.ib(default=None)
+    poll_interval = attr.ib(default=10)
+    log_prefix = attr.ib(default=None)
+
+    # Stacks never created successfully
+    recreate_statuses = {
+        'ROLLBACK_COMPLETE',
+        'ROLLBACK_FAILED',
+        'REVIEW_IN_PROGRESS',
+    }
+
+    def recover(self):
+        '''
+        Return actions taken ('wait', 'continue_rollback', 'recreate' or
+        'retry_delete').
+        '''
+        actions = []
+
+        while True:
+            status = self.get_status()
+
+            if status is None:
+                return actions
+
+            if status in self.recreate_statuses:
+                if 'recreate' in actions:
+                    raise StackRecoveryError(f'Unable to delete {self.stack_name} ({status})')
+
+                self.log(f'stack is in {status}, deleting it to create again')
+                self.cloudform.delete_stack(StackName=self.stack_name)
+                actions.append('recreate')
+            elif status == 'DELETE_FAILED':
+                if 'recreate' in actions or 'retry_delete' in actions:
+                    msg = (f'Unable to delete {self.stack_name} ({status}), resources that'
+                           ' failed to delete must be deleted or retained manually')
+                    raise StackRecoveryError(msg)
+
+                self.log(f'stack is in {status}, retrying delete to create it again')
+                self.cloudform.delete_stack(StackName=self.stack_name)
+                actions.append('retry_delete')
+            elif status.endswith('_IN_PROGRESS'):
+                self.log(f'waiting for {status}')
+                self.wait()
+                actions.append('wait')
+            elif status == 'UPDATE_ROLLBACK_FAILED':
+                if 'continue_rollback' in actions:
+                    msg = (f'Rollback of {self.stack_name} failed again, resources that'
+                           ' failed to roll back must be fixed or skipped manually')
+                    raise StackRecoveryError(msg)
+
+                self.log(f'stack is in {status}, continuing rollback')
+                self.cloudform.continue_update_rollback(StackName=self.stack_name)
+                actions.append('continue_rollback')
+            else:
+                return actions
+
+    def get_status(self):
+        try:
+            stack = self.boto.describe_stack(self.stack_name)
+        except StackDoesNotExistError:
+            return None
+
+        status = stack['StackStatus']
+        return None if status == 'DELETE_COMPLETE' else status
+
+    def wait(self):
+        while True:
+            if self.cancel_token:
+                self.cancel_token.check()
+
+            status = self.get_status()
+
+            if status is None or not status.endswith('_IN_PROGRESS') \
+                    or status in self.recreate_statuses:
+                return status
+
+            time.sleep(self.poll_interval)
+
+    def log(self, msg):
+        prefix = f'{self.log_prefix}: ' if self.log_prefix else ''
+        sh.print(f'{prefix}{msg}')
+
+    @property
+    def cloudform(self):
+        return self.boto.cloudform
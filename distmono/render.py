@@ -0,0 +1,68 @@
+'''
+Render stack templates in worker processes, see ProcessPool.
+'''
+from distmono.scheduler import ProcessPool
+from pathlib import Path
+import json
+
+
+# Projects loaded in a worker process, by (project file, mtime)
+worker_projects = {}
+
+
+def render_template(project_file, target, env, input):
+    '''
+    Return YAML body and data of template of a Stack target, in a worker
+    process with the project loaded from its file.
+    '''
+    from distmono.core import Context
+
+    project = load_worker_project(project_file)
+    dpl_cls = project.load_deployable_cls(project.get_deployables()[target])
+    context = Context(
+        project=project,
+        target=target,
+        env=env,
+        input=input,
+        build_dir=None,
+        build_output_dir=None,
+        destroy_dir=None,
+        output_store=None,
+    )
+    template = dpl_cls(context).get_template()
+    return {
+        'body': template.to_yaml(),
+        'data': json.loads(template.to_json()),
+    }
+
+
+def load_worker_project(project_file):
+    from distmono.core import load_project
+
+    key = (project_file, Path(project_file).stat().st_mtime_ns)
+    project = worker_projects.get(key)
+
+    if not project:
+        project = load_project(project_file)
+        worker_projects.clear()
+        worker_projects[key] = project
+
+    return project
+
+
+class TemplateRenderer(ProcessPool):
+    def __init__(self, *, project_file=None, max_workers=None):
+        super().__init__(max_workers)
+        self.project_file = str(project_file) if project_file else None
+
+    def render(self, target, env, input):
+        '''
+        Start rendering template of target, return future of its body and
+        data. Return None if the project wasn't loaded from a file, as
+        workers load it from there, the template is then rendered by the
+        build.
+        '''
+        if not self.project_file:
+            return None
+
+        return self.submit(render_template, self.project_file, target, env, input)
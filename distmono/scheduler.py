@@ -0,0 +1,272 @@
+from collections import Counter
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from distmono.exceptions import (
+    DeploymentCancelledError,
+    DeploymentTimeoutError,
+    TasksFailedError,
+)
+import concurrent.futures
+import multiprocessing
+import threading
+import time
+
+
+class CancelToken:
+    '''
+    Cooperative cancellation, a token is cancelled explicitly, when its
+    deadline passes or when its parent is cancelled. Work checks it between
+    steps and long running steps poll it.
+    '''
+
+    def __init__(self, timeout=None, *, parent=None):
+        self.timeout = timeout
+        self.deadline = None if timeout is None else time.monotonic() + timeout
+        self.parent = parent
+        self.event = threading.Event()
+        self.reason = None
+
+    def child(self, timeout=None):
+        return CancelToken(timeout, parent=self)
+
+    def cancel(self, reason='Cancelled'):
+        self.reason = reason
+        self.event.set()
+
+    def get_error(self):
+        '''
+        Error to raise if cancelled, None if not.
+        '''
+        if self.event.is_set():
+            return DeploymentCancelledError(self.reason)
+
+        error = self.parent and self.parent.get_error()
+
+        if error:
+            return error
+
+        if self.deadline is not None and time.monotonic() >= self.deadline:
+            return DeploymentTimeoutError(f'Timed out after {self.timeout}s')
+
+        return None
+
+    @property
+    def cancelled(self):
+        return self.get_error() is not None
+
+    def check(self):
+        error = self.get_error()
+
+        if error:
+            raise error
+
+
+class ResourcePool:
+    '''
+    Named resources with limited capacity (e.g. {'cfn_slots': 4, 'cpu': 8}),
+    resources without limit are unlimited.
+    '''
+
+    def __init__(self, limits=None):
+        self.limits = dict(limits or {})
+        self.used = Counter()
+
+    def clamp(self, resources):
+        # A task can't need more than what the pool has, or it would never run
+        return {name: min(amount, self.limits.get(name, amount))
+                for name, amount in resources.items()}
+
+    def try_acquire(self, resources):
+        resources = self.clamp(resources)
+
+        for name, amount in resources.items():
+            limit = self.limits.get(name)
+
+            if limit is not None and self.used[name] + amount > limit:
+                return False
+
+        self.used.update(resources)
+        return True
+
+    def release(self, resources):
+        self.used.subtract(self.clamp(resources))
+
+
+class InlineExecutor:
+    '''
+    Executor that runs task right away in the calling thread.
+    '''
+
+    def submit(self, func, *args):
+        future = Future()
+
+        try:
+            future.set_result(func(*args))
+        except BaseException as e:
+            future.set_exception(e)
+
+        return future
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        pass
+
+
+class ProcessPool:
+    '''
+    Worker processes started on first use, to run CPU bound work on all
+    cores instead of contending for the GIL in threads.
+    '''
+
+    def __init__(self, max_workers=None):
+        self.max_workers = max_workers
+        self.executor = None
+        self.lock = threading.Lock()
+
+    def get_executor(self):
+        with self.lock:
+            if not self.executor:
+                # Forking a process with running threads isn't safe
+                mp_context = multiprocessing.get_context('spawn')
+                self.executor = concurrent.futures.ProcessPoolExecutor(
+                    self.max_workers, mp_context=mp_context)
+
+            return self.executor
+
+    def submit(self, func, *args):
+        return self.get_executor().submit(func, *args)
+
+    def shutdown(self):
+        with self.lock:
+            if self.executor:
+                self.executor.shutdown()
+                self.executor = None
+
+
+class Scheduler:
+    '''
+    Run a task for each node of a dependency graph, in up to jobs threads.
+    A node starts once its dependencies are done and the resources it needs
+    are available, ready nodes start in the given order.
+    '''
+
+    def __init__(self, *, jobs=1, limits=None):
+        self.jobs = max(1, jobs)
+        self.pool = ResourcePool(limits)
+
+    def create_executor(self):
+        if self.jobs == 1:
+            return InlineExecutor()
+
+        return ThreadPoolExecutor(self.jobs)
+
+    def run(self, nodes, dependencies, func, *,
+            resources=None, results=None, keep_going=False, cancel=None, on_ready=None):
+        '''
+        Call func(node) for nodes, after func() of dependencies[node] are
+        done. Results are added to results dict as soon as they are
+        available. Raise the first error after running tasks are finished.
+
+        With keep_going, nodes not depending on a failed node still run, and
+        TasksFailedError is raised at the end.
+
+        Nothing more is started once cancel token is cancelled, it is also
+        cancelled on Ctrl-C so that running tasks can stop.
+
+        on_ready(node) is called once dependencies of node are done, before
+        it waits for a thread or resources, so that work for all ready nodes
+        can be started ahead.
+        '''
+        results = {} if results is None else results
+        resources = resources or (lambda node: {})
+        pending = list(nodes)
+        running = {}
+        error = None
+        errors = {}
+        skipped = []
+        ready = set()
+
+        def stopped():
+            return (error and not keep_going) or (cancel and cancel.cancelled)
+
+        with self.create_executor() as executor:
+            try:
+                while (pending and not stopped()) or running:
+                    self.skip_failed(pending, dependencies, errors, skipped)
+
+                    if on_ready and not stopped():
+                        for node in pending:
+                            deps = dependencies.get(node, [])
+
+                            if node not in ready and all(d in results for d in deps):
+                                ready.add(node)
+                                on_ready(node)
+
+                    for node in list(pending):
+                        if stopped() or len(running) >= self.jobs:
+                            break
+
+                        deps = dependencies.get(node, [])
+
+                        if not all(d in results for d in deps):
+                            continue
+
+                        needed = resources(node)
+
+                        if not self.pool.try_acquire(needed):
+                            continue
+
+                        pending.remove(node)
+                        running[executor.submit(func, node)] = (node, needed)
+
+                    if not running:
+                        if pending and not stopped():
+                            raise RuntimeError(f'Unable to schedule {pending!r}')
+
+                        break
+
+                    done, _ = wait(running, return_when=FIRST_COMPLETED)
+
+                    for future in done:
+                        node, needed = running.pop(future)
+                        self.pool.release(needed)
+
+                        try:
+                            results[node] = future.result()
+                        except BaseException as e:
+                            error = error or e
+                            errors[node] = e
+            except KeyboardInterrupt:
+                if cancel:
+                    cancel.cancel('Interrupted')
+
+                raise
+
+        if keep_going and errors and all(isinstance(e, Exception) for e in errors.values()):
+            raise TasksFailedError(errors, skipped)
+
+        if error:
+            raise error
+
+        if pending and cancel:
+            cancel.check()
+
+        return results
+
+    def skip_failed(self, pending, dependencies, errors, skipped):
+        '''
+        Move pending nodes depending on failed or skipped nodes to skipped.
+        '''
+        changed = True
+
+        while changed:
+            changed = False
+
+            for node in list(pending):
+                deps = dependencies.get(node, [])
+
+                if any(d in errors or d in skipped for d in deps):
+                    pending.remove(node)
+                    skipped.append(node)
+                    changed = True
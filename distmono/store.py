@@ -0,0 +1,208 @@
+from cached_property import cached_property
+from contextlib import contextmanager
+from pathlib import Path
+import json
+import sqlite3
+import threading
+import time
+import yaml
+
+
+class OutputStore:
+    '''
+    Build outputs of all targets in a namespace, kept in a single SQLite file.
+
+    Values are JSON encoded and indexed by (target, name). All rows are read
+    in one query on first access and served from memory afterwards, writes go
+    through a transaction and update the cache.
+
+    The journal table records how each target of the last build went, so
+    that a failed build can be resumed.
+    '''
+
+    # Files used to be scattered in build-output/<target>/
+    legacy_files = {
+        'stack-outputs.yaml': ('stack_outputs', yaml.safe_load),
+        'build-hash.txt': ('build_hash', str),
+        'code.zip.sha256': ('zip_hash', str.strip),
+    }
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.lock = threading.RLock()
+        self.cache = None
+
+    @cached_property
+    def conn(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        conn = sqlite3.connect(str(self.path),
+                               timeout=60,
+                               isolation_level=None,
+                               check_same_thread=False)
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS output (
+                target TEXT NOT NULL,
+                name TEXT NOT NULL,
+                value TEXT NOT NULL,
+                PRIMARY KEY (target, name)
+            )
+        ''')
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS journal (
+                target TEXT PRIMARY KEY,
+                status TEXT NOT NULL,
+                input_hash TEXT,
+                output TEXT,
+                error TEXT,
+                updated REAL NOT NULL
+            )
+        ''')
+        return conn
+
+    @contextmanager
+    def transaction(self):
+        with self.lock:
+            conn = self.conn
+            conn.execute('BEGIN IMMEDIATE')
+
+            try:
+                yield conn
+            except BaseException:
+                conn.execute('ROLLBACK')
+                raise
+            else:
+                conn.execute('COMMIT')
+
+    def load(self):
+        with self.lock:
+            rows = self.conn.execute('SELECT target, name, value FROM output')
+            cache = {}
+
+            for target, name, value in rows:
+                cache.setdefault(target, {})[name] = json.loads(value)
+
+            self.cache = cache
+            return cache
+
+    def refresh(self, target):
+        '''
+        Re-read outputs of a target, which might have been changed by another
+        process.
+        '''
+        with self.lock:
+            cache = self.get_cache()
+            rows = self.conn.execute(
+                'SELECT name, value FROM output WHERE target = ?', (target,))
+            values = {name: json.loads(value) for name, value in rows}
+
+            if values:
+                cache[target] = values
+            else:
+                cache.pop(target, None)
+
+    def get_cache(self):
+        with self.lock:
+            if self.cache is None:
+                self.load()
+
+            return self.cache
+
+    def get(self, target, name, default=None):
+        return self.get_cache().get(target, {}).get(name, default)
+
+    def get_target(self, target):
+        return dict(self.get_cache().get(target, {}))
+
+    def get_all(self):
+        return {t: dict(v) for t, v in self.get_cache().items()}
+
+    def update(self, target, values):
+        '''
+        Atomically set outputs of a target, None value deletes the output.
+        '''
+        with self.transaction() as conn:
+            for name, value in values.items():
+                if value is None:
+                    conn.execute('DELETE FROM output WHERE target = ? AND name = ?',
+                                 (target, name))
+                else:
+                    conn.execute('INSERT OR REPLACE INTO output VALUES (?, ?, ?)',
+                                 (target, name, json.dumps(value)))
+
+            cached = self.get_cache().setdefault(target, {})
+
+            for name, value in values.items():
+                if value is None:
+                    cached.pop(name, None)
+                else:
+                    cached[name] = value
+
+    def delete(self, *targets):
+        with self.transaction() as conn:
+            for target in targets:
+                conn.execute('DELETE FROM output WHERE target = ?', (target,))
+                self.get_cache().pop(target, None)
+
+    def get_journal(self, target):
+        '''
+        Journal entry of target from the last run that built it, None if
+        there isn't one.
+        '''
+        with self.lock:
+            row = self.conn.execute(
+                'SELECT status, input_hash, output, error, updated FROM journal'
+                ' WHERE target = ?', (target,)).fetchone()
+
+        if not row:
+            return None
+
+        status, input_hash, output, error, updated = row
+        return {
+            'status': status,
+            'input_hash': input_hash,
+            'output': None if output is None else json.loads(output),
+            'error': error,
+            'updated': updated,
+        }
+
+    def update_journal(self, target, status, *, input_hash=None, output=None, error=None):
+        output = None if output is None else json.dumps(output)
+
+        with self.transaction() as conn:
+            conn.execute('INSERT OR REPLACE INTO journal VALUES (?, ?, ?, ?, ?, ?)',
+                         (target, status, input_hash, output, error, time.time()))
+
+    def clear_journal(self, *targets):
+        with self.transaction() as conn:
+            for target in targets:
+                conn.execute('DELETE FROM journal WHERE target = ?', (target,))
+
+    def migrate(self, build_output_dir):
+        '''
+        Import outputs from the old per-target files and remove them.
+        '''
+        build_output_dir = Path(build_output_dir)
+
+        if not build_output_dir.is_dir():
+            return
+
+        migrated = []
+
+        with self.transaction() as conn:
+            for target_dir in sorted(build_output_dir.iterdir()):
+                for filename, (name, parse) in self.legacy_files.items():
+                    file = target_dir / filename
+
+                    if not file.is_file():
+                        continue
+
+                    value = parse(file.read_text())
+                    conn.execute('INSERT OR REPLACE INTO output VALUES (?, ?, ?)',
+                                 (target_dir.name, name, json.dumps(value)))
+                    migrated.append(file)
+
+        for file in migrated:
+            file.unlink()
+
+        if migrated:
+            self.cache = None
@@ -0,0 +1,31 @@
+from distmono.cache import BuildCache, LocalBuildCache, S3BuildCache
+import pytest
+
+
+class TestFromUrl:
+    def test_local(self, tmp_path):
+        cache = BuildCache.from_url(str(tmp_path), region='ap-southeast-1')
+        assert cache == LocalBuildCache(cache_dir=tmp_path)
+
+    def test_s3(self):
+        cache = BuildCache.from_url('s3://bucket/some/prefix/', region='ap-southeast-1')
+        assert cache == S3BuildCache(bucket='bucket',
+                                     prefix='some/prefix',
+                                     region='ap-southeast-1')
+        assert cache.get_key('a/b') == 'some/prefix/a/b.json'
+
+    def test_invalid(self):
+        with pytest.raises(ValueError, match="Unsupported build cache URL 'ftp://x'"):
+            BuildCache.from_url('ftp://x', region='ap-southeast-1')
+
+
+class TestLocalBuildCache:
+    def test_get_put(self, tmp_path):
+        cache = LocalBuildCache(cache_dir=tmp_path)
+        assert cache.get('ns/a/123') is None
+        cache.put('ns/a/123', {'build_hash': '123'})
+        assert cache.get('ns/a/123') == {'build_hash': '123'}
+        assert [p.name for p in (tmp_path / 'ns/a').iterdir()] == ['123.json']
+        cache.delete('ns/a/123')
+        cache.delete('ns/a/123')
+        assert cache.get('ns/a/123') is None
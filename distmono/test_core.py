@@ -1,7 +1,33 @@
-from distmono.core import Deployable, DeploymentGraph, load_project, Project
-from distmono.exceptions import CircularDependencyError, ConfigError
+from distmono.core import (
+    Builder,
+    Deployable,
+    DeploymentGraph,
+    load_project,
+    Project,
+    Stack,
+    StackGroup,
+    StackProbe,
+    Watcher,
+)
+from distmono.exceptions import (
+    BuildOutputNotFoundError,
+    CircularDependencyError,
+    ConfigError,
+    DeploymentTimeoutError,
+    TasksFailedError,
+)
+from distmono.hotswap import Hotswap
+from distmono.util import BotoHelper, sh
+from pathlib import Path
 from textwrap import dedent
+from troposphere import Output, Template
+import asyncio
+import fcntl
 import pytest
+import sys
+import threading
+import time
+import yaml
 
 
 @pytest.fixture
@@ -117,6 +143,38 @@ class TestDeploymentGraph:
         with pytest.raises(ValueError, match=r"Invalid target 'v',"):
             g.predecessors('v')
 
+    def test_dependents(self):
+        g = self.graph(['a', 'b1', 'b2', 'c', 'd'], {
+            'b1': 'a',
+            'b2': 'a',
+            'c': 'b1',
+        })
+        assert sorted(g.dependents('a')) == ['b1', 'b2', 'c']
+        assert g.dependents('b1') == ['c']
+        assert g.dependents('d') == []
+
+    def test_select(self):
+        g = self.graph(['bucket', 'api-code', 'web-code', 'api', 'web', 'all'], {
+            'api-code': 'bucket',
+            'web-code': 'bucket',
+            'api': 'api-code',
+            'web': 'web-code',
+            'all': ['api', 'web'],
+        })
+        assert g.select(['api']) == ['bucket', 'api-code', 'api']
+        assert g.select(['api', 'web']) == [
+            'bucket', 'api-code', 'api', 'web-code', 'web']
+        assert g.select(['*-code']) == ['bucket', 'api-code', 'web-code']
+        assert g.select(['*-code'], only=True) == ['api-code', 'web-code']
+        assert g.select(['all'], start='api-code') == ['api-code', 'api', 'all']
+        assert g.select(['web'], start=['api-code']) == []
+
+        with pytest.raises(ValueError, match=r"No target matches 'x\*'"):
+            g.select(['x*'])
+
+        with pytest.raises(ValueError, match=r"Invalid target 'x',"):
+            g.select(['x'])
+
 
 class TestBuildDependency:
     @pytest.fixture
@@ -183,6 +241,23 @@ class TestBuildDependency:
         assert project.log == ['A', 'B1', 'B2', 'C']
         assert output == {'cat': 1}
 
+    def test_build_targets(self, project):
+        output = project.build(['b1', 'b2'])
+        assert project.log == ['A', 'B1', 'B2']
+        assert output == {'a': {'apple': 1}, 'b1': {'boy': 1}, 'b2': {'boy': 2}}
+
+    def test_build_only(self, project):
+        project.build()
+        project.log.clear()
+        assert project.build('b*', only=True) == {'b1': {'boy': 1}, 'b2': {'boy': 2}}
+        assert project.log == ['B1', 'B2']
+
+    def test_build_start(self, project):
+        project.build()
+        project.log.clear()
+        assert project.build(start='b2') == {'b2': {'boy': 2}, 'c': {'cat': 1}}
+        assert project.log == ['B2', 'C']
+
     def test_destroy(self, project):
         project.destroy()
         assert project.log == ['~C', '~B1', '~B2', '~A']
@@ -191,6 +266,183 @@ class TestBuildDependency:
         project.destroy('a')
         assert project.log == ['~C', '~B1', '~B2', '~A']
 
+    def test_build_parallel(self, project):
+        output = project.build(jobs=4)
+        assert project.log[0] == 'A'
+        assert sorted(project.log[1:3]) == ['B1', 'B2']
+        assert project.log[3] == 'C'
+        assert output == {'cat': 1}
+
+    def test_destroy_parallel(self, project):
+        project.destroy('a', jobs=4)
+        assert project.log[0] == '~C'
+        assert sorted(project.log[1:3]) == ['~B1', '~B2']
+        assert project.log[3] == '~A'
+
+    def test_work_dir_parallel(self, tmp_path, env, monkeypatch):
+        class TestProject(Project):
+            def get_deployables(self):
+                return {'a': A, 'b': B, 'safe': Safe}
+
+            def get_dependencies(self):
+                return {}
+
+        class A(Deployable):
+            def build(self):
+                Path('log').write_text(self.context.target)
+                time.sleep(0.05)
+                assert Path('log').read_text() == self.context.target
+
+        class B(A):
+            pass
+
+        class Safe(Deployable):
+            parallel_safe = True
+
+            def build(self):
+                (self.context.build_dir / 'log').write_text('safe')
+
+        cwd = tmp_path / 'cwd'
+        cwd.mkdir()
+        monkeypatch.chdir(cwd)
+        project = TestProject(project_dir=tmp_path, env=env)
+        project.build(['a', 'b', 'safe'], jobs=3)
+        assert list(cwd.iterdir()) == []
+
+        for target in ('a', 'b', 'safe'):
+            build_dir = project.get_namespace_dir() / 'build' / target
+            assert (build_dir / 'log').exists()
+
+
+class TestResume:
+    @pytest.fixture
+    def project(self, tmp_path, env):
+        class TestProject(Project):
+            log = []
+            broken = {'b'}
+            build_hashes = {}
+
+            def get_deployables(self):
+                return {'a': Common, 'b': Common, 'c': Common, 'd': Common}
+
+            def get_dependencies(self):
+                return {'b': 'a', 'c': 'b', 'd': 'a'}
+
+            def get_default_build_target(self):
+                return ['c', 'd']
+
+        class Common(Deployable):
+            def build(self):
+                target = self.context.target
+                self.context.project.log.append(target)
+
+                if target in self.context.project.broken:
+                    raise RuntimeError(f'{target} is broken')
+
+            def get_build_output(self):
+                return {'target': self.context.target}
+
+            def get_build_hash(self):
+                return self.context.project.build_hashes.get(self.context.target)
+
+        return TestProject(project_dir=tmp_path, env=env)
+
+    def test_resume(self, project):
+        with pytest.raises(RuntimeError, match='b is broken'):
+            project.build()
+
+        assert project.log == ['a', 'b']
+        project.log.clear()
+        project.broken.clear()
+        output = project.build(resume=True)
+        assert project.log == ['b', 'c', 'd']
+        assert output['c'] == {'target': 'c'}
+
+        project.log.clear()
+        project.build()
+        assert project.log == ['a', 'b', 'c', 'd']
+
+    def test_keep_going(self, project):
+        with pytest.raises(TasksFailedError, match='Failed: b; skipped: c'):
+            project.build(keep_going=True)
+
+        assert project.log == ['a', 'b', 'd']
+        project.log.clear()
+        project.broken.clear()
+        project.build(resume=True)
+        assert project.log == ['b', 'c']
+
+    def test_destroyed(self, project):
+        with pytest.raises(RuntimeError, match='b is broken'):
+            project.build()
+
+        project.destroy()
+        project.log.clear()
+        project.broken.clear()
+        project.build(resume=True)
+        assert project.log == ['a', 'b', 'c', 'd']
+
+    def test_cleared(self, project):
+        with pytest.raises(RuntimeError, match='b is broken'):
+            project.build()
+
+        project.clear_build_outputs(['a'])
+        project.log.clear()
+        project.broken.clear()
+        project.build(resume=True)
+        assert project.log == ['a', 'b', 'c', 'd']
+
+    def test_source_changed(self, project):
+        project.build_hashes['a'] = 'hash1'
+
+        with pytest.raises(RuntimeError, match='b is broken'):
+            project.build()
+
+        project.build_hashes['a'] = 'hash2'
+        project.log.clear()
+        project.broken.clear()
+        project.build(resume=True)
+        assert project.log == ['a', 'b', 'c', 'd']
+
+
+class TestTimeout:
+    @pytest.fixture
+    def project(self, tmp_path, env):
+        class TestProject(Project):
+            def get_deployables(self):
+                return {'fast': Fast, 'slow': Slow}
+
+            def get_dependencies(self):
+                return {'slow': 'fast'}
+
+            def get_default_build_target(self):
+                return 'slow'
+
+        class Fast(Deployable):
+            pass
+
+        class Slow(Deployable):
+            timeout = 0.2
+
+            async def build(self):
+                await asyncio.sleep(10)
+
+        return TestProject(project_dir=tmp_path, env=env)
+
+    def test_target_timeout(self, project):
+        with pytest.raises(DeploymentTimeoutError):
+            project.build()
+
+        store = project.get_output_store()
+        assert store.get_journal('fast')['status'] == 'done'
+        assert store.get_journal('slow')['status'] == 'interrupted'
+
+    def test_timeout(self, project, env):
+        project.env = dict(env, target_timeout=10)
+
+        with pytest.raises(DeploymentTimeoutError, match='0.1s'):
+            project.build(timeout=0.1)
+
 
 class TestBuildDirs:
     @pytest.fixture
@@ -241,31 +493,804 @@ class TestBuildDirs:
 
     def test_build(self, project):
         project.build()
-        build_dir = project.temp_dir / 'build'
+        build_dir = project.get_namespace_dir() / 'build'
         assert (build_dir / 'a/log').read_text() == 'A was here\n'
         assert (build_dir / 'b/log').read_text() == 'B was here\n'
 
     def test_build_output(self, project):
         project.build()
-        tdir = project.temp_dir
+        tdir = project.get_namespace_dir()
         assert (tdir / 'build/a/log').read_text() == 'A was here\n'
         assert (tdir / 'build-output/a/output').read_text() == 'A output\n'
         project.build()
         assert (tdir / 'build/a/log').read_text() == 'A was here\n'
         assert (tdir / 'build-output/a/output').read_text() == 'A output\nA output\n'
 
+    def test_lock(self, project):
+        lock_file = project.get_namespace_dir() / 'lock/a.lock'
+
+        with sh.lock(lock_file):
+            project.build('b')
+            assert (project.get_namespace_dir() / 'build/b/log').exists()
+
+            thread = threading.Thread(target=project.build, args=['a'])
+            thread.start()
+            thread.join(0.5)
+            assert thread.is_alive()
+            assert not (project.get_namespace_dir() / 'build/a').exists()
+
+        thread.join()
+        assert (project.get_namespace_dir() / 'build/a/log').exists()
+
+    def test_lock_refresh_error(self, project, monkeypatch):
+        store = project.get_output_store()
+
+        def refresh(target):
+            raise RuntimeError('refresh failed')
+
+        monkeypatch.setattr(store, 'refresh', refresh)
+
+        with pytest.raises(RuntimeError, match='refresh failed'):
+            with Builder(project, 'a').lock('a'):
+                pass
+
+        lock_file = project.get_namespace_dir() / 'lock/a.lock'
+
+        with open(lock_file) as f:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+
     def test_transient_build_dir(self, project):
         project.build()
         project.build()
-        assert (project.temp_dir / 'build/a/log').read_text() == 'A was here\n'
+        assert (project.get_namespace_dir() / 'build/a/log').read_text() == 'A was here\n'
 
     def test_destroy(self, project):
         project.destroy()
-        destroy_dir = project.temp_dir / 'destroy'
+        destroy_dir = project.get_namespace_dir() / 'destroy'
         assert (destroy_dir / 'a/log').read_text() == 'A is dead\n'
         assert (destroy_dir / 'b/log').read_text() == 'B is dead\n'
 
     def test_transient_destroy_dir(self, project):
         project.destroy()
         project.destroy()
-        assert (project.temp_dir / 'destroy/b/log').read_text() == 'B is dead\n'
+        assert (project.get_namespace_dir() / 'destroy/b/log').read_text() == 'B is dead\n'
+
+
+class TestBuildOutputStore:
+    @pytest.fixture
+    def project(self, tmp_path, env):
+        class TestProject(Project):
+            def get_deployables(self):
+                return {
+                    'a': A,
+                    'b': B,
+                }
+
+            def get_dependencies(self):
+                return {'b': 'a'}
+
+            def get_default_build_target(self):
+                return 'b'
+
+        class A(Deployable):
+            def build(self):
+                self.save_output(count=self.load_output('count', 0) + 1)
+
+            def get_build_output(self):
+                return {'count': self.require_output('count')}
+
+        class B(Deployable):
+            def get_build_output(self):
+                return self.context.input['a']
+
+        return TestProject(project_dir=tmp_path, env=env)
+
+    def test_build(self, project):
+        assert project.build() == {'count': 1}
+        assert project.build() == {'count': 2}
+        assert project.get_output_store().get_all() == {
+            'a': {'count': 2, 'build_output': {'count': 2}},
+            'b': {'build_output': {'count': 2}},
+        }
+
+    def test_clear(self, project):
+        project.build()
+        project.clear_build_outputs(['a', 'b'])
+        assert project.get_output_store().get_all() == {}
+
+    def test_destroy(self, project):
+        project.build()
+        project.destroy()
+        assert project.get_output_store().get_all() == {}
+
+    def test_not_found(self, project):
+        with pytest.raises(BuildOutputNotFoundError, match=r"'count' of 'a' not found"):
+            project.destroy('b')
+
+
+class TestBuildCache:
+    def create_project(self, project_dir, env, *, build_hash='hash1', stack=False):
+        class TestProject(Project):
+            log = []
+            drifted = False
+
+            def get_deployables(self):
+                return {
+                    'a': StackA if stack else A,
+                    'b': B,
+                }
+
+            def get_dependencies(self):
+                return {'b': 'a'}
+
+            def get_default_build_target(self):
+                return 'b'
+
+        class A(Deployable):
+            def build(self):
+                self.context.project.log.append('A')
+                self.save_output(build_hash=self.get_build_hash(), value='apple')
+
+            def is_build_outdated(self):
+                return self.load_output('build_hash') != self.get_build_hash()
+
+            def get_build_hash(self):
+                return build_hash
+
+            def get_build_output(self):
+                return self.require_output('value')
+
+        class StackA(A, Stack):
+            def is_build_outdated(self):
+                return A.is_build_outdated(self) or self.context.project.drifted
+
+            def destroy(self):
+                pass
+
+        class B(Deployable):
+            def build(self):
+                self.context.project.log.append('B')
+
+            def get_build_output(self):
+                return self.context.input['a']
+
+        return TestProject(project_dir=project_dir, env=env)
+
+    @pytest.fixture
+    def env(self, env, tmp_path):
+        return dict(env, build_cache=str(tmp_path / 'cache'))
+
+    def test_shared(self, tmp_path, env):
+        project1 = self.create_project(tmp_path / 'checkout1', env)
+        assert project1.build() == 'apple'
+        assert project1.log == ['A', 'B']
+
+        project2 = self.create_project(tmp_path / 'checkout2', env)
+        assert project2.build() == 'apple'
+        assert project2.log == ['B']
+        assert project2.get_output_store().get_target('a') == {
+            'build_hash': 'hash1',
+            'value': 'apple',
+            'build_output': 'apple',
+        }
+
+    def test_namespace(self, tmp_path, env):
+        self.create_project(tmp_path / 'checkout1', env).build()
+        env = dict(env, namespace='other')
+        project = self.create_project(tmp_path / 'checkout2', env)
+        project.build()
+        assert project.log == ['A', 'B']
+
+    def test_latest(self, tmp_path, env):
+        self.create_project(tmp_path / 'checkout1', env).build()
+        project = self.create_project(tmp_path / 'checkout2', env, build_hash='hash2')
+        project.build()
+        assert project.log == ['A', 'B']
+
+        # Namespace has hash2 deployed now
+        project = self.create_project(tmp_path / 'checkout3', env)
+        project.build()
+        assert project.log == ['A', 'B']
+
+    def test_destroy(self, tmp_path, env):
+        project = self.create_project(tmp_path / 'checkout1', env)
+        project.build()
+        project.destroy()
+        project = self.create_project(tmp_path / 'checkout2', env)
+        project.build()
+        assert project.log == ['A', 'B']
+
+    def test_stack_drifted(self, tmp_path, env):
+        self.create_project(tmp_path / 'checkout1', env, stack=True).build()
+        project = self.create_project(tmp_path / 'checkout2', env, stack=True)
+        project.drifted = True
+        project.build()
+        assert project.log == ['A', 'B']
+
+        project = self.create_project(tmp_path / 'checkout3', env, stack=True)
+        project.build()
+        assert project.log == ['B']
+
+
+class TestAsyncDeployable:
+    @pytest.fixture
+    def project(self, tmp_path, env):
+        class TestProject(Project):
+            log = []
+
+            def get_deployables(self):
+                return {'a': A}
+
+            def get_dependencies(self):
+                return {}
+
+            def get_default_build_target(self):
+                return 'a'
+
+        class A(Deployable):
+            async def build(self):
+                await asyncio.sleep(0)
+                self.context.project.log.append('A')
+
+            async def destroy(self):
+                await asyncio.sleep(0)
+                self.context.project.log.append('~A')
+
+        return TestProject(project_dir=tmp_path, env=env)
+
+    def test_build(self, project):
+        project.build()
+        project.destroy()
+        assert project.log == ['A', '~A']
+
+
+class TestWatch:
+    @pytest.fixture
+    def project(self, tmp_path, env):
+        src_dir = tmp_path / 'src'
+        src_dir.mkdir()
+        (src_dir / 'a.txt').write_text('a')
+        (src_dir / 'b.txt').write_text('b')
+
+        class TestProject(Project):
+            log = []
+
+            def get_deployables(self):
+                return {
+                    'a': Source,
+                    'b': Source,
+                    'ab': Deployable,
+                    'c': C,
+                    'all': Deployable,
+                }
+
+            def get_dependencies(self):
+                return {
+                    'ab': ['a', 'b'],
+                    'all': ['ab', 'c'],
+                }
+
+            def get_default_build_target(self):
+                return 'all'
+
+        class Source(Deployable):
+            def build(self):
+                self.context.project.log.append(self.context.target)
+
+                if (src_dir / 'b.txt').read_text() == 'broken':
+                    raise RuntimeError('broken')
+
+            def get_watch_paths(self):
+                return [src_dir / f'{self.context.target}.txt']
+
+        class C(Source):
+            def get_watch_paths(self):
+                return [src_dir]
+
+        return TestProject(project_dir=tmp_path, env=env)
+
+    def test_poll(self, project, tmp_path):
+        watcher = Watcher(project, 'all')
+        watcher.start()
+        assert project.log == ['a', 'b', 'c']
+        assert watcher.poll() == []
+
+        project.log.clear()
+        (tmp_path / 'src/a.txt').write_text('apple')
+        assert watcher.poll() == ['a', 'c']
+        assert project.log == ['a', 'c']
+        assert set(watcher.builds) == {'a', 'b', 'ab', 'c', 'all'}
+
+        project.log.clear()
+        (tmp_path / 'src/new.txt').write_text('new')
+        assert watcher.poll() == ['c']
+        assert project.log == ['c']
+
+    def test_build_error(self, project, tmp_path):
+        watcher = Watcher(project, 'all')
+        watcher.start()
+
+        project.log.clear()
+        (tmp_path / 'src/b.txt').write_text('broken')
+        assert watcher.poll() == ['b', 'c']
+        assert project.log == ['b']
+        assert 'b' not in watcher.builds
+
+        project.log.clear()
+        (tmp_path / 'src/b.txt').write_text('bee')
+        assert watcher.poll() == ['b', 'c']
+        assert project.log == ['b', 'c']
+
+
+class TestStackOutdated:
+    def create_stack(self, tmp_path, env):
+        class TestProject(Project):
+            def get_deployables(self):
+                return {'stack': TestStack}
+
+            def get_dependencies(self):
+                return {}
+
+        class TestStack(Stack):
+            stack_code = 'test'
+
+            def get_template(self):
+                t = Template()
+                t.add_output(Output('Name', Value='test'))
+                return t
+
+        env = dict(env, check_drift=False)
+        project = TestProject(project_dir=tmp_path, env=env)
+        return Builder(project, 'stack').create_deployable('stack', {})
+
+    def test_build_hash(self, tmp_path, env):
+        stack = self.create_stack(tmp_path, env)
+
+        with sh.chdir(stack.context.build_dir):
+            assert stack.is_build_outdated()
+            stack.save_output(build_hash=stack.get_build_hash())
+            assert not stack.is_build_outdated()
+            stack.save_output(build_hash='previous')
+            assert stack.is_build_outdated()
+
+    def test_hotswapped(self, tmp_path, env):
+        stack = self.create_stack(tmp_path, dict(env, hotswap=True))
+
+        with sh.chdir(stack.context.build_dir):
+            build_hash = stack.get_build_hash()
+            stack.save_output(build_hash='previous', hotswap_hash=build_hash)
+            assert not stack.is_build_outdated()
+            # Reverted to what the last stack update deployed
+            stack.save_output(build_hash=build_hash, hotswap_hash='hot-swapped')
+            assert stack.is_build_outdated()
+            stack.save_output(build_hash='previous', hotswap_hash=build_hash)
+
+        stack = self.create_stack(tmp_path, env)
+
+        with sh.chdir(stack.context.build_dir):
+            assert stack.is_build_outdated()
+            stack.save_output(build_hash=build_hash)
+            assert stack.is_build_outdated()
+            stack.save_output(hotswap_hash=None)
+            assert not stack.is_build_outdated()
+
+    def test_hotswap_reverted(self, tmp_path, env, monkeypatch):
+        applied = []
+
+        def apply(hotswap):
+            applied.append((hotswap.old_template, hotswap.new_template))
+            return ['Function']
+
+        monkeypatch.setattr(Hotswap, 'apply', apply)
+        stack = self.create_stack(tmp_path, dict(env, hotswap=True))
+        v1 = stack.get_template_data()
+        v2 = {'Resources': {'Function': {'Code': 'v2'}}}
+
+        with sh.chdir(stack.context.build_dir):
+            build_hash = stack.get_build_hash()
+            stack.save_output(build_hash=build_hash, template=v1,
+                              hotswap_hash='v2', hotswap_template=v2)
+            assert stack.hotswap()
+            assert applied == [(v2, v1)]
+            assert stack.load_output('hotswap_hash') is None
+            assert stack.load_output('hotswap_template') is None
+
+    def test_revert_hotswap(self, tmp_path, env, monkeypatch):
+        applied = []
+
+        def apply(hotswap):
+            applied.append((hotswap.old_template, hotswap.new_template))
+            return ['Function']
+
+        monkeypatch.setattr(Hotswap, 'apply', apply)
+        stack = self.create_stack(tmp_path, env)
+        v1 = {'Resources': {'Function': {'Code': 'v1'}}}
+        v2 = {'Resources': {'Function': {'Code': 'v2'}}}
+
+        with sh.chdir(stack.context.build_dir):
+            stack.revert_hotswap()
+            assert applied == []
+
+            stack.save_output(template=v1, hotswap_hash='v2', hotswap_template=v2)
+            stack.revert_hotswap()
+            assert applied == [(v2, v1)]
+            assert stack.load_output('hotswap_hash') is None
+
+    def test_tags(self, tmp_path, env):
+        stack = self.create_stack(tmp_path, env)
+
+        with sh.chdir(stack.context.build_dir):
+            build_hash = stack.get_build_hash()
+            config = yaml.safe_load(stack.stacker.config_file.read_text())
+            assert config['stacks'][0]['template_path'] == 'stack.yaml'
+            tags = config['stacks'][0]['tags']
+            assert tags == {'distmono:build-hash': build_hash}
+
+            stack.generate_stacker_files()
+            assert stack.get_build_hash() == build_hash
+
+    def test_class_tags(self, tmp_path, env):
+        stack = self.create_stack(tmp_path, env)
+        tags = {'team': 'api'}
+        type(stack).get_tags = lambda self: tags
+
+        with sh.chdir(stack.context.build_dir):
+            stack.generate_stacker_files()
+            assert stack.stacker.tags['team'] == 'api'
+            assert tags == {'team': 'api'}
+
+    def test_drift(self, tmp_path, env):
+        stack = self.create_stack(tmp_path, env)
+        live = {
+            'StackName': 'distmono-test',
+            'StackStatus': 'UPDATE_COMPLETE',
+            'CreationTime': '2021-10-01',
+            'LastUpdatedTime': '2021-10-02',
+        }
+
+        class FakeBoto(BotoHelper):
+            def describe_stacks(self):
+                return [live]
+
+        stack.context.stack_probe = StackProbe(boto=FakeBoto(region='ap-southeast-1'))
+
+        with sh.chdir(stack.context.build_dir):
+            build_hash = stack.get_build_hash()
+            live['Tags'] = [{'Key': 'distmono:build-hash', 'Value': build_hash}]
+            stack.save_output(build_hash=build_hash, stack_updated='2021-10-02')
+            assert not stack.is_build_outdated()
+
+            live['LastUpdatedTime'] = '2021-10-03'
+            assert stack.is_build_outdated()
+            live['LastUpdatedTime'] = '2021-10-02'
+
+            live['StackStatus'] = 'UPDATE_ROLLBACK_COMPLETE'
+            assert stack.is_build_outdated()
+            live['StackStatus'] = 'UPDATE_COMPLETE'
+
+            live['Tags'] = [{'Key': 'distmono:build-hash', 'Value': 'other'}]
+            assert stack.is_build_outdated()
+
+            live['StackName'] = 'distmono-deleted'
+            stack.context.stack_probe = StackProbe(boto=FakeBoto(region='ap-southeast-1'))
+            assert stack.is_build_outdated()
+
+    def test_template_data(self, tmp_path, env):
+        stack = self.create_stack(tmp_path, env)
+        assert stack.get_template_data() == {
+            'Outputs': {'Name': {'Value': 'test'}},
+            'Resources': {},
+        }
+
+
+class TestOutputs:
+    @pytest.fixture
+    def project(self, tmp_path, env):
+        class TestProject(Project):
+            def get_deployables(self):
+                return {
+                    'a': A,
+                    'stack': TestStack,
+                    'other-stack': OtherStack,
+                    'custom-stack': CustomStack,
+                    'unserializable': Unserializable,
+                }
+
+            def get_dependencies(self):
+                return {'stack': 'a'}
+
+            def get_default_build_target(self):
+                return 'stack'
+
+        class A(Deployable):
+            def get_build_output(self):
+                return {'apple': 1}
+
+        class TestStack(Stack):
+            stack_code = 'test'
+
+        class OtherStack(Stack):
+            stack_code = 'other'
+
+        class CustomStack(Stack):
+            def get_namespace(self):
+                return 'custom'
+
+            def get_stack_code(self):
+                return self.context.target
+
+        class Unserializable(Deployable):
+            def get_build_output(self):
+                return {'lock': threading.Lock}
+
+        return TestProject(project_dir=tmp_path, env=env)
+
+    @pytest.fixture
+    def describe_stacks(self, monkeypatch):
+        calls = []
+
+        def describe_stacks(boto):
+            calls.append(boto.region)
+            return [
+                {'StackName': 'distmono-test', 'Outputs': [
+                    {'OutputKey': 'Url', 'OutputValue': 'https://test'},
+                ]},
+                {'StackName': 'distmono-other'},
+                {'StackName': 'custom-custom-stack', 'Outputs': [
+                    {'OutputKey': 'Name', 'OutputValue': 'custom'},
+                ]},
+                {'StackName': 'someone-else'},
+            ]
+
+        monkeypatch.setattr(BotoHelper, 'describe_stacks', describe_stacks)
+        return calls
+
+    def test_saved(self, project, describe_stacks):
+        store = project.get_output_store()
+        store.update('a', {'build_output': {'apple': 1}})
+        store.update('stack', {'build_output': {'Url': 'https://saved'}})
+        assert project.get_outputs('stack') == {'Url': 'https://saved'}
+        assert project.get_outputs('a') == {'apple': 1}
+        assert describe_stacks == []
+        assert not (project.get_namespace_dir() / 'build').exists()
+
+    def test_fetch_stacks(self, project, describe_stacks):
+        assert project.get_outputs() == {
+            'stack': {'Url': 'https://test'},
+            'other-stack': {},
+            'custom-stack': {'Name': 'custom'},
+        }
+        assert describe_stacks == ['ap-southeast-1']
+        assert project.get_output_store().get('stack', 'build_output') == {
+            'Url': 'https://test',
+        }
+        assert project.get_outputs('stack') == {'Url': 'https://test'}
+        assert describe_stacks == ['ap-southeast-1']
+
+    def test_refresh(self, project, describe_stacks):
+        project.get_output_store().update('stack', {'build_output': {'Url': 'https://old'}})
+        assert project.get_outputs('stack', refresh=True) == {'Url': 'https://test'}
+
+    def test_not_found(self, project, describe_stacks):
+        with pytest.raises(BuildOutputNotFoundError, match="output of 'a' not found"):
+            project.get_outputs('a')
+
+    def test_build(self, project, describe_stacks):
+        project.build('a')
+        assert project.get_outputs('a') == {'apple': 1}
+        assert describe_stacks == []
+
+    def test_unserializable(self, project, describe_stacks):
+        assert project.build('unserializable') == {'lock': threading.Lock}
+        store = project.get_output_store()
+        assert store.get('unserializable', 'build_output') is None
+        assert store.get_journal('unserializable') is None
+
+
+class TestStackGroup:
+    @pytest.fixture
+    def project(self, tmp_path, env):
+        class TestProject(Project):
+            def get_deployables(self):
+                return {
+                    'a': A,
+                    'buckets-stack': BucketsStack,
+                    'access-stack': AccessStack,
+                    'b': B,
+                }
+
+            def get_dependencies(self):
+                return {
+                    'buckets-stack': 'a',
+                    'access-stack': 'a',
+                    'b': 'access-stack',
+                }
+
+            def get_default_build_target(self):
+                return 'b'
+
+            def get_stack_groups(self):
+                return {'base-stack': ['buckets-stack', 'access-stack']}
+
+        class A(Deployable):
+            def get_build_output(self):
+                return {'apple': 1}
+
+        class BucketsStack(Stack):
+            def get_template(self):
+                t = Template()
+                t.add_output(Output('BucketName', Value='bucket'))
+                return t
+
+        class AccessStack(Stack):
+            def get_template(self):
+                t = Template()
+                t.add_output(Output('RoleArn', Value=str(self.context.input['a']['apple'])))
+                return t
+
+        class B(Deployable):
+            def build(self):
+                self.save_output(input=self.context.input)
+
+            def get_build_output(self):
+                return self.require_output('input')
+
+        env = dict(env, template_bucket='templates', check_drift=False)
+        return TestProject(project_dir=tmp_path, env=env)
+
+    def test_graph(self, project):
+        builder = Builder(project, 'b')
+        assert set(builder.graph.nodes) == {'a', 'base-stack', 'b'}
+        assert builder.graph.successors('base-stack') == ['a']
+        assert builder.graph.successors('b') == ['base-stack']
+        assert builder.resolve_target('access-stack') == 'base-stack'
+
+    def test_invalid(self, project):
+        project.get_stack_groups = lambda: {'base-stack': ['a']}
+
+        with pytest.raises(ConfigError, match="member 'a' is not a Stack"):
+            Builder(project, 'b').graph
+
+        project.get_stack_groups = lambda: {'b': ['buckets-stack']}
+
+        with pytest.raises(ConfigError, match="'b' has the name of a target"):
+            Builder(project, 'b').graph
+
+        project.get_dependencies = lambda: {'access-stack': 'buckets-stack'}
+        project.get_stack_groups = lambda: {'base-stack': ['buckets-stack', 'access-stack']}
+
+        with pytest.raises(ConfigError, match='depend on each other'):
+            Builder(project, 'b').graph
+
+        project.get_dependencies = lambda: {}
+        project.get_stack_groups = lambda: {'base-stack': ['buckets-stack', 'buckets']}
+        project.get_deployables = lambda: {'buckets-stack': Stack, 'buckets': Stack}
+
+        with pytest.raises(ConfigError, match="conflicting logical IDs 'Buckets'"):
+            Builder(project, 'b').graph
+
+        class TaggedStack(Stack):
+            def get_tags(self):
+                return {'team': 'a'}
+
+        project.get_deployables = lambda: {'buckets-stack': TaggedStack}
+        project.get_stack_groups = lambda: {'base-stack': ['buckets-stack']}
+
+        with pytest.raises(ConfigError, match="'buckets-stack' overrides get_tags"):
+            Builder(project, 'b').graph
+
+    def test_template(self, project):
+        group = Builder(project, 'b').create_deployable('base-stack', {'a': {'apple': 1}})
+        templates = group.member_templates
+        assert templates['access-stack']['logical_id'] == 'AccessStack'
+        assert templates['access-stack']['key'].startswith('distmono/base-stack/access-stack-')
+        assert 'Value: \'1\'' in templates['access-stack']['body']
+
+        data = group.get_template_data()
+        assert data['Resources']['BucketsStack']['Type'] == 'AWS::CloudFormation::Stack'
+        assert data['Outputs']['AccessStackRoleArn'] == {
+            'Value': {'Fn::GetAtt': ['AccessStack', 'Outputs.RoleArn']},
+        }
+
+        group.save_output(stack_outputs={
+            'BucketsStackBucketName': 'bucket',
+            'AccessStackRoleArn': 'arn',
+        })
+        assert group.get_build_output() == {
+            'buckets-stack': {'BucketName': 'bucket'},
+            'access-stack': {'RoleArn': 'arn'},
+        }
+
+    def test_build(self, project, monkeypatch):
+        def build(self):
+            self.save_output(stack_outputs={
+                'BucketsStackBucketName': 'bucket',
+                'AccessStackRoleArn': 'arn',
+            })
+
+        monkeypatch.setattr(StackGroup, 'build', build)
+        monkeypatch.setattr(StackGroup, 'is_build_outdated', lambda self: True)
+        assert project.build('access-stack') == {'RoleArn': 'arn'}
+        assert project.build('b') == {'access-stack': {'RoleArn': 'arn'}}
+        assert project.get_outputs('buckets-stack') == {'BucketName': 'bucket'}
+        assert project.get_outputs() == {
+            'a': {'apple': 1},
+            'buckets-stack': {'BucketName': 'bucket'},
+            'access-stack': {'RoleArn': 'arn'},
+            'b': {'access-stack': {'RoleArn': 'arn'}},
+        }
+
+    def test_fetch_stacks(self, project, monkeypatch):
+        def describe_stacks(boto):
+            return [{'StackName': 'distmono-base-stack', 'Outputs': [
+                {'OutputKey': 'BucketsStackBucketName', 'OutputValue': 'bucket'},
+                {'OutputKey': 'AccessStackRoleArn', 'OutputValue': 'arn'},
+            ]}]
+
+        monkeypatch.setattr(BotoHelper, 'describe_stacks', describe_stacks)
+        assert project.get_outputs('access-stack', refresh=True) == {'RoleArn': 'arn'}
+
+    def test_destroy(self, project, monkeypatch):
+        emptied = []
+        monkeypatch.setattr(Stack, 'destroy', lambda self: None)
+        monkeypatch.setattr(BotoHelper, 'empty_bucket',
+                            lambda self, bucket, prefix: emptied.append((bucket, prefix)))
+        store = project.get_output_store()
+        store.update('a', {'build_output': {'apple': 1}})
+        store.update('base-stack', {'build_output': {'access-stack': {}, 'buckets-stack': {}}})
+        project.destroy('base-stack')
+        assert emptied == [('templates', 'distmono/base-stack/')]
+
+
+class TestLazyDeployables:
+    @pytest.fixture
+    def project(self, tmp_path, env, monkeypatch):
+        (tmp_path / 'lazy_deployables.py').write_text(dedent('''\
+            from distmono.core import Deployable
+
+            class A(Deployable):
+                def get_build_output(self):
+                    return {'apple': 1}
+
+            class B(Deployable):
+                def get_build_output(self):
+                    return {'banana': self.context.input['a']['apple'] + 1}
+        '''))
+        monkeypatch.syspath_prepend(str(tmp_path))
+        monkeypatch.delitem(sys.modules, 'lazy_deployables', raising=False)
+
+        class TestProject(Project):
+            def get_deployables(self):
+                return {
+                    'a': 'lazy_deployables:A',
+                    'b': 'lazy_deployables.B',
+                    'c': Deployable,
+                }
+
+            def get_dependencies(self):
+                return {'b': 'a'}
+
+            def get_default_build_target(self):
+                return 'b'
+
+        return TestProject(project_dir=tmp_path, env=env)
+
+    def test_build(self, project):
+        project.build('c')
+        assert 'lazy_deployables' not in sys.modules
+
+        assert project.build('b') == {'banana': 2}
+        assert set(project.deployable_classes) == {'lazy_deployables:A', 'lazy_deployables.B'}
+        dpl_cls = project.load_deployable_cls('lazy_deployables:A')
+        assert dpl_cls is sys.modules['lazy_deployables'].A
+        assert project.load_deployable_cls('lazy_deployables:A') is dpl_cls
+
+    def test_invalid(self, project):
+        with pytest.raises(ConfigError, match="Unable to import deployable 'none:A'"):
+            project.load_deployable_cls('none:A')
+
+        with pytest.raises(ConfigError, match="Unable to import deployable 'lazy_deployables:C'"):
+            project.load_deployable_cls('lazy_deployables:C')
+
+        with pytest.raises(ConfigError, match="'distmono.core:Project' is not a Deployable"):
+            project.load_deployable_cls('distmono.core:Project')
@@ -0,0 +1,150 @@
+from distmono.daemon import Daemon, DaemonClient, get_socket_path
+from distmono.exceptions import DaemonError
+from textwrap import dedent
+import io
+import os
+import pytest
+import sys
+import threading
+
+
+PROJECT_FILE = dedent('''\
+    from distmono.core import Deployable, Project
+    from distmono.util import sh
+
+    VALUE = {value!r}
+
+    class TestProject(Project):
+        def get_deployables(self):
+            return {{'a': 'daemon_deployables:A' if VALUE == 'lazy' else A}}
+
+        def get_dependencies(self):
+            return {{}}
+
+        def get_default_build_target(self):
+            return 'a'
+
+    class A(Deployable):
+        def build(self):
+            sh.print(f'building {{VALUE}}')
+            sh.print(f'warning {{VALUE}}', error=True)
+
+        def get_build_output(self):
+            if VALUE == 'broken':
+                raise RuntimeError('broken output')
+
+            return {{'value': VALUE}}
+
+    def get_project():
+        env = {{'namespace': 'distmono', 'region': 'ap-southeast-1'}}
+        return TestProject(project_dir={project_dir!r}, env=env)
+''')
+
+LAZY_MODULE = dedent('''\
+    from distmono.core import Deployable
+
+    class A(Deployable):
+        def get_build_output(self):
+            return {{'value': {value!r}}}
+''')
+
+
+class TestDaemon:
+    @pytest.fixture
+    def project_file(self, tmp_path):
+        project_file = tmp_path / 'project.py'
+        self.write_project(project_file, 'apple')
+        return project_file
+
+    def write_project(self, project_file, value):
+        project_dir = str(project_file.parent)
+        text = PROJECT_FILE.format(value=value, project_dir=project_dir)
+        stat = project_file.stat() if project_file.exists() else None
+        project_file.write_text(text)
+
+        if stat:  # make sure change is seen even within mtime resolution
+            os.utime(project_file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1000))
+
+    @pytest.fixture
+    def client(self, project_file, tmp_path):
+        socket_path = tmp_path / 'dmn.sock'
+        daemon = Daemon(project_file, socket_path=socket_path)
+        thread = threading.Thread(target=daemon.serve)
+        thread.start()
+        client = DaemonClient(socket_path, output=io.StringIO(), error_output=io.StringIO())
+
+        for _ in range(100):
+            if client.is_running():
+                break
+
+            thread.join(0.05)
+
+        yield client
+        client.shutdown()
+        thread.join()
+        assert not socket_path.exists()
+
+    def test_build(self, client):
+        assert client.call('build') == {'value': 'apple'}
+        assert 'building apple\n' in client.output.getvalue()
+        assert client.error_output.getvalue() == 'warning apple\n'
+
+    def test_reload(self, client, project_file):
+        assert client.call('build', target='a') == {'value': 'apple'}
+        self.write_project(project_file, 'banana')
+        assert client.call('build', target='a') == {'value': 'banana'}
+        assert 'Project files changed, reloading\n' in client.output.getvalue()
+
+    def test_reload_lazy(self, client, project_file, monkeypatch):
+        module_file = project_file.parent / 'daemon_deployables.py'
+        module_file.write_text(LAZY_MODULE.format(value='cherry'))
+        monkeypatch.syspath_prepend(str(module_file.parent))
+        monkeypatch.delitem(sys.modules, 'daemon_deployables', raising=False)
+        self.write_project(project_file, 'lazy')
+        assert client.call('build', target='a') == {'value': 'cherry'}
+        assert client.call('build', target='a') == {'value': 'cherry'}
+        assert client.output.getvalue().count('reloading') == 1
+
+        stat = module_file.stat()
+        module_file.write_text(LAZY_MODULE.format(value='durian'))
+        os.utime(module_file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1000))
+        assert client.call('build', target='a') == {'value': 'durian'}
+        assert client.output.getvalue().count('reloading') == 2
+
+    def test_unload_project(self, project_file, tmp_path):
+        class FakeRenderer:
+            def shutdown(self):
+                self.shut_down = True
+
+        daemon = Daemon(project_file, socket_path=tmp_path / 'dmn.sock')
+        project = daemon.get_project()
+        renderer = project.__dict__['template_renderer'] = FakeRenderer()
+        self.write_project(project_file, 'banana')
+        assert daemon.get_project() is not project
+        assert renderer.shut_down
+
+    def test_error(self, client, project_file):
+        self.write_project(project_file, 'broken')
+
+        with pytest.raises(DaemonError, match='RuntimeError: broken output'):
+            client.call('build')
+
+        with pytest.raises(DaemonError, match="ValueError: Unknown command 'x'"):
+            client.call('x')
+
+    def test_socket_dir(self, tmp_path, monkeypatch):
+        monkeypatch.setenv('XDG_RUNTIME_DIR', str(tmp_path))
+        socket_path = get_socket_path(tmp_path / 'project.py')
+        assert socket_path.parent == tmp_path / f'dmn-{os.getuid()}'
+
+        daemon = Daemon(tmp_path / 'project.py')
+        daemon.make_socket_dir()
+        assert socket_path.parent.stat().st_mode & 0o777 == 0o700
+
+        socket_path.parent.chmod(0o755)
+
+        with pytest.raises(DaemonError, match='must be accessible only by its owner'):
+            daemon.make_socket_dir()
+
+    def test_not_running(self, tmp_path):
+        assert not DaemonClient(tmp_path / 'none.sock').is_running()
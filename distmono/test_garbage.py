@@ -0,0 +1,157 @@
+from datetime import datetime, timedelta, timezone
+from distmono.core import Deployable, Project
+from distmono.garbage import GarbageCollector
+from distmono.util import BotoHelper
+from textwrap import dedent
+import os
+import pytest
+import time
+
+
+class GcProject(Project):
+    def get_deployables(self):
+        return {'code': Deployable, 'stack': Deployable}
+
+    def get_dependencies(self):
+        return {'stack': 'code'}
+
+    def get_default_build_target(self):
+        return 'stack'
+
+
+@pytest.fixture
+def project(tmp_path):
+    return GcProject(project_dir=tmp_path, env={
+        'namespace': 'dev',
+        'region': 'ap-southeast-1',
+    })
+
+
+def make_old(path, days=30):
+    mtime = time.time() - days * 24 * 3600
+    os.utime(path, (mtime, mtime))
+
+
+class FakeBoto(BotoHelper):
+    def __init__(self, objects, templates=None):
+        self.objects = objects
+        self.templates = templates or {}
+        self.deleted = []
+        self.versions = []
+
+    def delete_object_versions(self, bucket, *, prefix, select, max_workers, versions):
+        items = [o for o in self.objects
+                 if o['Key'].startswith(prefix) and select(o)]
+        self.deleted.extend((bucket, o['Key']) for o in items)
+        self.versions.append(versions)
+        return len(items)
+
+    def describe_stacks(self):
+        for stack_id in self.templates:
+            tags = [] if stack_id == 'other' else [{'Key': 'distmono:build-hash', 'Value': 'h'}]
+            yield {'StackId': stack_id, 'Tags': tags}
+
+    @property
+    def cloudform(self):
+        boto = self
+
+        class FakeCloudFormation:
+            def get_template(self, StackName, TemplateStage):
+                return {'TemplateBody': boto.templates[StackName]}
+
+        return FakeCloudFormation()
+
+
+class TestGarbageCollector:
+    def test_find_artifacts(self, project):
+        gc = GarbageCollector(project=project)
+        value = {
+            'code': {'build_output': {'Bucket': 'b', 'Key': 'code/1.zip'}},
+            'stack': {'template': {'Resources': {'Function': {'Properties': {
+                'Code': {'S3Bucket': 'b', 'S3Key': 'code/0.zip'},
+                'Layers': [{'Ref': 'Layer'}],
+            }}}}},
+        }
+        assert sorted(gc.find_artifacts(value)) == [('b', 'code/0.zip'), ('b', 'code/1.zip')]
+
+    def test_objects(self, project):
+        store = project.get_output_store()
+        store.update('code', {
+            'build_output': {'Bucket': 'b', 'Key': 'code/2.zip'},
+            'artifact_prefixes': [['b', 'code/']],
+        })
+        store.update('stack', {'template': {'Resources': {'Function': {'Properties': {
+            'Code': {'S3Bucket': 'b', 'S3Key': 'other/1.zip'},
+        }}}}})
+        now = datetime.now(timezone.utc)
+        old = now - timedelta(days=30)
+        templates = {
+            # Deployed from another checkout
+            'deployed': dedent('''\
+                Resources:
+                  Function:
+                    Properties:
+                      Code:
+                        S3Bucket: b
+                        S3Key: code/3.zip
+                      Role: !GetAtt Role.Arn
+            '''),
+            'other': {'Resources': {}},
+        }
+        boto = FakeBoto([
+            {'Key': 'code/0.zip', 'LastModified': old},
+            {'Key': 'code/1.zip', 'LastModified': now},
+            {'Key': 'code/2.zip', 'LastModified': old},
+            {'Key': 'code/3.zip', 'LastModified': old},
+            {'Key': 'other/0.zip', 'LastModified': old},
+        ], templates)
+        gc = GarbageCollector(project=project)
+        gc.boto = boto
+        assert gc.collect()['objects'] == 1
+        assert boto.deleted == [('b', 'code/0.zip')]
+        assert boto.versions == [False]
+
+        gc = GarbageCollector(project=project, all_versions=True)
+        gc.boto = boto
+        gc.collect()
+        assert boto.versions == [False, True]
+
+    def test_artifact_prefixes_saved(self, project):
+        class Code(Deployable):
+            def get_artifact_prefixes(self):
+                return [('b', 'code/')]
+
+        project.get_deployables = lambda: {'code': Code, 'stack': Deployable}
+        project.build('code')
+        store = project.get_output_store()
+        assert store.get('code', 'artifact_prefixes') == [['b', 'code/']]
+        assert store.get('stack', 'artifact_prefixes') is None
+
+    def test_no_owned_prefixes(self, project):
+        store = project.get_output_store()
+        store.update('code', {'build_output': {'Bucket': 'b', 'Key': 'code/2.zip'}})
+        gc = GarbageCollector(project=project)
+        gc.boto = None  # not used
+        assert gc.collect()['objects'] == 0
+
+    def test_dirs(self, project):
+        project.build()
+        ns_dir = project.get_namespace_dir()
+        (ns_dir / 'build-output/removed').mkdir()
+        other_ns_dir = project.temp_dir / 'namespace' / 'destroyed'
+        other_ns_dir.mkdir()
+
+        for d in [ns_dir / 'build/code', ns_dir / 'build-output/code',
+                  ns_dir / 'build-output/removed', other_ns_dir]:
+            make_old(d)
+
+        gc = GarbageCollector(project=project, dry_run=True)
+        assert gc.collect() == {'objects': 0, 'dirs': 3}
+        assert (ns_dir / 'build/code').is_dir()
+
+        assert project.gc() == {'objects': 0, 'dirs': 3}
+        assert not (ns_dir / 'build/code').exists()
+        assert not (ns_dir / 'build-output/removed').exists()
+        assert not other_ns_dir.exists()
+        assert (ns_dir / 'build/stack').is_dir()
+        assert (ns_dir / 'build-output/code').is_dir()
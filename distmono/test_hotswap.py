@@ -0,0 +1,160 @@
+from copy import deepcopy
+from distmono.hotswap import Hotswap
+import pytest
+
+
+def code(key):
+    return {'S3Bucket': 'bucket', 'S3Key': key}
+
+
+@pytest.fixture
+def template():
+    return {
+        'Resources': {
+            'Layer': {
+                'Type': 'AWS::Lambda::LayerVersion',
+                'Properties': {
+                    'Content': code('layer1.zip'),
+                    'CompatibleRuntimes': ['python3.7'],
+                },
+            },
+            'Function': {
+                'Type': 'AWS::Lambda::Function',
+                'Properties': {
+                    'Code': code('function1.zip'),
+                    'Layers': [{'Ref': 'Layer'}],
+                    'Runtime': 'python3.7',
+                },
+            },
+        },
+        'Outputs': {
+            'FunctionName': {'Value': {'Ref': 'Function'}},
+        },
+    }
+
+
+class FakeBoto:
+    def __init__(self):
+        self.calls = []
+
+    def client(self, service):
+        return FakeClient(self.calls)
+
+
+class FakeClient:
+    function_layers = ['arn:aws:lambda:r:1:layer:stack-layer:1']
+
+    def __init__(self, calls):
+        self.calls = calls
+
+    def describe_stack_resources(self, StackName):
+        return {'StackResources': [
+            {'LogicalResourceId': 'Layer',
+             'PhysicalResourceId': 'arn:aws:lambda:r:1:layer:stack-layer:1'},
+            {'LogicalResourceId': 'Function',
+             'PhysicalResourceId': 'stack-function'},
+        ]}
+
+    def publish_layer_version(self, **kwargs):
+        self.calls.append(('publish_layer_version', kwargs))
+        return {'LayerVersionArn': 'arn:aws:lambda:r:1:layer:stack-layer:2'}
+
+    def update_function_code(self, **kwargs):
+        self.calls.append(('update_function_code', kwargs))
+
+    def get_waiter(self, name):
+        return self
+
+    def wait(self, **kwargs):
+        pass
+
+    def get_function_configuration(self, FunctionName):
+        return {'Layers': [{'Arn': arn} for arn in self.function_layers]}
+
+    def update_function_configuration(self, **kwargs):
+        self.calls.append(('update_function_configuration', kwargs))
+
+
+class TestHotswap:
+    def hotswap(self, old, new, boto=None):
+        return Hotswap(stack_name='stack',
+                       boto=boto or FakeBoto(),
+                       old_template=old,
+                       new_template=new)
+
+    def test_no_change(self, template):
+        assert self.hotswap(template, deepcopy(template)).get_changes() == {}
+        assert self.hotswap(template, deepcopy(template)).apply() == []
+
+    def test_function_code(self, template):
+        new = deepcopy(template)
+        new['Resources']['Function']['Properties']['Code'] = code('function2.zip')
+        boto = FakeBoto()
+        assert self.hotswap(template, new, boto).apply() == ['Function']
+        assert boto.calls == [
+            ('update_function_code', {
+                'FunctionName': 'stack-function',
+                'S3Bucket': 'bucket',
+                'S3Key': 'function2.zip',
+            }),
+        ]
+
+    def test_layer_content(self, template):
+        new = deepcopy(template)
+        new['Resources']['Layer']['Properties']['Content'] = code('layer2.zip')
+        boto = FakeBoto()
+        assert self.hotswap(template, new, boto).apply() == ['Layer']
+        assert boto.calls == [
+            ('publish_layer_version', {
+                'LayerName': 'arn:aws:lambda:r:1:layer:stack-layer',
+                'Content': code('layer2.zip'),
+                'CompatibleRuntimes': ['python3.7'],
+            }),
+            ('update_function_configuration', {
+                'FunctionName': 'stack-function',
+                'Layers': ['arn:aws:lambda:r:1:layer:stack-layer:2'],
+            }),
+        ]
+
+    def test_layer_hot_swapped_before(self, template, monkeypatch):
+        # Function uses version 3 from a previous hotswap, stack still has 1
+        monkeypatch.setattr(FakeClient, 'function_layers', [
+            'arn:aws:lambda:r:1:layer:other:5',
+            'arn:aws:lambda:r:1:layer:stack-layer:3',
+        ])
+        new = deepcopy(template)
+        new['Resources']['Layer']['Properties']['Content'] = code('layer2.zip')
+        boto = FakeBoto()
+        assert self.hotswap(template, new, boto).apply() == ['Layer']
+        assert boto.calls[-1] == ('update_function_configuration', {
+            'FunctionName': 'stack-function',
+            'Layers': [
+                'arn:aws:lambda:r:1:layer:other:5',
+                'arn:aws:lambda:r:1:layer:stack-layer:2',
+            ],
+        })
+
+    def test_other_property(self, template):
+        new = deepcopy(template)
+        new['Resources']['Function']['Properties']['Code'] = code('function2.zip')
+        new['Resources']['Function']['Properties']['Runtime'] = 'python3.9'
+        assert self.hotswap(template, new).get_changes() is None
+
+    def test_new_resource(self, template):
+        new = deepcopy(template)
+        new['Resources']['Bucket'] = {'Type': 'AWS::S3::Bucket'}
+        assert self.hotswap(template, new).get_changes() is None
+
+    def test_outputs(self, template):
+        new = deepcopy(template)
+        new['Resources']['Function']['Properties']['Code'] = code('function2.zip')
+        new['Outputs']['FunctionArn'] = {'Value': {'Fn::GetAtt': ['Function', 'Arn']}}
+        assert self.hotswap(template, new).get_changes() is None
+
+    def test_unresolved_location(self, template):
+        new = deepcopy(template)
+        new['Resources']['Function']['Properties']['Code'] = {
+            'S3Bucket': {'Ref': 'Bucket'},
+            'S3Key': 'function2.zip',
+        }
+        assert self.hotswap(template, new).get_changes() is None
@@ -0,0 +1,165 @@
+from distmono.core import Deployable, Project
+from distmono.exceptions import LoadTestFailedError
+from distmono.loadtest import FunctionLoadTest, HttpLoadTest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import base64
+import io
+import pytest
+import threading
+import time
+
+
+@pytest.fixture
+def server():
+    requests = []
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            requests.append(self.path)
+
+            if self.path == '/slow':
+                time.sleep(0.1)
+
+            self.send_response(500 if self.path == '/error' else 200)
+
+            if len(requests) == 1:
+                self.send_header('X-Cold-Start', '1')
+
+            self.end_headers()
+            self.wfile.write(b'{}')
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    server.requests = requests
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    yield server
+    server.shutdown()
+    thread.join()
+    server.server_close()
+
+
+def create_project(tmp_path, deployables):
+    class TestProject(Project):
+        def get_deployables(self):
+            return {'api': Api, **deployables}
+
+        def get_dependencies(self):
+            return {name: 'api' for name in deployables}
+
+    class Api(Deployable):
+        def get_build_output(self):
+            return {'ApiUrl': self.context.project.url}
+
+    env = {'namespace': 'distmono', 'region': 'ap-southeast-1'}
+    return TestProject(project_dir=tmp_path, env=env)
+
+
+class TestHttpLoadTest:
+    @pytest.fixture
+    def project(self, tmp_path, server):
+        class ApiLoadTest(HttpLoadTest):
+            concurrency = 4
+            rps = 50
+            duration = 0.4
+            cold_start_header = 'X-Cold-Start'
+
+            def get_url(self):
+                return self.context.input['api']['ApiUrl']
+
+        project = create_project(tmp_path, {'load-test': ApiLoadTest})
+        project.url = f'http://127.0.0.1:{server.server_port}/ok'
+        return project
+
+    def test_build(self, project, server):
+        report = project.build('load-test')
+        assert report['requests'] == len(server.requests) == 20
+        assert report['errors'] == 0
+        assert report['error_rate'] == 0
+        assert report['cold_starts'] == 1
+        assert report['target_rps'] == 50
+        assert report['rps'] >= 45
+        latency = report['latency_ms']
+        assert 0 < latency['min'] <= latency['p50'] <= latency['p99'] <= latency['max']
+        assert project.get_outputs('load-test') == report
+
+    def test_errors(self, project, server):
+        project.url = f'http://127.0.0.1:{server.server_port}/error'
+        dpl_cls = project.get_deployables()['load-test']
+        dpl_cls.max_error_rate = 0.5
+
+        with pytest.raises(LoadTestFailedError, match='load-test: error rate 1.000 > 0.5'):
+            project.build('load-test')
+
+        report = project.get_output_store().get('load-test', 'report')
+        assert report['errors'] == report['requests']
+        assert report['latency_ms']['p50'] is None
+        assert report['top_errors'] == {
+            'HTTPError: HTTP Error 500: Internal Server Error': report['requests'],
+        }
+
+    def test_saturated(self, project, server):
+        project.url = f'http://127.0.0.1:{server.server_port}/slow'
+        dpl_cls = project.get_deployables()['load-test']
+        dpl_cls.concurrency = 1
+        dpl_cls.duration = 0.2
+
+        with pytest.raises(LoadTestFailedError, match=r'rps .* < 45 \(90% of 50\)'):
+            project.build('load-test')
+
+        # Latency includes the time requests waited to be sent
+        report = project.get_output_store().get('load-test', 'report')
+        assert report['requests'] == 10
+        assert report['latency_ms']['max'] > 500
+
+    def test_latency_gate(self, project):
+        dpl_cls = project.get_deployables()['load-test']
+        dpl_cls.max_latency_ms = {'p50': 0}
+
+        with pytest.raises(LoadTestFailedError, match=r'latency p50 .* ms > 0 ms'):
+            project.build('load-test')
+
+
+class TestFunctionLoadTest:
+    def test_build(self, tmp_path):
+        invocations = []
+
+        class FakeLambda:
+            def invoke(self, **kwargs):
+                invocations.append(kwargs)
+                log = 'REPORT Init Duration: 100 ms' if len(invocations) == 1 else 'REPORT'
+                resp = {
+                    'Payload': io.BytesIO(b'{}'),
+                    'LogResult': base64.b64encode(log.encode('utf8')).decode('utf8'),
+                }
+
+                if len(invocations) == 2:
+                    resp['FunctionError'] = 'Unhandled'
+
+                return resp
+
+        class FunctionTest(FunctionLoadTest):
+            concurrency = 1
+            rps = 25
+            duration = 0.2
+            lambd = FakeLambda()
+
+            def get_function_name(self):
+                return 'function'
+
+            def get_payload(self):
+                return {'x': 1}
+
+        project = create_project(tmp_path, {'function-test': FunctionTest})
+        project.url = None
+        report = project.build('function-test')
+        assert report['requests'] == len(invocations) == 5
+        assert report['errors'] == 1
+        assert report['cold_starts'] == 1
+        assert invocations[0] == {
+            'FunctionName': 'function',
+            'Payload': b'{"x": 1}',
+            'LogType': 'Tail',
+        }
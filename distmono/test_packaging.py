@@ -0,0 +1,122 @@
+from distmono.packaging import file_sha256, Packager, Vendor, zip_dir, zip_dirs
+from distmono.util import sh
+import os
+import pytest
+import zipfile
+
+
+@pytest.fixture
+def src_dir(tmp_path):
+    src_dir = tmp_path / 'src'
+    (src_dir / 'python/lib').mkdir(parents=True)
+    (src_dir / 'python/lib/mod.py').write_text('x = 1\n')
+    (src_dir / 'python/main.py').write_text('import lib\n')
+    (src_dir / 'other.txt').write_text('other\n')
+    return src_dir
+
+
+class TestZipDir:
+    def test_zip(self, src_dir, tmp_path):
+        zip_file = tmp_path / 'code.zip'
+        zip_hash = zip_dir(zip_file, src_dir)
+        assert zip_hash == file_sha256(zip_file)
+
+        with zipfile.ZipFile(zip_file) as zf:
+            assert zf.namelist() == ['other.txt', 'python/main.py', 'python/lib/mod.py']
+            assert zf.read('python/lib/mod.py') == b'x = 1\n'
+
+    def test_large_file(self, src_dir, tmp_path):
+        data = os.urandom(3 * 1024 * 1024 + 7)
+        (src_dir / 'large.bin').write_bytes(data)
+        zip_file = tmp_path / 'code.zip'
+        zip_dir(zip_file, src_dir)
+
+        with zipfile.ZipFile(zip_file) as zf:
+            assert zf.read('large.bin') == data
+            assert zf.testzip() is None
+
+    def test_base_dir(self, src_dir, tmp_path):
+        zip_file = tmp_path / 'code.zip'
+        zip_dir(zip_file, src_dir, 'python')
+
+        with zipfile.ZipFile(zip_file) as zf:
+            assert zf.namelist() == ['python/main.py', 'python/lib/mod.py']
+
+    def test_reproducible(self, src_dir, tmp_path):
+        zip_hash = zip_dir(tmp_path / 'code1.zip', src_dir)
+        os.utime(src_dir / 'other.txt', (0, 0))
+        assert zip_dir(tmp_path / 'code2.zip', src_dir) == zip_hash
+
+        (src_dir / 'other.txt').write_text('changed\n')
+        assert zip_dir(tmp_path / 'code3.zip', src_dir) != zip_hash
+
+    def test_zip_dirs(self, src_dir, tmp_path):
+        vendored_dir = tmp_path / 'vendored'
+        vendored_dir.mkdir()
+        (vendored_dir / 'main.py').write_text('vendored\n')
+        (vendored_dir / 'requests.py').write_text('\n')
+        zip_file = tmp_path / 'code.zip'
+        zip_dirs(zip_file, [(src_dir / 'python', 'python'), (vendored_dir, 'python')])
+
+        with zipfile.ZipFile(zip_file) as zf:
+            assert zf.namelist() == [
+                'python/main.py',
+                'python/lib/mod.py',
+                'python/requests.py',
+            ]
+            assert zf.read('python/main.py') == b'import lib\n'
+
+
+class TestPackager:
+    def test_zip_dir(self, src_dir, tmp_path):
+        packager = Packager(max_workers=2)
+
+        try:
+            zip_hash = packager.zip_dir(tmp_path / 'code.zip', src_dir)
+            future = packager.submit(os.getpid)
+            assert future.result() != os.getpid()
+        finally:
+            packager.shutdown()
+
+        assert zip_hash == file_sha256(tmp_path / 'code.zip')
+
+
+class TestVendor:
+    @pytest.fixture
+    def wheel(self, tmp_path):
+        wheel = tmp_path / 'demo-1.0-py3-none-any.whl'
+
+        with zipfile.ZipFile(wheel, 'w') as zf:
+            zf.writestr('demo.py', 'VERSION = 1\n')
+            zf.writestr('demo-1.0.dist-info/METADATA',
+                        'Metadata-Version: 2.1\nName: demo\nVersion: 1.0\n')
+            zf.writestr('demo-1.0.dist-info/WHEEL',
+                        'Wheel-Version: 1.0\nRoot-Is-Purelib: true\nTag: py3-none-any\n')
+            zf.writestr('demo-1.0.dist-info/RECORD', '')
+
+        return wheel
+
+    def test_vendor(self, tmp_path, wheel, monkeypatch):
+        requirements = tmp_path / 'requirements.txt'
+        requirements.write_text(f'{wheel}\n')
+        vendor = Vendor(cache_dir=tmp_path / 'cache', pip_args=['--no-index'])
+        vendored_dir = vendor.vendor(requirements)
+        assert (vendored_dir / 'demo.py').read_text() == 'VERSION = 1\n'
+
+        def run(*args, **kwargs):
+            raise AssertionError('pip should not run again')
+
+        monkeypatch.setattr(sh, 'run', run)
+        assert vendor.vendor(requirements) == vendored_dir
+
+        requirements.write_text(f'# demo\n{wheel}\n')
+
+        with pytest.raises(AssertionError, match='pip should not run again'):
+            vendor.vendor(requirements)
+
+    def test_empty(self, tmp_path, monkeypatch):
+        requirements = tmp_path / 'requirements.txt'
+        requirements.write_text('# nothing\n\n')
+        monkeypatch.setattr(sh, 'run', None)
+        vendored_dir = Vendor(cache_dir=tmp_path).vendor(requirements)
+        assert list(vendored_dir.iterdir()) == []
@@ -0,0 +1,110 @@
+from distmono.exceptions import StackDoesNotExistError, StackRecoveryError
+from distmono.recovery import StackRecovery
+import pytest
+
+
+class FakeBoto:
+    '''
+    Stack whose status goes through statuses, one per describe, and calls
+    made to CloudFormation.
+    '''
+
+    def __init__(self, statuses, transitions=None):
+        self.statuses = list(statuses)
+        self.transitions = transitions or {}
+        self.calls = []
+
+    def describe_stack(self, stack_name):
+        status = self.statuses[0]
+
+        if len(self.statuses) > 1:
+            self.statuses.pop(0)
+
+        if status is None:
+            raise StackDoesNotExistError(f'Stack {stack_name} does not exist')
+
+        return {'StackName': stack_name, 'StackStatus': status}
+
+    @property
+    def cloudform(self):
+        return self
+
+    def delete_stack(self, StackName):
+        self.record('delete_stack')
+
+    def continue_update_rollback(self, StackName):
+        self.record('continue_update_rollback')
+
+    def record(self, call):
+        self.calls.append(call)
+        self.statuses = list(self.transitions.get(call, self.statuses))
+
+
+def recover(boto):
+    return StackRecovery(stack_name='stack', boto=boto, poll_interval=0).recover()
+
+
+class TestStackRecovery:
+    def test_missing(self):
+        boto = FakeBoto([None])
+        assert recover(boto) == []
+        assert boto.calls == []
+
+    def test_complete(self):
+        boto = FakeBoto(['UPDATE_ROLLBACK_COMPLETE'])
+        assert recover(boto) == []
+        assert boto.calls == []
+
+    def test_in_progress(self):
+        boto = FakeBoto(['UPDATE_IN_PROGRESS', 'UPDATE_IN_PROGRESS', 'UPDATE_COMPLETE'])
+        assert recover(boto) == ['wait']
+        assert boto.calls == []
+
+    def test_update_rollback_failed(self):
+        boto = FakeBoto(['UPDATE_ROLLBACK_FAILED'], {
+            'continue_update_rollback': [
+                'UPDATE_ROLLBACK_IN_PROGRESS', 'UPDATE_ROLLBACK_COMPLETE'],
+        })
+        assert recover(boto) == ['continue_rollback', 'wait']
+        assert boto.calls == ['continue_update_rollback']
+
+    def test_update_rollback_failed_again(self):
+        boto = FakeBoto(['UPDATE_ROLLBACK_FAILED'], {
+            'continue_update_rollback': [
+                'UPDATE_ROLLBACK_IN_PROGRESS', 'UPDATE_ROLLBACK_FAILED'],
+        })
+
+        with pytest.raises(StackRecoveryError, match='Rollback of stack failed again'):
+            recover(boto)
+
+    def test_rollback_complete(self):
+        boto = FakeBoto(['ROLLBACK_COMPLETE'], {
+            'delete_stack': ['DELETE_IN_PROGRESS', 'DELETE_COMPLETE'],
+        })
+        assert recover(boto) == ['recreate', 'wait']
+        assert boto.calls == ['delete_stack']
+
+    def test_delete_failed(self):
+        boto = FakeBoto(['ROLLBACK_COMPLETE'], {
+            'delete_stack': ['DELETE_IN_PROGRESS', 'DELETE_FAILED'],
+        })
+
+        with pytest.raises(StackRecoveryError, match=r'Unable to delete stack \(DELETE_FAILED\)'):
+            recover(boto)
+
+    def test_retry_delete(self):
+        boto = FakeBoto(['DELETE_FAILED'], {
+            'delete_stack': ['DELETE_IN_PROGRESS', 'DELETE_COMPLETE'],
+        })
+        assert recover(boto) == ['retry_delete', 'wait']
+        assert boto.calls == ['delete_stack']
+
+    def test_retry_delete_failed(self):
+        boto = FakeBoto(['DELETE_FAILED'], {
+            'delete_stack': ['DELETE_IN_PROGRESS', 'DELETE_FAILED'],
+        })
+
+        with pytest.raises(StackRecoveryError, match='must be deleted or retained manually'):
+            recover(boto)
+
+        assert boto.calls == ['delete_stack']
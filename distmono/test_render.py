@@ -0,0 +1,100 @@
+from concurrent.futures import Future
+from distmono.core import Builder, load_project
+from distmono.render import TemplateRenderer
+from textwrap import dedent
+import pytest
+
+
+@pytest.fixture
+def project_file(tmp_path):
+    file = tmp_path / 'project.py'
+    file.write_text(dedent('''\
+        from distmono.core import Project, Stack
+        from troposphere import Output, Template
+
+
+        class TestProject(Project):
+            def get_deployables(self):
+                return {'stack': TestStack}
+
+            def get_dependencies(self):
+                return {}
+
+            def get_default_build_target(self):
+                return 'stack'
+
+
+        class TestStack(Stack):
+            stack_code = 'test'
+
+            def get_template(self):
+                t = Template()
+                name = self.context.input.get('name', 'x')
+                t.add_output(Output('Name', Value=f"{name}-{self.context.project.env['region']}"))
+                return t
+
+
+        def get_project():
+            return TestProject(project_dir=%r, env={
+                'namespace': 'distmono',
+                'region': 'ap-southeast-1',
+                'check_drift': False,
+                'render_jobs': 2,
+            })
+        ''' % str(tmp_path)))
+    return file
+
+
+class TestTemplateRenderer:
+    def test_render(self, project_file):
+        project = load_project(project_file)
+        renderer = TemplateRenderer(project_file=project.project_file, max_workers=1)
+
+        try:
+            rendered = renderer.render('stack', project.env, {'name': 'y'}).result()
+        finally:
+            renderer.shutdown()
+
+        assert rendered['data'] == {
+            'Outputs': {'Name': {'Value': 'y-ap-southeast-1'}},
+            'Resources': {},
+        }
+        assert 'y-ap-southeast-1' in rendered['body']
+
+    def test_no_project_file(self):
+        assert TemplateRenderer().render('stack', {}, {}) is None
+
+    def test_build_hash(self, project_file):
+        project = load_project(project_file)
+        builder = Builder(project, 'stack')
+        builder.render_template('stack', {'name': 'y'})
+        dpl = builder.create_deployable('stack', {'name': 'y'})
+        assert dpl.context.rendered_template
+        rendered_hash = dpl.get_build_hash()
+        builder.stop_rendering()
+        assert not builder.rendered_templates
+        # Kept for the next build
+        assert project.template_renderer.executor is not None
+
+        # Rendered for another input
+        builder.render_template('stack', {'name': 'z'})
+        assert builder.create_deployable('stack', {'name': 'y'}).context.rendered_template is None
+        builder.stop_rendering()
+        project.template_renderer.shutdown()
+
+        project.env = dict(project.env, render_jobs=0)
+        project.__dict__.pop('template_renderer')
+        dpl = Builder(project, 'stack').create_deployable('stack', {'name': 'y'})
+        assert dpl.context.rendered_template is None
+        assert dpl.get_build_hash() == rendered_hash
+
+    def test_worker_failed(self, project_file):
+        project = load_project(project_file)
+        builder = Builder(project, 'stack')
+        future = Future()
+        future.set_exception(ImportError('not importable'))
+        builder.rendered_templates['stack'] = ({'name': 'y'}, future)
+        dpl = builder.create_deployable('stack', {'name': 'y'})
+        assert dpl.context.rendered_template is None
+        assert 'y-ap-southeast-1' in dpl.stacker.template.to_yaml()
+        assert 'stack' not in builder.rendered_templates
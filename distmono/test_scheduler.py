@@ -0,0 +1,163 @@
+from distmono.exceptions import (
+    DeploymentCancelledError,
+    DeploymentTimeoutError,
+    TasksFailedError,
+)
+from distmono.scheduler import CancelToken, ResourcePool, Scheduler
+import pytest
+import threading
+import time
+
+
+class TestResourcePool:
+    def test_acquire(self):
+        pool = ResourcePool({'cpu': 2})
+        assert pool.try_acquire({'cpu': 1})
+        assert pool.try_acquire({'cpu': 1, 'net': 100})
+        assert not pool.try_acquire({'cpu': 1})
+        pool.release({'cpu': 1})
+        assert pool.try_acquire({'cpu': 1})
+
+    def test_clamp(self):
+        pool = ResourcePool({'cpu': 2})
+        assert pool.try_acquire({'cpu': 4})
+        assert not pool.try_acquire({'cpu': 1})
+        pool.release({'cpu': 4})
+        assert pool.used['cpu'] == 0
+
+
+class TestCancelToken:
+    def test_cancel(self):
+        token = CancelToken()
+        child = token.child()
+        assert not child.cancelled
+        child.check()
+        token.cancel('Stop')
+        assert child.cancelled
+
+        with pytest.raises(DeploymentCancelledError, match='Stop'):
+            child.check()
+
+    def test_timeout(self):
+        token = CancelToken(10)
+        child = token.child(0.1)
+        assert not child.cancelled
+        time.sleep(0.15)
+        assert not token.cancelled
+
+        with pytest.raises(DeploymentTimeoutError, match=r'Timed out after 0.1s'):
+            child.check()
+
+
+class Recorder:
+    def __init__(self, delay=0):
+        self.delay = delay
+        self.lock = threading.Lock()
+        self.log = []
+        self.running = set()
+        self.max_running = 0
+
+    def __call__(self, node):
+        with self.lock:
+            self.log.append(node)
+            self.running.add(node)
+            self.max_running = max(self.max_running, len(self.running))
+
+        time.sleep(self.delay)
+
+        with self.lock:
+            self.running.remove(node)
+
+        if node == 'fail':
+            raise RuntimeError('failed')
+
+        return node.upper()
+
+
+class TestScheduler:
+    dependencies = {
+        'b1': ['a'],
+        'b2': ['a'],
+        'c': ['b1', 'b2'],
+    }
+
+    def test_sequential(self):
+        func = Recorder()
+        results = Scheduler().run(['a', 'b1', 'b2', 'c'], self.dependencies, func)
+        assert func.log == ['a', 'b1', 'b2', 'c']
+        assert results == {'a': 'A', 'b1': 'B1', 'b2': 'B2', 'c': 'C'}
+
+    def test_parallel(self):
+        func = Recorder(delay=0.2)
+        started = time.monotonic()
+        Scheduler(jobs=4).run(['a', 'b1', 'b2', 'c'], self.dependencies, func)
+        assert time.monotonic() - started < 0.75
+        assert func.log[0] == 'a'
+        assert set(func.log[1:3]) == {'b1', 'b2'}
+        assert func.log[3] == 'c'
+        assert func.max_running == 2
+
+    def test_jobs(self):
+        func = Recorder(delay=0.05)
+        Scheduler(jobs=2).run(list('abcdef'), {}, func)
+        assert func.max_running == 2
+
+    def test_resources(self):
+        func = Recorder(delay=0.05)
+        resources = {'a': {'cfn_slots': 1}, 'b': {'cfn_slots': 1}, 'c': {'cpu': 1}}
+        scheduler = Scheduler(jobs=4, limits={'cfn_slots': 1})
+        scheduler.run(['a', 'b', 'c'], {}, func, resources=resources.get)
+        assert func.max_running == 2
+        assert func.log[:2] == ['a', 'c']
+
+    def test_results(self):
+        results = {'a': 'done'}
+        func = Recorder()
+        Scheduler().run(['b1', 'b2', 'c'], self.dependencies, func, results=results)
+        assert func.log == ['b1', 'b2', 'c']
+        assert results['c'] == 'C'
+
+    def test_on_ready(self):
+        log = []
+        func = Recorder()
+        Scheduler().run(['a', 'b1', 'b2', 'c'], self.dependencies,
+                        lambda node: log.append(node) or func(node),
+                        on_ready=lambda node: log.append(f'ready {node}'))
+        assert log == ['ready a', 'a', 'ready b1', 'ready b2', 'b1', 'b2', 'ready c', 'c']
+
+    def test_error(self):
+        func = Recorder(delay=0.1)
+        dependencies = {'c': ['fail'], 'd': ['b']}
+
+        with pytest.raises(RuntimeError, match='failed'):
+            Scheduler(jobs=2).run(['fail', 'b', 'c', 'd'], dependencies, func)
+
+        assert sorted(func.log) == ['b', 'fail']
+
+    def test_keep_going(self):
+        func = Recorder(delay=0.1)
+        dependencies = {'c': ['fail'], 'd': ['b'], 'e': ['c']}
+
+        with pytest.raises(TasksFailedError, match='Failed: fail; skipped: c, e') as e:
+            Scheduler(jobs=2).run(['fail', 'b', 'c', 'd', 'e'], dependencies, func,
+                                  keep_going=True)
+
+        assert sorted(func.log) == ['b', 'd', 'fail']
+        assert list(e.value.errors) == ['fail']
+        assert e.value.skipped == ['c', 'e']
+
+    def test_cancel(self):
+        token = CancelToken()
+
+        def func(node):
+            if node == 'a':
+                token.cancel()
+
+            return node
+
+        with pytest.raises(DeploymentCancelledError):
+            Scheduler().run(['a', 'b'], {}, func, cancel=token)
+
+    def test_unschedulable(self):
+        with pytest.raises(RuntimeError, match=r"Unable to schedule \['b'\]"):
+            Scheduler().run(['b'], {'b': ['a']}, Recorder())
@@ -0,0 +1,87 @@
+from distmono.store import OutputStore
+import pytest
+
+
+@pytest.fixture
+def store(tmp_path):
+    return OutputStore(tmp_path / 'outputs.db')
+
+
+class TestOutputStore:
+    def test_update(self, store):
+        store.update('a', {'stack_outputs': {'Url': 'x'}, 'build_hash': 'abc'})
+        assert store.get('a', 'stack_outputs') == {'Url': 'x'}
+        assert store.get('a', 'build_hash') == 'abc'
+        assert store.get('a', 'missing') is None
+        assert store.get('b', 'missing', 1) == 1
+
+        store.update('a', {'build_hash': None})
+        assert store.get_target('a') == {'stack_outputs': {'Url': 'x'}}
+
+    def test_persist(self, store):
+        store.update('a', {'build_hash': 'abc'})
+        store.update('b', {'zip_hash': 'def'})
+        other = OutputStore(store.path)
+        assert other.get_all() == {
+            'a': {'build_hash': 'abc'},
+            'b': {'zip_hash': 'def'},
+        }
+
+    def test_cache(self, store):
+        store.update('a', {'build_hash': 'abc'})
+        other = OutputStore(store.path)
+        assert other.get('a', 'build_hash') == 'abc'
+
+        store.update('a', {'build_hash': 'def'})
+        assert other.get('a', 'build_hash') == 'abc'
+        other.refresh('a')
+        assert other.get('a', 'build_hash') == 'def'
+
+    def test_atomic_update(self, store):
+        store.update('a', {'build_hash': 'abc'})
+
+        with pytest.raises(TypeError):
+            store.update('a', {'build_hash': 'def', 'bad': object()})
+
+        assert OutputStore(store.path).get_target('a') == {'build_hash': 'abc'}
+
+    def test_delete(self, store):
+        store.update('a', {'build_hash': 'abc'})
+        store.update('b', {'build_hash': 'def'})
+        store.delete('a')
+        assert store.get_all() == {'b': {'build_hash': 'def'}}
+        assert OutputStore(store.path).get_all() == {'b': {'build_hash': 'def'}}
+
+    def test_journal(self, store):
+        assert store.get_journal('a') is None
+        store.update_journal('a', 'done', input_hash='abc', output={'Url': 'x'})
+        store.update_journal('b', 'failed', input_hash='def', error='boom')
+        entry = OutputStore(store.path).get_journal('a')
+        assert entry['status'] == 'done'
+        assert entry['input_hash'] == 'abc'
+        assert entry['output'] == {'Url': 'x'}
+        assert store.get_journal('b')['error'] == 'boom'
+
+        store.clear_journal('a')
+        assert store.get_journal('a') is None
+        assert store.get_journal('b')['status'] == 'failed'
+
+    def test_migrate(self, store, tmp_path):
+        output_dir = tmp_path / 'build-output'
+        (output_dir / 'stack').mkdir(parents=True)
+        (output_dir / 'stack/stack-outputs.yaml').write_text('Url: x\n')
+        (output_dir / 'stack/build-hash.txt').write_text('abc')
+        (output_dir / 'code').mkdir()
+        (output_dir / 'code/code.zip').write_text('zip')
+        (output_dir / 'code/code.zip.sha256').write_text('def\n')
+
+        store.migrate(output_dir)
+        assert store.get_all() == {
+            'stack': {'stack_outputs': {'Url': 'x'}, 'build_hash': 'abc'},
+            'code': {'zip_hash': 'def'},
+        }
+        assert not (output_dir / 'stack/build-hash.txt').exists()
+        assert (output_dir / 'code/code.zip').exists()
+
+        store.migrate(output_dir)
+        assert store.get('code', 'zip_hash') == 'def'
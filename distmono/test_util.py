@@ -1,8 +1,29 @@
 from os import path as osp
-from subprocess import CalledProcessError
-from distmono.util import sh
+from subprocess import CalledProcessError, TimeoutExpired
+from distmono.exceptions import (
+    ConfigError,
+    DeploymentCancelledError,
+    DeploymentTimeoutError,
+    StackDoesNotExistError,
+)
+from distmono.scheduler import CancelToken
+from distmono.util import (
+    AsyncBotoHelper,
+    BotoHelper,
+    hash_file,
+    hash_files,
+    hash_tree,
+    new_hash,
+    sh,
+    update_hash,
+)
+import asyncio
+import hashlib
 import os
 import pytest
+import sys
+import threading
+import time
 
 
 class TestCmdlist:
@@ -72,3 +93,272 @@ class TestChdir:
             assert tmpdir.samefile(os.getcwd())
 
         assert osp.samefile(os.getcwd(), cwd)
+
+
+class TestLock:
+    def test_exclusive(self, tmp_path):
+        lock_file = tmp_path / 'lock/file'
+        code = 'import fcntl, sys; fcntl.flock(open(sys.argv[1]), fcntl.LOCK_EX | fcntl.LOCK_NB)'
+        try_lock = [sys.executable, '-c', code, lock_file]
+
+        with sh.lock(lock_file):
+            assert sh.run(try_lock, check=False, capture_output=True).returncode != 0
+
+        assert sh.run(try_lock).returncode == 0
+
+
+class TestBotoHelper:
+    def test_config(self):
+        config = BotoHelper(region='ap-southeast-1').get_config()
+        assert config.region_name == 'ap-southeast-1'
+        assert config.max_pool_connections == 10
+        assert config.retries is None
+
+    def test_retries(self):
+        boto = BotoHelper(region='ap-southeast-1',
+                          max_pool_connections=100,
+                          retry_mode='adaptive',
+                          max_attempts=5)
+        config = boto.get_config()
+        assert config.max_pool_connections == 100
+        assert config.retries == {'mode': 'adaptive', 'max_attempts': 5}
+
+    def test_empty_bucket(self):
+        class FakeS3:
+            def __init__(self):
+                self.lock = threading.Lock()
+                self.deleted = []
+
+            def get_paginator(self, name):
+                assert name == 'list_object_versions'
+                return self
+
+            def paginate(self, Bucket, Prefix=None):
+                assert (Bucket, Prefix) == ('bucket', 'code/')
+
+                for page in range(3):
+                    yield {
+                        'Versions': [{'Key': f'code/{page}-{i}', 'VersionId': str(i)}
+                                     for i in range(900)],
+                        'DeleteMarkers': [{'Key': f'code/{page}', 'VersionId': 'm'}],
+                    }
+
+            def delete_objects(self, Bucket, Delete):
+                assert len(Delete['Objects']) <= 1000
+
+                with self.lock:
+                    self.deleted.extend(Delete['Objects'])
+
+                return {}
+
+        s3 = FakeS3()
+
+        class FakeBotoHelper(BotoHelper):
+            def client(self, service):
+                return s3
+
+        boto = FakeBotoHelper(region='ap-southeast-1')
+        assert boto.empty_bucket('bucket', prefix='code/', max_workers=2) == 2703
+        assert len(s3.deleted) == 2703
+        assert {'Key': 'code/2', 'VersionId': 'm'} in s3.deleted
+
+    def test_shared_session(self, monkeypatch):
+        monkeypatch.setattr(BotoHelper, 'sessions', {})
+        boto1 = BotoHelper(region='ap-southeast-1')
+        boto2 = BotoHelper.from_env({'region': 'ap-southeast-1'}, max_pool_connections=50)
+        assert boto1.session is boto2.session
+        assert BotoHelper(region='us-east-1').session is not boto1.session
+
+    def test_assumed_role_cache(self, monkeypatch, tmp_path):
+        from botocore.credentials import AssumeRoleCredentialFetcher, JSONFileCache
+        from datetime import datetime, timedelta, timezone
+
+        monkeypatch.setattr(BotoHelper, 'sessions', {})
+        monkeypatch.setenv('AWS_ACCESS_KEY_ID', 'source-key')
+        monkeypatch.setenv('AWS_SECRET_ACCESS_KEY', 'source-secret')
+        role_arn = 'arn:aws:iam::123456789012:role/deploy'
+        cache = JSONFileCache(str(tmp_path))
+        # Credentials cached by a previous run
+        fetcher = AssumeRoleCredentialFetcher(
+            client_creator=None, source_credentials=None, role_arn=role_arn,
+            extra_args={'RoleSessionName': 'distmono'}, cache=cache)
+        expiration = datetime.now(timezone.utc) + timedelta(hours=1)
+        cache[fetcher._cache_key] = {'Credentials': {
+            'AccessKeyId': 'role-key',
+            'SecretAccessKey': 'role-secret',
+            'SessionToken': 'role-token',
+            'Expiration': expiration.isoformat(),
+        }}
+
+        boto = BotoHelper.from_env({
+            'region': 'ap-southeast-1',
+            'role_arn': role_arn,
+        }, credential_cache_dir=tmp_path)
+        credentials = boto.session.get_credentials().get_frozen_credentials()
+        assert credentials.access_key == 'role-key'
+        assert credentials.token == 'role-token'
+
+    def test_async_defaults(self):
+        config = AsyncBotoHelper(region='ap-southeast-1').get_config()
+        assert config.max_pool_connections == 50
+        assert config.retries == {'mode': 'adaptive'}
+
+    def test_async_role_arn(self):
+        role_arn = 'arn:aws:iam::123456789012:role/deploy'
+        boto = AsyncBotoHelper(region='ap-southeast-1', role_arn=role_arn)
+
+        with pytest.raises(ConfigError):
+            boto.session
+
+    def test_async_stack_outputs(self, monkeypatch):
+        pytest.importorskip('aiobotocore')
+        from botocore.stub import Stubber
+
+        monkeypatch.setenv('AWS_ACCESS_KEY_ID', 'key')
+        monkeypatch.setenv('AWS_SECRET_ACCESS_KEY', 'secret')
+        boto = AsyncBotoHelper(region='ap-southeast-1')
+        create_client = boto.client
+        stubs = [
+            lambda stubber: stubber.add_response('describe_stacks', {'Stacks': [{
+                'StackName': 'distmono-test',
+                'StackStatus': 'CREATE_COMPLETE',
+                'CreationTime': '2021-10-01',
+                'Outputs': [{'OutputKey': 'Url', 'OutputValue': 'https://test'}],
+            }]}, {'StackName': 'distmono-test'}),
+            lambda stubber: stubber.add_client_error(
+                'describe_stacks', 'ValidationError',
+                'Stack with id distmono-none does not exist'),
+        ]
+
+        class StubbedClient:
+            def __init__(self, service):
+                self.client_context = create_client(service)
+
+            async def __aenter__(self):
+                client = await self.client_context.__aenter__()
+                stubber = Stubber(client)
+                stubs.pop(0)(stubber)
+                stubber.activate()
+                return client
+
+            async def __aexit__(self, *exc_info):
+                return await self.client_context.__aexit__(*exc_info)
+
+        monkeypatch.setattr(boto, 'client', StubbedClient)
+
+        outputs = asyncio.run(boto.get_stack_outputs('distmono-test'))
+        assert outputs == {'Url': 'https://test'}
+
+        with pytest.raises(StackDoesNotExistError):
+            asyncio.run(boto.get_stack_outputs('distmono-none'))
+
+
+class TestStream:
+    def test_prefix(self, tmp_path, capsys):
+        log_file = tmp_path / 'log'
+        res = sh.stream(['sh', '-c', 'echo out; echo err >&2'],
+                        prefix='target', log_file=log_file)
+        assert res.returncode == 0
+        out = capsys.readouterr().out
+        assert "[target] $ sh -c \"echo out; echo err >&2\"\n" in out
+        assert '[target] out\n' in out
+        assert '[target] err\n' in out
+        assert log_file.read_text() == 'out\nerr\n'
+
+    def test_check(self):
+        with pytest.raises(CalledProcessError):
+            sh.stream(['ls', '--invalid-option'])
+
+        assert sh.stream(['ls', '--invalid-option'], check=False).returncode != 0
+
+    def test_timeout(self, tmp_path):
+        started = time.monotonic()
+
+        with pytest.raises(TimeoutExpired):
+            sh.stream(['sleep', '10'], timeout=0.2)
+
+        assert time.monotonic() - started < 5
+
+    def test_cancel(self):
+        async def run():
+            task = asyncio.ensure_future(sh.run_async(['sleep', '10']))
+            await asyncio.sleep(0.2)
+            task.cancel()
+
+            with pytest.raises(asyncio.CancelledError):
+                await task
+
+        started = time.monotonic()
+        asyncio.run(run())
+        assert time.monotonic() - started < 5
+
+    def test_cancel_token(self):
+        token = CancelToken()
+        threading.Timer(0.2, token.cancel).start()
+        started = time.monotonic()
+
+        with pytest.raises(DeploymentCancelledError):
+            sh.stream(['sleep', '10'], cancel=token)
+
+        assert time.monotonic() - started < 5
+
+        with pytest.raises(DeploymentTimeoutError):
+            sh.stream(['sleep', '10'], cancel=CancelToken(0.2))
+
+    def test_concurrent(self):
+        async def run():
+            return await asyncio.gather(*[
+                sh.run_async(['sleep', '0.5'], prefix=str(i)) for i in range(4)
+            ])
+
+        started = time.monotonic()
+        results = asyncio.run(run())
+        assert [r.returncode for r in results] == [0, 0, 0, 0]
+        assert time.monotonic() - started < 1.5
+
+
+class TestHash:
+    @pytest.mark.parametrize('size', [0, 100, 3 * 1024 * 1024 + 7])
+    def test_hash_file(self, tmp_path, size):
+        file = tmp_path / 'file'
+        data = os.urandom(size)
+        file.write_bytes(data)
+        assert hash_file(file) == hashlib.sha256(data).hexdigest()
+        assert hash_file(file, 'md5') == hashlib.md5(data).hexdigest()
+
+    def test_update_hash(self, tmp_path):
+        (tmp_path / 'a').write_bytes(b'a' * 10)
+        (tmp_path / 'b').write_bytes(b'b' * 10)
+        h = hashlib.sha256()
+        update_hash(h, tmp_path / 'a', chunk_size=3)
+        update_hash(h, tmp_path / 'b', chunk_size=3)
+        assert h.hexdigest() == hashlib.sha256(b'a' * 10 + b'b' * 10).hexdigest()
+
+    def test_fast(self, tmp_path):
+        file = tmp_path / 'file'
+        file.write_bytes(b'data')
+        h = new_hash('fast')
+        h.update(b'data')
+        assert hash_file(file, 'fast') == h.hexdigest()
+        assert hash_file(file, 'fast') != hash_file(file)
+
+    def test_hash_files(self, tmp_path):
+        files = []
+
+        for i in range(10):
+            file = tmp_path / f'{i}.txt'
+            file.write_text(str(i))
+            files.append(file)
+
+        assert hash_files(files, max_workers=4) == {f: hash_file(f) for f in files}
+
+    def test_hash_tree(self, tmp_path):
+        (tmp_path / 'src').mkdir()
+        (tmp_path / 'src' / 'a.py').write_text('a')
+        digest = hash_tree(tmp_path)
+        assert hash_tree(tmp_path) == digest
+        (tmp_path / 'src' / '__pycache__').mkdir()
+        (tmp_path / 'src' / '__pycache__' / 'a.cpython-311.pyc').write_bytes(b'pyc')
+        assert hash_tree(tmp_path) == digest
+        (tmp_path / 'src' / 'a.py').rename(tmp_path / 'src' / 'b.py')
+        assert hash_tree(tmp_path) != digest
@@ -1,19 +1,34 @@
 from botocore.config import Config as BotoConfig
-from botocore.exceptions import ClientError
+from botocore.credentials import CredentialProvider
+from botocore.exceptions import ClientError, UnknownCredentialError
 from cached_property import cached_property
-from distmono.exceptions import StackDoesNotExistError
+from distmono.exceptions import (
+    ConfigError,
+    DeploymentCancelledError,
+    S3DeleteError,
+    StackDoesNotExistError,
+)
 from pathlib import PosixPath
 from pprint import pformat
+import asyncio
 import attr
 import boto3
+import fcntl
+import hashlib
+import mmap
 import re
+import signal
 import sys
 import shlex
 import subprocess
+import threading
 import os
 
 
 class Shell:
+    def __init__(self):
+        self.print_lock = threading.Lock()
+
     def cmdlist(self, cmd):
         if not cmd:
             raise ValueError('cmd cannot be empty')
@@ -50,6 +65,117 @@ class Shell:
 
         return subprocess.run(cmd, **kwargs)
 
+    def stream(self, cmd, **kwargs):
+        '''
+        Blocking version of run_async().
+        '''
+        return asyncio.run(self.run_async(cmd, **kwargs))
+
+    async def run_async(self, cmd, *, prefix=None, log_file=None, timeout=None,
+                        cancel=None, check=True, print_cmd=True, kill_grace=10,
+                        **kwargs):
+        '''
+        Run command without blocking the event loop, stdout and stderr are
+        printed line by line with prefix and appended to log_file. The child
+        is killed on timeout (subprocess.TimeoutExpired is raised), when the
+        task is cancelled or when cancel token is cancelled (its error is
+        raised).
+        '''
+        cmd = self.cmdlist(cmd)
+        line_prefix = f'[{prefix}] ' if prefix else ''
+
+        if print_cmd:
+            self.print(f'{line_prefix}$ {subprocess.list2cmdline(cmd)}')
+
+        proc = await asyncio.create_subprocess_exec(
+            *cmd,
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            start_new_session=True,
+            **kwargs)
+        log = open(log_file, 'a', encoding='utf8') if log_file else None
+
+        async def pipe_lines():
+            async for line in proc.stdout:
+                line = line.decode(self.encoding, errors='replace').rstrip('\n')
+                self.print(f'{line_prefix}{line}')
+
+                if log:
+                    log.write(line + '\n')
+
+            return await proc.wait()
+
+        try:
+            returncode = await asyncio.wait_for(self.watch_cancel(pipe_lines(), cancel),
+                                                timeout)
+        except asyncio.TimeoutError:
+            await self.kill_process(proc, kill_grace)
+            self.print(f'{line_prefix}Killed after {timeout}s', error=True)
+            raise subprocess.TimeoutExpired(cmd, timeout)
+        except asyncio.CancelledError:
+            await self.kill_process(proc, kill_grace)
+            raise
+        except DeploymentCancelledError as e:
+            await self.kill_process(proc, kill_grace)
+            self.print(f'{line_prefix}Killed: {e}', error=True)
+            raise
+        finally:
+            if log:
+                log.close()
+
+        if check and returncode:
+            raise subprocess.CalledProcessError(returncode, cmd)
+
+        return subprocess.CompletedProcess(cmd, returncode)
+
+    async def watch_cancel(self, aw, cancel, *, interval=0.2):
+        '''
+        Await aw, cancel it and raise error of cancel token once the token is
+        cancelled.
+        '''
+        if not cancel:
+            return await aw
+
+        task = asyncio.ensure_future(aw)
+
+        try:
+            while True:
+                done, _ = await asyncio.wait({task}, timeout=interval)
+
+                if done:
+                    return task.result()
+
+                error = cancel.get_error()
+
+                if error:
+                    task.cancel()
+                    await asyncio.wait({task})
+                    raise error
+        except asyncio.CancelledError:
+            task.cancel()
+            raise
+
+    async def kill_process(self, proc, grace):
+        '''
+        Terminate the process group of proc, kill it if still alive after
+        grace seconds.
+        '''
+        if proc.returncode is not None:
+            return
+
+        for sig in (signal.SIGTERM, signal.SIGKILL):
+            try:
+                os.killpg(proc.pid, sig)
+            except ProcessLookupError:
+                return
+
+            try:
+                await asyncio.wait_for(asyncio.shield(proc.wait()), grace)
+                return
+            except asyncio.TimeoutError:
+                pass
+
     @property
     def encoding(self):
         return sys.stdout.encoding or 'utf8'
@@ -67,7 +193,8 @@ class Shell:
         if error:
             kwargs['file'] = sys.stderr
 
-        print(str(msg), **kwargs)
+        with self.print_lock:
+            print(str(msg), **kwargs)
 
     def pprint(self, obj, **kwargs):
         self.print(pformat(obj), **kwargs)
@@ -95,6 +222,64 @@ class Shell:
 
         return ChdirContext()
 
+    def lock(self, lock_file, *, name=None):
+        '''
+        Exclusive inter-process lock on lock_file, released on exit.
+        '''
+        from contextlib import contextmanager
+
+        lock_file = PosixPath(lock_file)
+        name = name or str(lock_file)
+
+        @contextmanager
+        def lock_context():
+            lock_file.parent.mkdir(parents=True, exist_ok=True)
+
+            with open(lock_file, 'a') as f:
+                try:
+                    fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    self.print(f'Waiting for lock on {name}')
+                    fcntl.flock(f, fcntl.LOCK_EX)
+
+                try:
+                    yield lock_file
+                finally:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+
+        return lock_context()
+
+    def snapshot_files(self, paths):
+        '''
+        Modification time and size of files under paths, by path.
+        '''
+        snapshot = {}
+
+        def add(file):
+            try:
+                st = file.stat()
+            except FileNotFoundError:
+                return
+
+            snapshot[file] = (st.st_mtime_ns, st.st_size)
+
+        for path in paths:
+            path = PosixPath(path)
+
+            if path.is_dir():
+                for file in walk_files(path):
+                    add(file)
+            else:
+                add(path)
+
+        return snapshot
+
+    def diff_snapshots(self, old, new):
+        '''
+        Files added, removed or modified between two snapshots.
+        '''
+        return {f for f in old.keys() | new.keys() if old.get(f) != new.get(f)}
+
     def temp_dir(self, *, memory=False, prefix=None, suffix=None):
         import shutil
         import tempfile
@@ -136,24 +321,261 @@ class Shell:
 sh = Shell()
 
 
+HASH_CHUNK_SIZE = 1024 * 1024
+
+try:
+    import xxhash
+except ImportError:  # optional
+    xxhash = None
+
+
+def new_hash(algorithm='sha256'):
+    '''
+    Create hash object, 'fast' is a non-cryptographic hash for change
+    detection (xxh3 if xxhash is installed, else 128-bit BLAKE2b).
+    '''
+    if algorithm == 'fast':
+        if xxhash:
+            return xxhash.xxh3_128()
+
+        return hashlib.blake2b(digest_size=16)
+
+    return hashlib.new(algorithm)
+
+
+def update_hash(h, file, *, chunk_size=HASH_CHUNK_SIZE):
+    '''
+    Feed content of file to hash object h, memory mapped in chunks so that
+    large files are not read into memory.
+    '''
+    with open(file, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+
+        if size <= chunk_size:
+            h.update(f.read())
+            return h
+
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+            view = memoryview(m)
+
+            try:
+                for offset in range(0, size, chunk_size):
+                    h.update(view[offset:offset + chunk_size])
+            finally:
+                view.release()
+
+    return h
+
+
+def hash_file(file, algorithm='sha256'):
+    return update_hash(new_hash(algorithm), file).hexdigest()
+
+
+def hash_files(files, algorithm='sha256', *, max_workers=None):
+    '''
+    Hash files in parallel threads (hashing releases the GIL), return hex
+    digests by file.
+    '''
+    from concurrent.futures import ThreadPoolExecutor
+
+    files = list(files)
+
+    with ThreadPoolExecutor(max_workers) as executor:
+        digests = executor.map(lambda f: hash_file(f, algorithm), files)
+        return dict(zip(files, digests))
+
+
+def walk_files(root_dir):
+    '''
+    Files under root_dir in sorted order, directory by directory, without
+    Python bytecode caches, which change by just running the code.
+    '''
+    for dirpath, dirnames, filenames in os.walk(root_dir):
+        dirnames[:] = sorted(d for d in dirnames if d != '__pycache__')
+
+        for filename in sorted(filenames):
+            yield PosixPath(dirpath) / filename
+
+
+def hash_tree(root_dir, algorithm='fast', *, max_workers=None):
+    '''
+    Hash of names and content of all files under root_dir.
+    '''
+    root_dir = PosixPath(root_dir)
+    files = sorted(walk_files(root_dir))
+    digests = hash_files(files, algorithm, max_workers=max_workers)
+    h = new_hash(algorithm)
+
+    for file in files:
+        h.update(str(file.relative_to(root_dir)).encode('utf8') + b'\0')
+        h.update(digests[file].encode('ascii') + b'\n')
+
+    return h.hexdigest()
+
+
 @attr.s(kw_only=True)
-class BotoHelper:
+class BaseBotoHelper:
+    '''
+    Settings and response helpers shared by BotoHelper and AsyncBotoHelper.
+    '''
     region = attr.ib()
+    max_pool_connections = attr.ib(default=10)
+    retry_mode = attr.ib(default=None)  # 'legacy', 'standard' or 'adaptive'
+    max_attempts = attr.ib(default=None)
+    profile = attr.ib(default=None)
+    role_arn = attr.ib(default=None)  # role to assume with profile credentials
+    credential_cache_dir = attr.ib(default=None)
+
+    @classmethod
+    def from_context(cls, context, **kwargs):
+        return cls.from_env(context.env, **kwargs)
 
     @classmethod
-    def from_context(cls, context):
-        return cls(region=context.env['region'])
+    def from_env(cls, env, **kwargs):
+        for name in ('profile', 'role_arn'):
+            if env.get(name):
+                kwargs.setdefault(name, env[name])
+
+        kwargs.setdefault('region', env['region'])
+        return cls(**kwargs)
+
+    def get_credential_cache_dir(self):
+        if self.credential_cache_dir:
+            return PosixPath(self.credential_cache_dir)
+
+        cache_home = os.environ.get('XDG_CACHE_HOME') or PosixPath.home() / '.cache'
+        return PosixPath(cache_home) / 'distmono' / 'credentials'
+
+    def get_config(self):
+        retries = {}
+
+        if self.retry_mode:
+            retries['mode'] = self.retry_mode
+
+        if self.max_attempts:
+            retries['max_attempts'] = self.max_attempts
+
+        kwargs = {
+            'region_name': self.region,
+            'max_pool_connections': self.max_pool_connections,
+        }
+
+        if retries:
+            kwargs['retries'] = retries
+
+        return BotoConfig(**kwargs)
+
+    def get_last_updated(self, stack):
+        return str(stack.get('LastUpdatedTime') or stack['CreationTime'])
+
+    def get_tags(self, stack):
+        return {t['Key']: t['Value'] for t in stack.get('Tags', [])}
+
+    def get_outputs(self, stack):
+        outputs = stack.get('Outputs', [])
+        return {o['OutputKey']: o['OutputValue'] for o in outputs}
+
+
+class AssumeRoleArnProvider(CredentialProvider):
+    '''
+    Credentials of role_arn, assumed with credentials of source_session and
+    cached in cache.
+    '''
+    METHOD = 'assume-role-arn'
+
+    def __init__(self, *, source_session, role_arn, cache):
+        self.source_session = source_session
+        self.role_arn = role_arn
+        self.cache = cache
+
+    def load(self):
+        from botocore.credentials import (
+            AssumeRoleCredentialFetcher,
+            DeferredRefreshableCredentials,
+        )
+
+        fetcher = AssumeRoleCredentialFetcher(
+            client_creator=self.source_session.create_client,
+            source_credentials=self.source_session.get_credentials(),
+            role_arn=self.role_arn,
+            extra_args={'RoleSessionName': 'distmono'},
+            cache=self.cache,
+        )
+        return DeferredRefreshableCredentials(
+            method='assume-role',
+            refresh_using=fetcher.fetch_credentials,
+        )
+
+
+@attr.s(kw_only=True)
+class BotoHelper(BaseBotoHelper):
+    # Sessions shared by all helpers in the process, by (profile, role, region)
+    sessions = {}
+    sessions_lock = threading.RLock()
 
     def client(self, service):
-        return boto3.client(service, config=self.get_config())
+        # Sessions aren't thread safe
+        with self.sessions_lock:
+            return self.session.client(service, config=self.get_config())
 
     def resource(self, service):
-        return boto3.resource(service, config=self.get_config())
+        with self.sessions_lock:
+            return self.session.resource(service, config=self.get_config())
 
-    def get_config(self):
-        return BotoConfig(region_name=self.region)
+    @property
+    def session(self):
+        key = (self.profile, self.role_arn, self.region)
+
+        with self.sessions_lock:
+            session = self.sessions.get(key)
+
+            if not session:
+                session = self.create_session()
+                self.sessions[key] = session
+
+            return session
+
+    def create_session(self):
+        '''
+        Session whose assumed role, web identity and SSO credentials are
+        cached in the credential cache directory, so that later runs reuse
+        them until they expire.
+        '''
+        from botocore.credentials import JSONFileCache
+
+        cache = JSONFileCache(str(self.get_credential_cache_dir()))
+        session = self.create_botocore_session(cache)
+
+        if self.role_arn:
+            # Credentials of the profile assume the role
+            provider = AssumeRoleArnProvider(
+                source_session=self.create_botocore_session(cache),
+                role_arn=self.role_arn,
+                cache=cache,
+            )
+            resolver = session.get_component('credential_provider')
+            resolver.insert_before('env', provider)
+
+        return boto3.Session(botocore_session=session, region_name=self.region)
+
+    def create_botocore_session(self, cache):
+        import botocore.session
+
+        session = botocore.session.Session(profile=self.profile)
+        resolver = session.get_component('credential_provider')
+
+        for method in ('assume-role', 'assume-role-with-web-identity', 'sso'):
+            try:
+                resolver.get_provider(method).cache = cache
+            except UnknownCredentialError:
+                pass
+
+        return session
 
     def get_stack_outputs(self, stack_name):
+        return self.get_outputs(self.describe_stack(stack_name))
+
+    def describe_stack(self, stack_name):
         try:
             resp = self.cloudform.describe_stacks(StackName=stack_name)
         except ClientError as e:
@@ -163,9 +585,155 @@ class BotoHelper:
 
             raise
 
-        outputs = resp['Stacks'][0].get('Outputs', [])
-        return {o['OutputKey']: o['OutputValue'] for o in outputs}
+        return resp['Stacks'][0]
+
+    def describe_stacks(self):
+        '''
+        Iterate through all stacks in the region, 100 per call.
+        '''
+        paginator = self.cloudform.get_paginator('describe_stacks')
+
+        for page in paginator.paginate():
+            yield from page['Stacks']
 
     @cached_property
     def cloudform(self):
         return self.client('cloudformation')
+
+    def empty_bucket(self, bucket, *, prefix=None, max_workers=8):
+        '''
+        Delete all objects in bucket, or only those with key prefix, with
+        all their versions and delete markers. Return number of keys deleted.
+        '''
+        return self.delete_object_versions(bucket, prefix=prefix, max_workers=max_workers)
+
+    def delete_object_versions(self, bucket, *, prefix=None, select=None, max_workers=8,
+                               versions=True):
+        '''
+        Delete object versions and delete markers in bucket, those with key
+        prefix and for which select(item) is true if given. Batches of 1000
+        keys are deleted in max_workers threads while listing goes on.
+        Return number of keys deleted.
+
+        Without versions, only latest versions of objects are deleted,
+        versioned buckets then keep them as noncurrent versions.
+        '''
+        from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+        s3 = self.client('s3')
+        running = set()
+        deleted = 0
+        batches = self.list_object_batches(s3, bucket, prefix=prefix, select=select,
+                                           versions=versions)
+
+        with ThreadPoolExecutor(max_workers) as executor:
+            for batch in batches:
+                if len(running) >= max_workers * 2:
+                    done, running = wait(running, return_when=FIRST_COMPLETED)
+                    deleted += sum(f.result() for f in done)
+
+                running.add(executor.submit(self.delete_objects, s3, bucket, batch))
+
+            deleted += sum(f.result() for f in running)
+
+        return deleted
+
+    def list_object_batches(self, s3, bucket, *, prefix=None, select=None, batch_size=1000,
+                            versions=True):
+        '''
+        Iterate through lists of {'Key', 'VersionId'} of object versions and
+        delete markers (those select(item) is true for), up to batch_size
+        each. Without versions, lists of {'Key'} of objects instead.
+        '''
+        if versions:
+            paginator = s3.get_paginator('list_object_versions')
+        else:
+            paginator = s3.get_paginator('list_objects_v2')
+
+        kwargs = {'Bucket': bucket}
+
+        if prefix:
+            kwargs['Prefix'] = prefix
+
+        batch = []
+
+        for page in paginator.paginate(**kwargs):
+            if versions:
+                items = page.get('Versions', []) + page.get('DeleteMarkers', [])
+            else:
+                items = page.get('Contents', [])
+
+            for item in items:
+                if select and not select(item):
+                    continue
+
+                if versions:
+                    batch.append({'Key': item['Key'], 'VersionId': item['VersionId']})
+                else:
+                    batch.append({'Key': item['Key']})
+
+                if len(batch) == batch_size:
+                    yield batch
+                    batch = []
+
+        if batch:
+            yield batch
+
+    def delete_objects(self, s3, bucket, objects):
+        resp = s3.delete_objects(Bucket=bucket, Delete={'Objects': objects, 'Quiet': True})
+        errors = resp.get('Errors', [])
+
+        if errors:
+            e = errors[0]
+            msg = (f'Unable to delete {len(errors)} objects from {bucket},'
+                   f' {e["Key"]}: {e["Code"]} {e["Message"]}')
+            raise S3DeleteError(msg)
+
+        return len(objects)
+
+
+@attr.s(kw_only=True)
+class AsyncBotoHelper(BaseBotoHelper):
+    '''
+    BotoHelper for asyncio, clients are async context managers:
+
+        async with boto.client('s3') as s3:
+            await s3.list_buckets()
+
+    Requires aiobotocore. Adaptive retry mode adds client side rate limiting,
+    which keeps many concurrent calls from being throttled.
+    '''
+    max_pool_connections = attr.ib(default=50)
+    retry_mode = attr.ib(default='adaptive')
+
+    @cached_property
+    def session(self):
+        if self.role_arn:
+            raise ConfigError('AsyncBotoHelper does not support role_arn, use BotoHelper')
+
+        try:
+            from aiobotocore.session import get_session
+        except ImportError as e:
+            raise ImportError('AsyncBotoHelper requires aiobotocore, please install it') from e
+
+        session = get_session()
+
+        if self.profile:
+            session.set_config_variable('profile', self.profile)
+
+        return session
+
+    def client(self, service):
+        return self.session.create_client(service, config=self.get_config())
+
+    async def get_stack_outputs(self, stack_name):
+        async with self.client('cloudformation') as cloudform:
+            try:
+                resp = await cloudform.describe_stacks(StackName=stack_name)
+            except ClientError as e:
+                if re.match(r'.*Stack .* does not exist.*', str(e)):
+                    raise StackDoesNotExistError(str(e))
+
+                raise
+
+        return self.get_outputs(resp['Stacks'][0])
@@ -2,8 +2,11 @@ from distmono import (
     Project,
     Deployable,
     Stack,
+    StackDoesNotExistError,
 )
-from distmono.util import BotoHelper, sh
+from distmono.loadtest import FunctionLoadTest, HttpLoadTest
+from distmono.packaging import packager, Vendor
+from distmono.util import BotoHelper, hash_tree, new_hash, sh
 from cached_property import cached_property
 from troposphere import (
     apigateway as apigw,
@@ -24,7 +27,6 @@ from os import path as osp
 from textwrap import indent
 import hashlib
 import json
-import shutil
 import urllib.request
 
 
@@ -44,6 +46,8 @@ class ApiProject(Project):
 
             'call-api': CallApi,
             'invoke-function': InvokeFunction,
+            'load-test-api': LoadTestApi,
+            'load-test-function': LoadTestFunction,
             # 'test': SimpleTest,
             'test': Deployable,
         }
@@ -58,6 +62,8 @@ class ApiProject(Project):
 
             'call-api': 'api-stack',
             'invoke-function': 'function-stack',
+            'load-test-api': 'api-stack',
+            'load-test-function': 'function-stack',
             # 'test': 'buckets-stack',
             'test': ['invoke-function', 'call-api'],
         }
@@ -245,37 +251,49 @@ class FunctionStack(Stack):
 
 # TODO: this is reusable, move into distmono and unit test
 class Code(Deployable):
+    resources = {'cpu': 1}
+    parallel_safe = True
+
     @cached_property
     def code_base_dir(self):
         return Path(__file__).parent / 'api-code'
 
     def build(self):
-        zip_file = Path('code.zip')
-        self.zip(zip_file.stem)
-        zip_hash = self.file_sha256(zip_file)
-        sh.print("TODO: don't upload if already uploaded")
+        zip_file = self.out_zip_file
+        zip_hash = self.zip(zip_file)
         self.upload_zip_file(zip_file, zip_hash)
-        zip_file.replace(self.out_zip_file)
-        self.out_zip_hash_file.write_text(zip_hash)
+        self.save_output(zip_hash=zip_hash, build_hash=self.get_build_hash())
 
-    def zip(self, stem):
+    def zip(self, zip_file):
+        '''
+        Create zip_file in a packaging worker process, return its SHA-256.
+        '''
         raise NotImplementedError
 
-    def file_sha256(self, file):
-        file = Path(file)
-        h = hashlib.sha256()
-        h.update(file.read_bytes())
-        return h.hexdigest()
-
     def upload_zip_file(self, zip_file, zip_hash):
         key = self.get_s3_zip_key(zip_hash)
         sh.print(f'Uploading {zip_file.name} to s3://{self.bucket_name}/{key}')
         self.s3.upload_file(str(zip_file), self.bucket_name, key)
 
-    # TODO: implement is_build_outdated()
+    def is_build_outdated(self):
+        return self.load_output('build_hash') != self.get_build_hash()
+
+    @cached_property
+    def build_hash(self):
+        # Hashing sources is much faster than zipping them to compare
+        h = new_hash('fast')
+        h.update(self.bucket_name.encode('utf8') + b'\0')
+
+        for path in self.get_watch_paths():
+            h.update(hash_tree(path).encode('ascii') + b'\n')
+
+        return h.hexdigest()
+
+    def get_build_hash(self):
+        return self.build_hash
 
     def get_build_output(self):
-        zip_hash = self.out_zip_hash_file.read_text().strip()
+        zip_hash = self.require_output('zip_hash')
         return {
             'Bucket': self.bucket_name,
             'Key': self.get_s3_zip_key(zip_hash),
@@ -294,37 +312,66 @@ class Code(Deployable):
         return self.context.input['buckets-stack']['CodeBucketName']
 
     def get_s3_zip_key(self, zip_hash):
-        return f'{zip_hash[32:]}.zip'
+        return f'{self.s3_prefix}/{zip_hash[32:]}.zip'
+
+    def get_artifact_prefixes(self):
+        return [(self.bucket_name, f'{self.s3_prefix}/')]
+
+    @property
+    def s3_prefix(self):
+        # Function and layer code share the bucket
+        return self.context.target
 
     @cached_property
     def out_zip_file(self):
         return self.context.build_output_dir / 'code.zip'
 
-    @cached_property
-    def out_zip_hash_file(self):
-        zip_file = self.out_zip_file
-        return zip_file.parent / (zip_file.name + '.sha256')
-
     def destroy(self):
-        # XXX: if bucket is not cleared, it can't be deleted
-        sh.print(f'Clearing S3 bucket {self.bucket_name!r}')
-        s3 = self.boto.resource('s3')
-        bucket = s3.Bucket(self.bucket_name)
-        # TODO: should only delete function or layer code
-        bucket.objects.all().delete()
+        # Only code of this target, buckets-stack clears the rest
+        prefix = f'{self.s3_prefix}/'
+        sh.print(f'Clearing s3://{self.bucket_name}/{prefix}')
+        count = self.boto.empty_bucket(self.bucket_name, prefix=prefix)
+        sh.print(f'Deleted {count} objects')
 
 
 class FunctionCode(Code):
-    def zip(self, stem):
-        function_dir = self.code_base_dir / 'function'
-        shutil.make_archive(stem, 'zip', function_dir)
+    def zip(self, zip_file):
+        return packager.zip_dir(zip_file, self.function_dir)
+
+    def get_watch_paths(self):
+        return [self.function_dir]
+
+    @property
+    def function_dir(self):
+        return self.code_base_dir / 'function'
 
 
 class LayerCode(Code):
-    def zip(self, stem):
-        # TODO: move to build dir, download libraries from requirements etc
-        layer_dir = self.code_base_dir / 'layer'
-        shutil.make_archive(stem, 'zip', layer_dir, 'python')
+    def zip(self, zip_file):
+        vendored_dir = self.vendor.vendor(self.layer_dir / 'requirements.txt')
+        return packager.zip_dirs(zip_file, [
+            (self.layer_dir / 'python', 'python'),
+            (vendored_dir, 'python'),
+        ])
+
+    @cached_property
+    def vendor(self):
+        return Vendor(
+            cache_dir=self.context.project.temp_dir / 'cache',
+            pip_args=[
+                '--platform', 'manylinux2014_x86_64',
+                '--implementation', 'cp',
+                '--python-version', '3.7',
+                '--only-binary=:all:',
+            ],
+        )
+
+    def get_watch_paths(self):
+        return [self.layer_dir]
+
+    @property
+    def layer_dir(self):
+        return self.code_base_dir / 'layer'
 
 
 class BucketsStack(Stack):
@@ -355,6 +402,21 @@ class BucketsStack(Stack):
         t.add_output(Output(f'CodeBucketName', Value=Ref(bucket)))
         return bucket
 
+    def destroy(self):
+        # Bucket must be empty to be deleted, code targets only clear their
+        # prefixes and code used to be uploaded to the bucket root
+        try:
+            bucket_name = self.get_stack_outputs().get('CodeBucketName')
+        except StackDoesNotExistError:
+            bucket_name = None
+
+        if bucket_name:
+            sh.print(f'Clearing s3://{bucket_name}')
+            count = self.boto.empty_bucket(bucket_name)
+            sh.print(f'Deleted {count} objects')
+
+        super().destroy()
+
 
 class AccessStack(Stack):
     stack_code = 'access'
@@ -424,6 +486,8 @@ class AccessStack(Stack):
 
 
 class CallApi(Deployable):
+    parallel_safe = True
+
     def build(self):
         base_url = self.context.input['api-stack']['ApiUrl']
         status_url = osp.join(base_url, 'status')
@@ -434,6 +498,8 @@ class CallApi(Deployable):
 
 
 class InvokeFunction(Deployable):
+    parallel_safe = True
+
     def build(self):
         resp = self.lambd.invoke(FunctionName=self.function_name)
         sh.pprint(resp)
@@ -454,10 +520,29 @@ class InvokeFunction(Deployable):
         return self.context.input['function-stack']['FunctionName']
 
 
+class LoadTestApi(HttpLoadTest):
+    rps = 20
+    duration = 10
+    max_latency_ms = {'p95': 1000}
+    max_error_rate = 0.01
+
+    def get_url(self):
+        return osp.join(self.context.input['api-stack']['ApiUrl'], 'status')
+
+
+class LoadTestFunction(FunctionLoadTest):
+    concurrency = 5
+    duration = 10
+    max_error_rate = 0
+
+    def get_function_name(self):
+        return self.context.input['function-stack']['FunctionName']
+
+
 class SimpleTest(Deployable):
+    parallel_safe = True
+
     def build(self):
         bucket_name = self.context.input['buckets-stack']['CodeBucketName']
         sh.print(f'Clearing S3 bucket {bucket_name!r}')
-        s3 = BotoHelper.from_context(self.context).resource('s3')
-        bucket = s3.Bucket(bucket_name)
-        bucket.objects.all().delete()
+        BotoHelper.from_context(self.context).empty_bucket(bucket_name)